@@ -0,0 +1,155 @@
+"""
+Локальный классификатор «ответ написан ИИ» для анти-чит шага 1.
+
+Логистическая регрессия на хэшированных символьных n-граммах, обученная
+на answers с метками is_suspicious. Модель — вектор весов (.npy) и параметры
+(.json); загружается один раз при старте бота. Переобучение по базе:
+
+    DATABASE_URL=... python ai_text_classifier.py [путь к .npy]
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from ngram_lm import encode, hash_ngrams
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+class AITextClassifier:
+    """
+    Признаки — символьные n-граммы порядков 1..order, у каждого порядка своя
+    хэш-таблица на 2**bits весов; значения — log(1 + count), нормированные по L2.
+    predict_proba возвращает вероятность того, что ответ подозрительный.
+    """
+
+    def __init__(self, order: int = 4, bits: int = 16, weights: np.ndarray = None, bias: float = 0.0,
+                 metrics: dict = None):
+        self.order = order
+        self.bits = bits
+        size = 1 << bits
+        self.weights = weights if weights is not None else np.zeros(order * size, dtype=np.float32)
+        self.bias = bias
+        self.metrics = metrics or {}
+        self._offsets = (np.arange(order, dtype=np.int64) * size)[:, None]
+
+    def features(self, text: str):
+        """(индексы, значения) разреженного вектора признаков."""
+        codes = encode(text, self.order)
+        indexes = hash_ngrams(codes, self.order, self.bits)[:, self.order - 1:] + self._offsets
+        index, counts = np.unique(indexes.ravel(), return_counts=True)
+        values = np.log1p(counts)
+        return index, values / np.sqrt(values @ values)
+
+    def predict_proba(self, text: str) -> float:
+        index, values = self.features(text)
+        return float(_sigmoid(self.weights[index] @ values + self.bias))
+
+    # --------------------------
+    # Обучение
+    # --------------------------
+
+    def fit(self, texts, labels, epochs: int = 20, batch_size: int = 256, learning_rate: float = 20.0,
+            l2: float = 1e-6, seed: int = 0) -> "AITextClassifier":
+        """Мини-батчевый градиентный спуск по логистической функции потерь; классы взвешены поровну."""
+        rows = [self.features(t) for t in texts]
+        labels = np.asarray(labels, dtype=np.float64)
+        positives = labels.sum()
+        negatives = len(labels) - positives
+        if not positives or not negatives:
+            raise ValueError("Нужны примеры обоих классов")
+        sample_weight = np.where(labels == 1, len(labels) / (2 * positives), len(labels) / (2 * negatives))
+        weights = self.weights.astype(np.float64)
+        bias = self.bias
+        rng = np.random.default_rng(seed)
+
+        for epoch in range(epochs):
+            rate = learning_rate / np.sqrt(1 + epoch)
+            order = rng.permutation(len(rows))
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                index = np.concatenate([rows[i][0] for i in batch])
+                values = np.concatenate([rows[i][1] for i in batch])
+                owner = np.repeat(np.arange(len(batch)), [len(rows[i][0]) for i in batch])
+                z = np.bincount(owner, weights=weights[index] * values, minlength=len(batch)) + bias
+                error = (_sigmoid(z) - labels[batch]) * sample_weight[batch] / len(batch)
+                gradient = np.bincount(index, weights=error[owner] * values, minlength=len(weights))
+                weights -= rate * (gradient + l2 * weights)
+                bias -= rate * error.sum()
+
+        self.weights = weights.astype(np.float32)
+        self.bias = float(bias)
+        return self
+
+    # --------------------------
+    # Хранение
+    # --------------------------
+
+    def save(self, path: str):
+        path = Path(path)
+        np.save(path, self.weights)
+        meta = {"order": self.order, "bits": self.bits, "bias": self.bias, "metrics": self.metrics}
+        path.with_suffix(".json").write_text(json.dumps(meta, ensure_ascii=False, indent=2))
+
+    @classmethod
+    def load(cls, path: str) -> "AITextClassifier":
+        path = Path(path)
+        meta = json.loads(path.with_suffix(".json").read_text())
+        return cls(order=meta["order"], bits=meta["bits"], weights=np.load(path), bias=meta["bias"],
+                   metrics=meta.get("metrics"))
+
+
+def roc_auc(scores, labels) -> float:
+    """Площадь под ROC через ранги (вероятность, что положительный выше отрицательного)."""
+    scores = np.asarray(scores, dtype=np.float64)
+    labels = np.asarray(labels, dtype=bool)
+    positives, negatives = labels.sum(), (~labels).sum()
+    if not positives or not negatives:
+        return float("nan")
+    ranks = np.empty(len(scores))
+    ranks[np.argsort(scores, kind="mergesort")] = np.arange(1, len(scores) + 1)
+    return float((ranks[labels].sum() - positives * (positives + 1) / 2) / (positives * negatives))
+
+
+def train(rows, holdout: int = 5, min_per_class: int = 10, **fit_kwargs) -> AITextClassifier:
+    """rows — (id, answer, is_suspicious); каждый holdout-й ответ (по id) идёт в проверку."""
+    train_rows = [(a, bool(s)) for i, a, s in rows if i % holdout]
+    test_rows = [(a, bool(s)) for i, a, s in rows if not i % holdout]
+    positives = sum(label for _, label in train_rows)
+    if positives < min_per_class or len(train_rows) - positives < min_per_class:
+        raise ValueError(f"Мало размеченных ответов: {positives} подозрительных из {len(train_rows)}")
+
+    model = AITextClassifier().fit([a for a, _ in train_rows], [s for _, s in train_rows], **fit_kwargs)
+    if test_rows:
+        scores = [model.predict_proba(a) for a, _ in test_rows]
+        labels = [s for _, s in test_rows]
+        model.metrics = {"holdout": len(test_rows), "auc": roc_auc(scores, labels)}
+        logging.info(f"[AIClassifier] Отложенная выборка: {model.metrics}")
+    return model
+
+
+async def train_from_db(path: str):
+    import asyncpg
+
+    conn = await asyncpg.connect(os.getenv("DATABASE_URL"))
+    try:
+        rows = await conn.fetch(
+            "SELECT id, answer, is_suspicious FROM answers WHERE answer IS NOT NULL AND length(answer) >= 20"
+        )
+    finally:
+        await conn.close()
+    model = train([(r["id"], r["answer"], r["is_suspicious"]) for r in rows])
+    model.save(path)
+    print(f"Обучено на {len(rows)} ответах, {model.metrics}, файл: {path}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(train_from_db(sys.argv[1] if len(sys.argv) > 1 else "ai_classifier.npy"))
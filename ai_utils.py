@@ -1,49 +1,8 @@
-import openai
-import asyncio
 import logging
 
-openai.api_key = "FAKE-KEY"  # заменишь позже
-
-async def evaluate_answer(question: str, student_answer: str, student_name: str) -> str:
-    prompt = (
-        f"Вопрос: {question}\n"
-        f"Ответ студента: {student_answer}\n\n"
-        "Проанализируй ответ пользователя по следующей схеме. "
-        "Всего 5 критериев. Каждый оценивается от 0 до 0.2 баллов (шаг 0.05). "
-        "Если критерий 'Соответствие вопросу' равен 0.0 — остальные не учитываются, и итоговая оценка = 0.0. "
-        "Если он больше 0.0, оцени остальные 4 критерия.\n\n"
-        "Критерии:\n"
-        "• Соответствие вопросу\n"
-        "• Полнота\n"
-        "• Аргументация\n"
-        "• Структура\n"
-        "• Примеры\n\n"
-        "Ответ строго в формате:\n\n"
-        "Критерии:\n"
-        "• Соответствие вопросу: <балл>\n"
-        "• Полнота: <балл>\n"
-        "• Аргументация: <балл>\n"
-        "• Структура: <балл>\n"
-        "• Примеры: <балл>\n\n"
-        "Итог: <сумма баллов>\n"
-        "Feedback: <текстовая обратная связь для пользователя>\n\n"
-        "Поясни в Feedback, что именно не так (если есть недочёты), или похвали за хорошую работу (если всё ок)."
-    )
-    try:
-        response = await asyncio.to_thread(
-            openai.ChatCompletion.create,
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Ты строгий преподаватель."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=450,
-            temperature=0.3
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        logging.error(f"Ошибка оценки ответа: {e}")
-        return "❌ Ошибка оценки ответа."
+import llm_gateway
+from llm_scheduler import Priority
+from evaluation import evaluate_answer
 
 async def generate_question(grade: str, topic: str, name: str) -> str:
     """
@@ -85,9 +44,9 @@ async def generate_question(grade: str, topic: str, name: str) -> str:
         """.strip()
 
     try:
-        response = await asyncio.to_thread(
-            openai.ChatCompletion.create,
+        text = await llm_gateway.chat(
             model="gpt-3.5-turbo",
+            priority=Priority.GENERATION,
             messages=[
                 {
                     "role": "system",
@@ -102,7 +61,6 @@ async def generate_question(grade: str, topic: str, name: str) -> str:
             max_tokens=350,
             temperature=0.9
         )
-        text = response.choices[0].message.content.strip()
         return text[:800] if len(text) > 800 else text
 
     except Exception as e:
@@ -116,9 +74,9 @@ async def generate_correct_answer(question: str, grade: str) -> str:
         "Отвечай строго по делу, без оценочных комментариев, приветствий или лишних пояснений. Дай только эталонное решение."
     )
     try:
-        response = await asyncio.to_thread(
-            openai.ChatCompletion.create,
+        return await llm_gateway.chat(
             model="gpt-3.5-turbo",
+            priority=Priority.GENERATION,
             messages=[
                 {
                     "role": "system",
@@ -129,7 +87,6 @@ async def generate_correct_answer(question: str, grade: str) -> str:
             max_tokens=1000,
             temperature=0.3
         )
-        return response.choices[0].message.content.strip()
     except Exception as e:
         logging.error(f"Ошибка генерации эталонного ответа: {e}")
         return "❌ Ошибка генерации эталонного ответа."
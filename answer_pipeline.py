@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import time
+
+from metrics import metrics
+
+
+class PipelineResult:
+    def __init__(self):
+        self.rejected_by = None   # имя анти-чит стадии, отклонившей ответ
+        self.rejection = None     # текст обратной связи от этой стадии
+        self.evaluation = None    # сырой ответ evaluate_answer
+        self.timings = {}         # стадия -> секунды
+
+    @property
+    def rejected(self) -> bool:
+        return self.rejected_by is not None
+
+
+async def run_answer_pipeline(checks: dict, evaluate, label: str = "") -> PipelineResult:
+    """
+    Запускает анти-чит проверки и оценку ответа одновременно.
+
+    checks   — {имя: корутина-фабрика}, каждая возвращает None (ответ прошёл)
+               или текст обратной связи (ответ отклонён).
+    evaluate — корутина-фабрика оценки ответа.
+
+    Первый же отказ отменяет оценку и остальные проверки. Ошибка проверки
+    не блокирует ответ — как и раньше, такая стадия просто пропускается.
+    """
+    result = PipelineResult()
+    started = time.monotonic()
+
+    async def timed(name, factory):
+        t0 = time.monotonic()
+        try:
+            return await factory()
+        finally:
+            result.timings[name] = time.monotonic() - t0
+
+    check_tasks = {
+        asyncio.create_task(timed(name, factory)): name
+        for name, factory in checks.items()
+    }
+    eval_task = asyncio.create_task(timed("evaluate", evaluate))
+
+    try:
+        pending = set(check_tasks)
+        while pending and not result.rejected:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name = check_tasks[task]
+                if task.exception():
+                    logging.warning(f"[AntiCheat] {name} error: {task.exception()}")
+                    continue
+                verdict = task.result()
+                if verdict:
+                    result.rejected_by, result.rejection = name, verdict
+                    break
+
+        if result.rejected:
+            for task in (*pending, eval_task):
+                task.cancel()
+            await asyncio.gather(*pending, eval_task, return_exceptions=True)
+            metrics.inc(f"answer_rejected_{result.rejected_by}")
+        else:
+            result.evaluation = await eval_task
+    finally:
+        for task in (*check_tasks, eval_task):
+            if not task.done():
+                task.cancel()
+
+    result.timings["total"] = time.monotonic() - started
+    for name, seconds in result.timings.items():
+        metrics.observe(f"answer_stage_{name}_seconds", seconds)
+    stages = " ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in result.timings.items())
+    logging.info(f"[AnswerPipeline] {label} {stages}" + (f" rejected_by={result.rejected_by}" if result.rejected else ""))
+    return result
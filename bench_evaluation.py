@@ -0,0 +1,97 @@
+"""
+Сравнение старой (текстовый шаблон + regex) и новой (JSON) оценки ответа:
+токены на входе/выходе, задержка и доля ответов, которые удалось разобрать.
+
+    OPENAI_API_KEY=... python bench_evaluation.py [повторов]
+"""
+import asyncio
+import re
+import sys
+import time
+
+import llm_gateway
+from evaluation import EVALUATION_MODEL, EvaluationError, build_evaluation_messages, parse_evaluation
+
+SAMPLES = [
+    ("Как вы приоритизируете бэклог, если все задачи «срочные»?",
+     "Смотрю на влияние на ключевую метрику и трудозатраты, считаю RICE, обсуждаю с командой и стейкхолдерами."),
+    ("Retention упал на 10% за неделю. Ваши действия?",
+     "Проверю трекинг, разобью по когортам и платформам, посмотрю релизы недели, поговорю с поддержкой."),
+    ("Что такое MVP и зачем он нужен?", "Это минимальный продукт."),
+]
+
+# Промпт, который использовался до перехода на JSON (для сравнения)
+LEGACY_PROMPT = (
+    "Вопрос: {question}\n"
+    "Ответ студента: {answer}\n\n"
+    "Проанализируй ответ пользователя по следующей схеме. "
+    "Всего 5 критериев. Каждый оценивается от 0 до 0.2 баллов (шаг 0.05). "
+    "Если критерий 'Соответствие вопросу' равен 0.0 — остальные не учитываются, и итоговая оценка = 0.0. "
+    "Если он больше 0.0, оцени остальные 4 критерия.\n\n"
+    "Критерии:\n• Соответствие вопросу\n• Полнота\n• Аргументация\n• Структура\n• Примеры\n\n"
+    "Ответ строго в формате:\n\n"
+    "Критерии:\n• Соответствие вопросу: <балл>\n• Полнота: <балл>\n• Аргументация: <балл>\n"
+    "• Структура: <балл>\n• Примеры: <балл>\n\n"
+    "Итог: <сумма баллов>\n"
+    "Feedback: <текстовая обратная связь для пользователя>\n\n"
+    "Поясни в Feedback, что именно не так (если есть недочёты), или похвали за хорошую работу (если всё ок)."
+)
+LEGACY_PATTERN = re.compile(r"Критерии:\s*(.*?)Итог:\s*([\d.]+)\s*Feedback:\s*(.*)", re.DOTALL)
+
+
+async def call(messages, **kwargs):
+    started = time.perf_counter()
+    response = await llm_gateway.get_client().chat.completions.create(
+        model=EVALUATION_MODEL, messages=messages, temperature=0.3, **kwargs
+    )
+    return response, time.perf_counter() - started
+
+
+def legacy_ok(content: str) -> bool:
+    return bool(LEGACY_PATTERN.search(content or ""))
+
+
+def json_ok(content: str) -> bool:
+    try:
+        parse_evaluation(content)
+        return True
+    except EvaluationError:
+        return False
+
+
+async def run_variant(name, build, parse_ok, repeats, **kwargs):
+    prompt_tokens = completion_tokens = latency = parsed = 0
+    runs = 0
+    for _ in range(repeats):
+        for question, answer in SAMPLES:
+            response, elapsed = await call(build(question, answer), **kwargs)
+            prompt_tokens += response.usage.prompt_tokens
+            completion_tokens += response.usage.completion_tokens
+            latency += elapsed
+            parsed += parse_ok(response.choices[0].message.content)
+            runs += 1
+    print(f"{name:8}: вход {prompt_tokens / runs:6.0f} ток., выход {completion_tokens / runs:6.0f} ток., "
+          f"{latency / runs * 1000:6.0f} мс, разобрано {parsed}/{runs}")
+    return completion_tokens / runs, latency / runs
+
+
+async def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    legacy = await run_variant(
+        "legacy",
+        lambda q, a: [{"role": "system", "content": "Ты строгий преподаватель. Не здоровайся, сразу давай оценку без лишних слов."},
+                      {"role": "user", "content": LEGACY_PROMPT.format(question=q, answer=a)}],
+        legacy_ok, repeats, max_tokens=450,
+    )
+    new = await run_variant(
+        "json",
+        build_evaluation_messages,
+        json_ok, repeats, max_tokens=300, response_format={"type": "json_object"},
+    )
+    print(f"Выходные токены: {100 * (1 - new[0] / legacy[0]):+.0f}% экономии, "
+          f"задержка: {100 * (1 - new[1] / legacy[1]):+.0f}% быстрее")
+    await llm_gateway.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
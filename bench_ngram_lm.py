@@ -0,0 +1,35 @@
+"""
+Бенчмарк анти-чит шага PERPLEXITY: время оценки ответа локальной n-gram
+моделью (раньше — сетевой запрос к completions API).
+
+    python bench_ngram_lm.py [путь к модели]
+"""
+import random
+import sys
+import timeit
+
+from ngram_lm import NgramLM
+
+ROUNDS = 2000
+ANSWER = (
+    "Сначала проверю, не сломан ли трекинг. Затем разобью падение retention по когортам, "
+    "платформам и источникам трафика, посмотрю релизы за неделю и поговорю с поддержкой. "
+    "По итогам сформулирую гипотезы и проверю самую вероятную A/B тестом."
+)
+
+
+def synthetic_model() -> NgramLM:
+    rng = random.Random(1)
+    words = ANSWER.lower().split()
+    return NgramLM().fit(" ".join(rng.choice(words) for _ in range(60)) for _ in range(2000))
+
+
+def main():
+    model = NgramLM.load(sys.argv[1]) if len(sys.argv) > 1 else synthetic_model()
+    seconds = timeit.timeit(lambda: model.mean_surprisal(ANSWER), number=ROUNDS) / ROUNDS
+    print(f"Ответ {len(ANSWER)} символов: {seconds * 1e6:.0f} мкс на ответ, "
+          f"{seconds * 1e6 / (len(ANSWER) + 1):.2f} мкс на символ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Бенчмарк анти-чит шага GPT_PHRASES: старый поиск (regex-альтернатива,
+компилируемая на каждый вызов) против автомата PhraseMatcher на словарях
+от десятков до тысяч фраз.
+
+    python bench_phrase_matcher.py
+"""
+import random
+import re
+import timeit
+
+from phrase_matcher import PhraseMatcher
+
+ROUNDS = 200
+ANSWER = (
+    "Сначала проверю, не сломан ли трекинг. Затем разобью падение retention по когортам, "
+    "платформам и источникам трафика, посмотрю релизы за неделю и поговорю с поддержкой. "
+    "По итогам сформулирую гипотезы и проверю самую вероятную A/B тестом. "
+) * 3
+
+
+def make_phrases(n: int, seed: int = 1) -> list:
+    rng = random.Random(seed)
+    letters = "абвгдежзиклмнопрстуфхцчшэюя"
+    words = ["".join(rng.choice(letters) for _ in range(rng.randint(4, 10))) for _ in range(3000)]
+    return [" ".join(rng.sample(words, rng.randint(2, 5))) for _ in range(n)]
+
+
+def old_detect(phrases, text):
+    # Как было: альтернатива собирается и компилируется на каждый вызов
+    # (кэш re на 512 шаблонов не спасает при смене словаря и переполнении)
+    re.purge()
+    return bool(re.compile("|".join(map(re.escape, phrases)), re.IGNORECASE).search(text))
+
+
+def main():
+    print(f"{'фраз':>6} | {'regex на вызов, мкс':>20} | {'автомат, мкс':>12} | {'сборка автомата, мс':>20}")
+    for n in (10, 100, 1000, 5000):
+        phrases = make_phrases(n)
+        built = timeit.timeit(lambda: PhraseMatcher(phrases), number=3) / 3
+        matcher = PhraseMatcher(phrases)
+        old = timeit.timeit(lambda: old_detect(phrases, ANSWER), number=ROUNDS) / ROUNDS
+        new = timeit.timeit(lambda: matcher.find(ANSWER), number=ROUNDS) / ROUNDS
+        print(f"{n:>6} | {old * 1e6:>20.0f} | {new * 1e6:>12.0f} | {built * 1e3:>20.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Бенчмарк анти-чит шага EMBEDDING-SIMILARITY: сколько времени event loop
+тратит на косинус на один ответ.
+
+    python bench_similarity.py
+"""
+import math
+import random
+import timeit
+
+from similarity import to_unit_vector, cosine_similarity
+
+DIM = 1536
+ROUNDS = 2000
+
+
+def old_cosine(v1, v2):
+    # Старая реализация: питоновские списки, три прохода по 1536 элементам
+    dot = sum(a*b for a, b in zip(v1, v2))
+    norm1 = math.sqrt(sum(a*a for a in v1))
+    norm2 = math.sqrt(sum(b*b for b in v2))
+    return dot / (norm1 * norm2) if norm1 and norm2 else 0.0
+
+
+def new_cosine(student_embedding, ref_vec):
+    # Новая: эталон уже нормирован и лежит в кэше, конвертируем только ответ студента
+    return cosine_similarity(to_unit_vector(student_embedding), ref_vec)
+
+
+def main():
+    student = [random.uniform(-1, 1) for _ in range(DIM)]
+    reference = [random.uniform(-1, 1) for _ in range(DIM)]
+    ref_vec = to_unit_vector(reference)
+
+    assert abs(old_cosine(student, reference) - new_cosine(student, ref_vec)) < 1e-4
+
+    old = timeit.timeit(lambda: old_cosine(student, reference), number=ROUNDS) / ROUNDS
+    new = timeit.timeit(lambda: new_cosine(student, ref_vec), number=ROUNDS) / ROUNDS
+
+    print(f"dim={DIM}, rounds={ROUNDS}")
+    print(f"python lists : {old * 1e6:8.1f} µs на ответ")
+    print(f"numpy float32: {new * 1e6:8.1f} µs на ответ")
+    print(f"экономия     : {(old - new) * 1e6:8.1f} µs event loop на ответ ({old / new:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
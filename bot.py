@@ -1,19 +1,18 @@
 print("=== Бот стартует ===")
 import os
-import re
+import html
 import logging
 logging.basicConfig(level=logging.DEBUG)
 import asyncpg
 import asyncio
 from urllib.parse import urlparse
-import math
-import tempfile
 from aiogram.filters import StateFilter
 from aiogram import F
 from dotenv import load_dotenv
 load_dotenv()
 
-from openai import OpenAI
+import llm_gateway
+from llm_scheduler import Priority, with_priority
 
 from aiogram import Bot, Dispatcher, Router, F, types
 from aiogram.types import (
@@ -23,8 +22,31 @@ from aiogram.types import (
 )
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.memory import MemoryStorage
+from pg_storage import PostgresStorage
+from webhook_server import WebhookServer, ensure_webhook
 from aiogram.fsm.state import StatesGroup, State
 from inactivity_middleware import InactivityMiddleware
+from session_sweeper import SessionSweeper
+from rate_limiter import RateLimiter
+from broadcast import Broadcaster
+from rollups import ensure_rollups, fetch_totals, fetch_product_metrics
+from question_pool import QuestionPool
+from reference_answers import ReferenceAnswerStore
+from answer_pipeline import run_answer_pipeline
+from evaluation import evaluate_answer, CRITERIA, CRITERION_MAX
+from heuristic_scorer import score_answer
+from reevaluation import ReevaluationQueue
+from stream_editor import StreamingEditor, TELEGRAM_TEXT_LIMIT
+from similarity import to_unit_vector, cosine_similarity
+from ngram_lm import NgramLM
+from ai_text_classifier import AITextClassifier
+from phrase_matcher import find_gpt_phrases
+from minhash_index import MinHashIndex, answer_scopes
+from rank_service import RankIndex, Leaderboard
+from score_histogram import ScoreHistogram
+from voice_pipeline import TranscriptCache, open_voice
+from user_cache import UserCache, UserMiddleware, MISSING
+from metrics import metrics
 from aiogram.filters import StateFilter
 from aiogram.enums import ChatAction
 print("=== Все импорты прошли успешно ===")
@@ -38,11 +60,8 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 ADMIN_IDS = os.getenv("ADMIN_IDS", "")
 admin_ids = [int(x.strip()) for x in ADMIN_IDS.split(",")] if ADMIN_IDS else []
 # ────────────────────────────────────────────────────
-# Защищённая инициализация OpenAI клиента
-if OPENAI_API_KEY:
-    client = OpenAI(api_key=OPENAI_API_KEY)
-else:
-    client = None
+# Клиент OpenAI создаётся лениво в llm_gateway (общий async пул соединений)
+if not OPENAI_API_KEY:
     logging.warning("❌ OPENAI_API_KEY is not set. Some features may not work.")
 
 # Защищённая инициализация бота
@@ -76,28 +95,95 @@ NAV_KB_AFTER_SHOW = InlineKeyboardMarkup(inline_keyboard=[
 ])
 # ────────────────────────────────────────────────────
 # Пороги для анти-чит-проверок
-AI_CLASSIFIER_CONFIDENCE = 0.8       # если классификатор уверен ≥ 80%
-PERPLEXITY_THRESHOLD     = 15.0      # если средняя log-вероятность < 15
+AI_CLASSIFIER_CONFIDENCE = float(os.getenv("AI_CLASSIFIER_CONFIDENCE", "0.8"))  # если классификатор уверен ≥ 80%
+AI_CLASSIFIER_PATH       = os.getenv("AI_CLASSIFIER_PATH", "ai_classifier.npy")
+# Порог средней неожиданности локальной n-gram модели (бит/символ); по умолчанию — из калибровки
+PERPLEXITY_THRESHOLD     = float(os.getenv("PERPLEXITY_THRESHOLD", "0")) or None
+NGRAM_MODEL_PATH         = os.getenv("NGRAM_MODEL_PATH", "ngram_lm.npy")
 SIMILARITY_THRESHOLD = 0.90
+# Оценка Жаккара (по MinHash), начиная с которой ответы двух пользователей считаются списанными
+PLAGIARISM_THRESHOLD = float(os.getenv("PLAGIARISM_THRESHOLD", "0.6"))
+# Как часто индекс дочитывает ответы других реплик и сколько последних id перечитывать
+PLAGIARISM_REFRESH_INTERVAL = float(os.getenv("PLAGIARISM_REFRESH_INTERVAL", "30"))
+PLAGIARISM_REFRESH_OVERLAP  = 200
+# ────────────────────────────────────────────────────
+# Пул заранее сгенерированных вопросов (нижняя/верхняя граница очереди на ключ)
+QUESTION_POOL_LOW  = int(os.getenv("QUESTION_POOL_LOW", "1"))
+QUESTION_POOL_HIGH = int(os.getenv("QUESTION_POOL_HIGH", "3"))
+# ────────────────────────────────────────────────────
+# Сессии: 2 часа бездействия; FSM_STORAGE=postgres включает постоянное хранилище
+INACTIVITY_TIMEOUT = 7200
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory")
+# Общий лимит фоновых запросов к Telegram API (уборка сессий, рассылки), запросов/сек
+TELEGRAM_BACKGROUND_RPS = float(os.getenv("TELEGRAM_BACKGROUND_RPS", "25"))
+# ────────────────────────────────────────────────────
+# Режим работы: polling (по умолчанию) или webhook за балансировщиком
+BOT_MODE           = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL        = os.getenv("WEBHOOK_URL", "")        # публичный https://host без пути
+WEBHOOK_PATH       = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET     = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST       = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT       = int(os.getenv("PORT", "8080"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS    = int(os.getenv("WEBHOOK_WORKERS", "32"))
+# /metrics на отдельном внутреннем адресе; без METRICS_PORT — на публичном порту под Bearer WEBHOOK_SECRET
+METRICS_HOST       = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT       = int(os.getenv("METRICS_PORT", "0")) or None
 # ────────────────────────────────────────────────────
 # --------------------------
 # Инициализация бота и диспетчера
 # --------------------------
 
 bot = Bot(token=API_TOKEN)
-storage = MemoryStorage()
+if FSM_STORAGE == "postgres":
+    storage = PostgresStorage(ttl=INACTIVITY_TIMEOUT)
+else:
+    storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
 router = Router()
 dp.include_router(router)
-# Подключаем middleware для очистки истории (2 часа бездействия)
-dp.message.middleware(InactivityMiddleware(timeout_seconds=7200))
-dp.callback_query.middleware(InactivityMiddleware(timeout_seconds=7200))
+# Подключаем middleware для очистки истории (2 часа бездействия).
+# Экземпляр общий: время активности хранится в нём, а не в FSM-данных.
+# Неактивные сессии выселяет фоновый sweeper, не дожидаясь возвращения пользователя
+telegram_limiter = RateLimiter(rate=TELEGRAM_BACKGROUND_RPS, burst=5)
+session_sweeper = SessionSweeper(storage, bot, timeout=INACTIVITY_TIMEOUT, limiter=telegram_limiter)
+inactivity = InactivityMiddleware(timeout_seconds=INACTIVITY_TIMEOUT, sweeper=session_sweeper)
+# Рассылки идут под тем же общим лимитом, что и уборка сессий
+broadcaster = Broadcaster(bot, telegram_limiter)
+dp.message.middleware(inactivity)
+dp.callback_query.middleware(inactivity)
+# Пользователь грузится один раз на апдейт и попадает в data["user"]
+user_cache = UserCache(ttl=30, max_size=10000)
+dp.message.middleware(UserMiddleware(lambda user_id: get_user_from_db(user_id)))
+dp.callback_query.middleware(UserMiddleware(lambda user_id: get_user_from_db(user_id)))
+
+question_pool = QuestionPool(low_watermark=QUESTION_POOL_LOW, high_watermark=QUESTION_POOL_HIGH)
+# Эталонные ответы: один на вопрос, генерируются в фоне сразу после выдачи вопроса
+# Эталон к только что выданному вопросу пользователь ещё не ждёт — не отнимаем слоты у оценки
+reference_answers = ReferenceAnswerStore(
+    lambda q, g: stream_correct_answer(q, g),
+    background=lambda coro: with_priority(Priority.BACKGROUND, coro)
+)
+# Рейтинг: O(log n) позиция пользователя и кэшированный топ-N
+rank_index = RankIndex()
+leaderboard = Leaderboard(size=100, page_size=10, ttl=60)
+# Распределение баллов (вся база и каждый уровень) для «Ты лучше, чем N%»
+score_histogram = ScoreHistogram()
+# Расшифровки голосовых по file_unique_id — пересланные копии не уходят в Whisper повторно
+transcripts = TranscriptCache(max_entries=5000)
+# MinHash/LSH-индекс ответов для поиска списывания между пользователями; собирается из базы при старте
+plagiarism_index = MinHashIndex(threshold=PLAGIARISM_THRESHOLD)
+# Ответы, оценённые эвристикой, пока LLM недоступен; итоговая оценка — в фоне
+reevaluation = ReevaluationQueue(
+    lambda q, a: evaluate_answer(q, a),
+    lambda row, evaluation: apply_reevaluation(row, evaluation),
+    llm_gateway.breaker,
+)
 
 # --------------------------
-# Настройка OpenAI клиента и логирование
+# Логирование
 # --------------------------
 
-client = OpenAI(api_key=OPENAI_API_KEY)
 logging.basicConfig(level=logging.INFO)
 
 # --------------------------
@@ -105,6 +191,8 @@ logging.basicConfig(level=logging.INFO)
 # --------------------------
 
 LEVELS = ["Junior", "Middle", "Senior", "Head of Product", "CPO", "CEO"]
+# Для перехода с уровня LEVELS[i] на следующий нужно 50 * (i + 1) баллов
+LEVEL_STEP_POINTS = 50
 
 ACADEMY_TOPICS = [
     ("research", "📚 Исследования"),
@@ -155,7 +243,8 @@ def get_main_menu():
         [InlineKeyboardButton(text="📝 Экзамен", callback_data="exam")],
         [InlineKeyboardButton(text="👨‍🎓 Ученикам Академии", callback_data="learning")],
         [InlineKeyboardButton(text="📰 Новости", callback_data="news")],
-        [InlineKeyboardButton(text="📊 Аналитика прогресса", callback_data="progress")]
+        [InlineKeyboardButton(text="📊 Аналитика прогресса", callback_data="progress")],
+        [InlineKeyboardButton(text="🏆 Рейтинг", callback_data="lb:all:0")]
     ]
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
@@ -192,6 +281,8 @@ def get_admin_menu():
         [InlineKeyboardButton(text="📈 Метрики продукта", callback_data="admin_metrics")],
         [InlineKeyboardButton(text="📨 Рассылка", callback_data="admin_broadcast")],
         [InlineKeyboardButton(text="🎓 Добавить ученика Академии", callback_data="admin_add_academy")],
+        [InlineKeyboardButton(text="🩺 Метрики системы", callback_data="admin_system")],
+        [InlineKeyboardButton(text="🕵️ Списывание", callback_data="admin_plagiarism")],
         [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
     ])
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
@@ -204,6 +295,10 @@ class RegisterState(StatesGroup):
     name = State()
     age = State()
 
+class BroadcastState(StatesGroup):
+    waiting_for_text = State()
+    confirm = State()
+
 class TaskState(StatesGroup):
     waiting_for_answer = State()
     waiting_for_clarification = State()
@@ -243,6 +338,15 @@ async def create_db_pool():
         await conn.execute('''
             ALTER TABLE users ADD COLUMN IF NOT EXISTS academy_points REAL DEFAULT 0.0;
         ''')
+        await conn.execute('''
+            ALTER TABLE users ADD COLUMN IF NOT EXISTS is_blocked BOOLEAN DEFAULT FALSE;
+        ''')
+        await conn.execute('''
+            CREATE INDEX IF NOT EXISTS users_points_idx ON users (points DESC);
+        ''')
+        await conn.execute('''
+            CREATE INDEX IF NOT EXISTS users_level_points_idx ON users (level, points DESC);
+        ''')
 
                 # 👇 Таблица answers
         await conn.execute('''
@@ -259,6 +363,84 @@ async def create_db_pool():
             )
         ''')
 
+        # 👇 Лучший засчитанный балл за вопрос — от него считается прирост в commit_score
+        scores_migrated = await conn.fetchval("SELECT to_regclass('question_scores') IS NOT NULL")
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS question_scores (
+                user_id BIGINT NOT NULL,
+                question_hash TEXT NOT NULL,
+                score REAL NOT NULL,
+                previous REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, question_hash)
+            )
+        ''')
+        if not scores_migrated:
+            await conn.execute('''
+                INSERT INTO question_scores (user_id, question_hash, score)
+                SELECT user_id, md5(question), MAX(score) FROM answers
+                WHERE user_id IS NOT NULL AND question IS NOT NULL AND score IS NOT NULL
+                GROUP BY user_id, md5(question)
+            ''')
+
+        # 👇 Кэш расшифровок голосовых (file_unique_id одинаков у пересланных копий)
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS transcripts (
+                file_unique_id TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT now()
+            )
+        ''')
+
+        # 👇 MinHash-сигнатуры ответов и найденные совпадения между пользователями
+        await conn.execute('''
+            ALTER TABLE answers ADD COLUMN IF NOT EXISTS minhash BYTEA;
+        ''')
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS plagiarism_matches (
+                id SERIAL PRIMARY KEY,
+                answer_id INTEGER NOT NULL,
+                matched_answer_id INTEGER NOT NULL,
+                user_id BIGINT NOT NULL,
+                matched_user_id BIGINT NOT NULL,
+                similarity REAL NOT NULL,
+                created_at TIMESTAMP DEFAULT now()
+            )
+        ''')
+        await conn.execute('''
+            CREATE INDEX IF NOT EXISTS plagiarism_matches_created_idx ON plagiarism_matches (created_at DESC);
+        ''')
+        # 👇 Совпадение пишется и для несохранённых ответов (предварительных, без прироста):
+        # тогда answer_id пуст, а ответ определяется пользователем и вопросом
+        await conn.execute('''
+            ALTER TABLE plagiarism_matches ALTER COLUMN answer_id DROP NOT NULL;
+            ALTER TABLE plagiarism_matches ADD COLUMN IF NOT EXISTS question TEXT;
+            CREATE UNIQUE INDEX IF NOT EXISTS plagiarism_matches_user_question_idx
+                ON plagiarism_matches (user_id, md5(question), matched_answer_id);
+        ''')
+
+        # 👇 Ответы, ждущие оценки LLM (пользователь уже получил предварительную)
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS pending_evaluations (
+                id SERIAL PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                chat_id BIGINT NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                grade TEXT,
+                topic TEXT,
+                is_academy BOOLEAN DEFAULT FALSE,
+                is_suspicious BOOLEAN DEFAULT FALSE,
+                last_score REAL DEFAULT 0,
+                provisional_score REAL,
+                attempts INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT now()
+            )
+        ''')
+        # Реплика, взявшая строку в работу (пусто — свободна)
+        await conn.execute('''
+            ALTER TABLE pending_evaluations ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP;
+        ''')
+
         # 👇 Таблица analytics
         await conn.execute('''
             CREATE TABLE IF NOT EXISTS analytics (
@@ -275,6 +457,36 @@ async def create_db_pool():
             )
         ''')
 
+        # 👇 Баллы по критериям в каждом ответе и накопительные суммы в analytics
+        for key, _ in CRITERIA:
+            await conn.execute(f'''
+                ALTER TABLE answers ADD COLUMN IF NOT EXISTS criteria_{key} REAL;
+            ''')
+        analytics_migrated = await conn.fetchval('''
+            SELECT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'analytics' AND column_name = 'score_sum'
+            )
+        ''')
+        await conn.execute('''
+            ALTER TABLE analytics
+                ADD COLUMN IF NOT EXISTS score_sum DOUBLE PRECISION DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS criteria_count INTEGER DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS relevance_sum DOUBLE PRECISION DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS completeness_sum DOUBLE PRECISION DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS argumentation_sum DOUBLE PRECISION DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS structure_sum DOUBLE PRECISION DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS examples_sum DOUBLE PRECISION DEFAULT 0;
+        ''')
+        if not analytics_migrated:
+            # Старые строки analytics — заглушки; пересобираем их по реальным ответам
+            await conn.execute('''
+                DELETE FROM analytics;
+                INSERT INTO analytics (user_id, tasks_done, average_score, score_sum)
+                SELECT user_id, COUNT(*), AVG(score), COALESCE(SUM(score), 0)
+                FROM answers WHERE user_id IS NOT NULL GROUP BY user_id;
+            ''')
+
         # ✅ Проверка и добавление поля is_suspicious
         await conn.execute('''
             DO $$
@@ -290,6 +502,37 @@ async def create_db_pool():
         ''')
    
 
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS reference_answers (
+                question_hash TEXT PRIMARY KEY,
+                grade TEXT,
+                answer TEXT,
+                created_at TIMESTAMP DEFAULT now()
+            )
+        ''')
+        await conn.execute('''
+            ALTER TABLE reference_answers ADD COLUMN IF NOT EXISTS embedding BYTEA;
+        ''')
+
+        # 👇 Рассылки: прогресс сохраняется после каждой страницы получателей
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id SERIAL PRIMARY KEY,
+                text TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'running',
+                created_by BIGINT,
+                total INTEGER DEFAULT 0,
+                sent INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                blocked INTEGER DEFAULT 0,
+                last_user_id BIGINT DEFAULT 0,
+                progress_chat_id BIGINT,
+                progress_message_id BIGINT,
+                created_at TIMESTAMP DEFAULT now(),
+                finished_at TIMESTAMP
+            )
+        ''')
+
         await conn.execute('''
             CREATE TABLE IF NOT EXISTS academy_progress (
                 user_id BIGINT,
@@ -298,81 +541,175 @@ async def create_db_pool():
                 PRIMARY KEY (user_id, topic)
             )
         ''')
+
+        # 👇 Агрегаты для админки и Metabase (обновляются триггерами)
+        await ensure_rollups(conn)
 # --------------------------
 # Функции работы с базой данных
 # --------------------------
 
 async def add_user_to_db(user_id: int, username: str, name: str, age: int):
     async with db_pool.acquire() as conn:
-        await conn.execute('''
+        status = await conn.execute('''
             INSERT INTO users (id, username, name, age, level, points)
             VALUES ($1, $2, $3, $4, $5, $6)
             ON CONFLICT (id) DO NOTHING
         ''', user_id, username, name, age, "Junior", 0.0)
+    user_cache.invalidate(user_id)
+    # Повторная регистрация не должна обнулять баллы пользователя в индексе рейтинга
+    if status == "INSERT 0 1":
+        rank_index.update(user_id, 0.0)
+        score_histogram.add(0.0, "Junior")
 
 async def get_user_from_db(user_id: int):
+    user = user_cache.get(user_id)
+    if user is not MISSING:
+        return user
     async with db_pool.acquire() as conn:
-        return await conn.fetchrow('SELECT * FROM users WHERE id = $1', user_id)
-
-async def update_user_points(user_id: int, additional_points: float):
-    async with db_pool.acquire() as conn:
-        await conn.execute(
-            'UPDATE users SET points = points + $1 WHERE id = $2',
-            additional_points, user_id
-        )
-
-async def update_user_academy_points(user_id: int, additional_points: float):
-    """Увеличить поле academy_points в таблице users"""
-    async with db_pool.acquire() as conn:
-        await conn.execute(
-            'UPDATE users SET academy_points = academy_points + $1 WHERE id = $2',
-            additional_points, user_id
-        )
+        user = await conn.fetchrow('SELECT * FROM users WHERE id = $1', user_id)
+    user_cache.set(user_id, user)
+    return user
 
 import time
 
-async def save_user_answer(user_id: int, question: str, answer: str, grade: str, topic: str, score: float, state: FSMContext = None):
-    # Получаем данные из FSMContext, если передан
-    state_data = await state.get_data() if state else {}
-    question_time = state_data.get("question_time", time.time())
-
-    # Условие подозрительности
-    is_suspicious = len(answer.strip()) < 30 or (time.time() - question_time) < 120
-
+async def commit_score(user_id: int, question: str, answer: str, grade: str, topic: str, score: float,
+                       last_score: float = 0.0, is_academy: bool = False, is_suspicious: bool = False,
+                       criteria: dict = None, minhash: bytes = None):
+    """
+    Фиксирует результат ответа одной транзакцией за один round trip:
+    баллы (и баллы Академии), повышение уровня (в т.ч. сразу на несколько ступеней),
+    прогресс по теме Академии, запись в answers и накопительные суммы в analytics.
+    Начисляется разница между score и лучшим уже засчитанным баллом за этот вопрос
+    (question_scores; last_score из FSM — нижняя граница для ответов до её появления).
+    Строка question_scores блокируется upsert'ом, поэтому параллельные и отложенные
+    оценки одного вопроса не начисляют баллы дважды.
+    criteria — баллы по критериям ({"relevance": 0.15, ...}) или None, если их не разобрали.
+    minhash — сигнатура ответа для поиска списывания (MinHashIndex.to_bytes).
+    Возвращает {"points", "level", "old_level", "rank", "answer_id", "increment"} или None,
+    если пользователя нет или балл не выше уже засчитанного.
+    """
+    criteria_values = [criteria.get(key, 0.0) for key, _ in CRITERIA] if criteria else None
     async with db_pool.acquire() as conn:
-        await conn.execute('''
-            INSERT INTO answers (user_id, question, answer, grade, topic, score, is_suspicious)
-            VALUES ($1, $2, $3, $4, $5, $6, $7)
-        ''', user_id, question, answer, grade, topic, score, is_suspicious)
-
-async def update_level(user_id: int):
-    user = await get_user_from_db(user_id)
-    if not user:
-        return
-    current_level = user["level"]
-    points = user["points"]
-    cur_index = LEVELS.index(current_level)
-    required_points = 50 * (cur_index + 1)
-    if points >= required_points and cur_index < len(LEVELS) - 1:
-        new_level = LEVELS[cur_index + 1]
-        async with db_pool.acquire() as conn:
-            await conn.execute(
-                'UPDATE users SET level = $1 WHERE id = $2',
-                new_level, user_id
+        row = await conn.fetchrow('''
+            WITH best AS (
+                INSERT INTO question_scores AS b (user_id, question_hash, score)
+                SELECT $1, md5($5), $8::real WHERE EXISTS (SELECT 1 FROM users WHERE id = $1)
+                ON CONFLICT (user_id, question_hash) DO UPDATE
+                SET previous = b.score, score = GREATEST(b.score, EXCLUDED.score)
+                RETURNING $8::real - GREATEST(b.previous, $2::real) AS increment
+            ),
+            gain AS (
+                SELECT increment FROM best WHERE increment > 0
+            ),
+            old AS (
+                SELECT points, level FROM users WHERE id = $1 FOR UPDATE
+            ),
+            upd AS (
+                UPDATE users u SET
+                    points = u.points + g.increment,
+                    academy_points = COALESCE(u.academy_points, 0) + CASE WHEN $3 THEN g.increment ELSE 0 END,
+                    level = ($10::text[])[GREATEST(
+                        array_position($10::text[], u.level),
+                        LEAST(cardinality($10::text[]), floor((u.points + g.increment) / $11)::int + 1)
+                    )]
+                FROM gain g, old
+                WHERE u.id = $1
+                RETURNING u.points, u.level
+            ),
+            academy AS (
+                INSERT INTO academy_progress (user_id, topic, points)
+                SELECT $1, $4, increment FROM gain WHERE $3
+                ON CONFLICT (user_id, topic) DO UPDATE
+                SET points = academy_progress.points + EXCLUDED.points
+            ),
+            saved AS (
+                INSERT INTO answers (user_id, question, answer, grade, topic, score, is_suspicious,
+                                     criteria_relevance, criteria_completeness, criteria_argumentation,
+                                     criteria_structure, criteria_examples, minhash)
+                SELECT $1, $5, $6, $7, $4, $8, $9, ($12::float8[])[1], ($12::float8[])[2], ($12::float8[])[3], ($12::float8[])[4], ($12::float8[])[5], $13
+                WHERE EXISTS (SELECT 1 FROM upd)
+                RETURNING id
+            ),
+            stats AS (
+                INSERT INTO analytics AS a (
+                    user_id, tasks_done, score_sum, average_score, criteria_count,
+                    relevance_sum, completeness_sum, argumentation_sum, structure_sum, examples_sum,
+                    criteria_relevance, criteria_completeness, criteria_argumentation,
+                    criteria_structure, criteria_examples, next_target
+                )
+                SELECT $1, 1, $8, $8, CASE WHEN $12::float8[] IS NULL THEN 0 ELSE 1 END,
+                       COALESCE(($12::float8[])[1], 0), COALESCE(($12::float8[])[2], 0), COALESCE(($12::float8[])[3], 0),
+                       COALESCE(($12::float8[])[4], 0), COALESCE(($12::float8[])[5], 0),
+                       ($12::float8[])[1], ($12::float8[])[2], ($12::float8[])[3], ($12::float8[])[4], ($12::float8[])[5],
+                       CASE WHEN upd.level = ($10::text[])[cardinality($10::text[])] THEN NULL
+                            ELSE ceil(GREATEST(0, array_position($10::text[], upd.level) * $11 - upd.points))::int
+                       END
+                FROM upd
+                ON CONFLICT (user_id) DO UPDATE SET
+                    tasks_done        = COALESCE(a.tasks_done, 0) + 1,
+                    score_sum         = COALESCE(a.score_sum, 0) + EXCLUDED.score_sum,
+                    average_score     = (COALESCE(a.score_sum, 0) + EXCLUDED.score_sum) / (COALESCE(a.tasks_done, 0) + 1),
+                    criteria_count    = COALESCE(a.criteria_count, 0) + EXCLUDED.criteria_count,
+                    relevance_sum     = COALESCE(a.relevance_sum, 0) + EXCLUDED.relevance_sum,
+                    completeness_sum  = COALESCE(a.completeness_sum, 0) + EXCLUDED.completeness_sum,
+                    argumentation_sum = COALESCE(a.argumentation_sum, 0) + EXCLUDED.argumentation_sum,
+                    structure_sum     = COALESCE(a.structure_sum, 0) + EXCLUDED.structure_sum,
+                    examples_sum      = COALESCE(a.examples_sum, 0) + EXCLUDED.examples_sum,
+                    criteria_relevance     = (COALESCE(a.relevance_sum, 0) + EXCLUDED.relevance_sum)
+                                             / NULLIF(COALESCE(a.criteria_count, 0) + EXCLUDED.criteria_count, 0),
+                    criteria_completeness  = (COALESCE(a.completeness_sum, 0) + EXCLUDED.completeness_sum)
+                                             / NULLIF(COALESCE(a.criteria_count, 0) + EXCLUDED.criteria_count, 0),
+                    criteria_argumentation = (COALESCE(a.argumentation_sum, 0) + EXCLUDED.argumentation_sum)
+                                             / NULLIF(COALESCE(a.criteria_count, 0) + EXCLUDED.criteria_count, 0),
+                    criteria_structure     = (COALESCE(a.structure_sum, 0) + EXCLUDED.structure_sum)
+                                             / NULLIF(COALESCE(a.criteria_count, 0) + EXCLUDED.criteria_count, 0),
+                    criteria_examples      = (COALESCE(a.examples_sum, 0) + EXCLUDED.examples_sum)
+                                             / NULLIF(COALESCE(a.criteria_count, 0) + EXCLUDED.criteria_count, 0),
+                    next_target       = EXCLUDED.next_target
             )
-        logging.info(f"Пользователь {user_id} повышен с {current_level} до {new_level}.")
+            SELECT upd.points, upd.level, old.points AS old_points, old.level AS old_level, gain.increment,
+                   (SELECT id FROM saved) AS answer_id
+            FROM upd, old, gain
+        ''', user_id, last_score or 0.0, is_academy, topic, question, answer, grade, score,
+            is_suspicious, LEVELS, LEVEL_STEP_POINTS, criteria_values, minhash)
+
+    user_cache.invalidate(user_id)
+    if not row:
+        return None
+    increment = row["increment"]
+    rank_index.update(user_id, row["points"])
+    score_histogram.move(row["old_points"], row["points"], row["old_level"], row["level"])
+    if row["level"] != row["old_level"]:
+        logging.info(f"Пользователь {user_id} повышен с {row['old_level']} до {row['level']}.")
+    return {
+        "points": row["points"],
+        "level": row["level"],
+        "old_level": row["old_level"],
+        "rank": rank_index.rank(user_id),
+        "answer_id": row["answer_id"],
+        "increment": increment,
+    }
+
+async def load_rank_index():
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch('SELECT id, points FROM users')
+    rank_index.load((r["id"], r["points"]) for r in rows)
 
 async def get_user_rank(user_id: int) -> int:
+    rank = rank_index.rank(user_id)
+    if rank != -1:
+        return rank
+    # Пользователя нет в индексе (например, добавлен другим процессом) — считаем по индексу БД
     async with db_pool.acquire() as conn:
-        rows = await conn.fetch('''
-            SELECT id
-            FROM users
-            ORDER BY points DESC
-        ''')
-        ids = [row['id'] for row in rows]
-        if user_id in ids:
-            return ids.index(user_id) + 1  # позиция +1, т.к. с нуля
+        row = await conn.fetchrow('''
+            SELECT points, (SELECT COUNT(*) FROM users o WHERE o.points > u.points) + 1 AS rank
+            FROM users u
+            WHERE id = $1
+        ''', user_id)
+    if not row:
         return -1  # если вдруг не нашли
+    rank_index.update(user_id, row["points"] or 0.0)
+    return row["rank"]
 
 # Получить текущие баллы по теме
 async def get_academy_topic_points(user_id: int, topic: str) -> float:
@@ -383,15 +720,6 @@ async def get_academy_topic_points(user_id: int, topic: str) -> float:
         )
         return row["points"] if row else 0.0
 
-# Добавить баллы
-async def update_academy_topic_points(user_id: int, topic: str, additional: float):
-    async with db_pool.acquire() as conn:
-        await conn.execute('''
-            INSERT INTO academy_progress (user_id, topic, points)
-            VALUES ($1, $2, $3)
-            ON CONFLICT (user_id, topic) DO UPDATE
-            SET points = academy_progress.points + EXCLUDED.points
-        ''', user_id, topic, additional)
 # --------------------------
 # Обработчики коллбэков и команд
 # --------------------------
@@ -446,12 +774,55 @@ async def show_profile(callback: CallbackQuery):
     await callback.answer()
 
 
+@router.callback_query(F.data.startswith("lb:"))
+async def show_leaderboard(callback: CallbackQuery):
+    _, level_key, page_raw = callback.data.split(":", 2)
+    level = None if level_key == "all" else level_key
+    rows, pages = await leaderboard.page(level, int(page_raw))
+    page = min(int(page_raw), pages - 1)
+
+    start = page * leaderboard.page_size
+    lines = "\n".join(
+        f"{start + i + 1}. {html.escape(r['name'] or '—')} ({r['level']}) — {round(r['points'] or 0, 2)}"
+        for i, r in enumerate(rows)
+    ) or "— пока пусто"
+    rank = rank_index.rank(callback.from_user.id)
+    title = f"🏆 <b>Рейтинг{' — ' + level if level else ''}</b>"
+    text = f"{title}\n\n{lines}"
+    if rank != -1:
+        text += f"\n\n<b>Твоё место:</b> {rank}"
+
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text="⬅️", callback_data=f"lb:{level_key}:{page - 1}"))
+    nav.append(InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data=f"lb:{level_key}:{page}"))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton(text="➡️", callback_data=f"lb:{level_key}:{page + 1}"))
+    level_buttons = [InlineKeyboardButton(text="Все", callback_data="lb:all:0")] + [
+        InlineKeyboardButton(text=lvl, callback_data=f"lb:{lvl}:0") for lvl in LEVELS
+    ]
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        nav,
+        level_buttons[:4],
+        level_buttons[4:],
+        [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
+    ])
+    try:
+        await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    except Exception as e:
+        # Повторное нажатие на ту же страницу — Telegram ругается «message is not modified»
+        logging.debug(f"[Leaderboard] edit_text: {e}")
+    await callback.answer()
+
 @router.message(lambda msg: msg.text == "/start")
 async def cmd_start(message: Message, state: FSMContext):
     await state.clear()
     await message.answer("🔄 Перезапуск...", reply_markup=ReplyKeyboardRemove())
 
     user = await get_user_from_db(message.from_user.id)
+    if user and user.get("is_blocked"):
+        await broadcaster.unblock(message.from_user.id)
+        user_cache.invalidate(message.from_user.id)
 
     if user:
         name = user["name"]
@@ -538,8 +909,7 @@ async def admin_panel(message: Message, state: FSMContext):
 async def admin_stats_handler(callback: CallbackQuery):
     try:
         async with db_pool.acquire() as conn:
-            row = await conn.fetchrow("SELECT COUNT(*) FROM users")
-            count = row[0]
+            count = (await fetch_totals(conn))["users"]
     except Exception as e:
         logging.error(f"Ошибка получения статистики: {e}")
         count = "не удалось получить статистику"
@@ -550,34 +920,83 @@ async def admin_stats_handler(callback: CallbackQuery):
 
 @router.callback_query(F.data == "admin_broadcast")
 async def admin_broadcast_handler(callback: CallbackQuery, state: FSMContext):
-    await callback.message.edit_text("Функция рассылки скоро будет доступна.", reply_markup=get_admin_menu())
+    if callback.from_user.id not in admin_ids:
+        await callback.answer("🚫 Нет прав", show_alert=True)
+        return
+    if broadcaster.running:
+        await callback.message.edit_text(
+            f"📨 Рассылка #{broadcaster.current_id} ещё идёт — прогресс обновляется в её сообщении.",
+            reply_markup=get_admin_menu()
+        )
+        await callback.answer()
+        return
+    await state.set_state(BroadcastState.waiting_for_text)
+    await callback.message.edit_text(
+        "✍️ Пришлите текст рассылки одним сообщением.",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🔙 Отмена", callback_data="broadcast_abort")]
+        ])
+    )
     await callback.answer()
 
+@router.message(StateFilter(BroadcastState.waiting_for_text))
+async def broadcast_text_received(message: Message, state: FSMContext):
+    if message.from_user.id not in admin_ids or not message.text:
+        await message.answer("✍️ Нужен текст сообщения.")
+        return
+    await state.update_data(broadcast_text=message.text)
+    await state.set_state(BroadcastState.confirm)
+    await message.answer(
+        f"Так сообщение увидят пользователи:\n\n{message.text}",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="✅ Отправить всем", callback_data="broadcast_confirm")],
+            [InlineKeyboardButton(text="🔙 Отмена", callback_data="broadcast_abort")]
+        ])
+    )
+
+@router.callback_query(F.data == "broadcast_confirm", StateFilter(BroadcastState.confirm))
+async def broadcast_confirm(callback: CallbackQuery, state: FSMContext):
+    if callback.from_user.id not in admin_ids:
+        await callback.answer("🚫 Нет прав", show_alert=True)
+        return
+    text = (await state.get_data()).get("broadcast_text")
+    await state.clear()
+    if not text or broadcaster.running:
+        await callback.message.edit_text("⚠️ Рассылку запустить нельзя.", reply_markup=get_admin_menu())
+        await callback.answer()
+        return
+    progress = await callback.message.answer("📨 Запускаем рассылку…")
+    broadcast_id = await broadcaster.create(text, callback.from_user.id, progress.chat.id, progress.message_id)
+    broadcaster.start(broadcast_id)
+    logging.info(f"[Broadcast] Рассылка #{broadcast_id} запущена админом {callback.from_user.id}")
+    await callback.answer("Рассылка запущена")
+
+@router.callback_query(F.data == "broadcast_abort")
+async def broadcast_abort(callback: CallbackQuery, state: FSMContext):
+    await state.clear()
+    await callback.message.edit_text("👑 Админ-панель", reply_markup=get_admin_menu())
+    await callback.answer()
+
+@router.callback_query(F.data == "broadcast_cancel")
+async def broadcast_cancel(callback: CallbackQuery):
+    if callback.from_user.id not in admin_ids:
+        await callback.answer("🚫 Нет прав", show_alert=True)
+        return
+    await broadcaster.cancel()
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await callback.answer("Рассылка остановлена")
+
 @router.callback_query(F.data == "admin_metrics")
 async def admin_metrics_handler(callback: CallbackQuery):
     try:
         async with db_pool.acquire() as conn:
-            # Среднее количество заданий на пользователя
-            tasks_avg = await conn.fetchval('''
-                SELECT AVG(cnt) FROM (
-                    SELECT COUNT(*) AS cnt FROM answers GROUP BY user_id
-                ) sub
-            ''')
-
-            # Средняя оценка
-            avg_score = await conn.fetchval("SELECT AVG(score) FROM answers")
-
-            # Популярные темы
-            top_topics = await conn.fetch('''
-                SELECT topic, COUNT(*) as count
-                FROM answers
-                GROUP BY topic
-                ORDER BY count DESC
-                LIMIT 3
-            ''')
+            # Всё берётся из агрегатов — ни одного прохода по answers
+            stats = await fetch_product_metrics(conn)
+            tasks_avg = stats["tasks_avg"]
+            avg_score = stats["avg_score"]
 
             top_lines = "\n".join([
-                f"{i+1}. {r['topic']} — {r['count']} ответов" for i, r in enumerate(top_topics)
+                f"{i+1}. {topic} — {count} ответов" for i, (topic, count) in enumerate(stats["top_topics"])
             ])
 
             # Заглушка для времени
@@ -588,6 +1007,7 @@ async def admin_metrics_handler(callback: CallbackQuery):
                 "<b>📈 Метрики продукта</b>\n\n"
                 f"🧮 Среднее число заданий на пользователя: {round(tasks_avg or 0, 2)}\n"
                 f"⭐ Средняя оценка за задания: {round(avg_score or 0, 2)}\n"
+                f"📅 Ответов сегодня: {stats['answers_today']}\n"
                 f"⏱️ Среднее время в боте: {avg_time}\n\n"
                 f"<b>🔥 Топ-3 темы заданий:</b>\n{top_lines}\n\n"
                 "<i>Метрики собираются на основе пользовательской активности</i>"
@@ -601,6 +1021,87 @@ async def admin_metrics_handler(callback: CallbackQuery):
 
     await callback.answer()
 
+def metrics_dump(limit: int) -> str:
+    """Текстовый дамп метрик целыми строками не длиннее limit; полный — на /metrics."""
+    lines = [html.escape(line) for line in metrics.render_text().splitlines()]
+    if not lines:
+        return "— пока пусто"
+    tail = "… полный список — на /metrics"
+    shown, size = [], 0
+    for i, line in enumerate(lines):
+        reserve = 0 if i == len(lines) - 1 else len(tail) + 1
+        if size + len(line) + 1 + reserve > limit:
+            shown.append(tail)
+            break
+        shown.append(line)
+        size += len(line) + 1
+    return "\n".join(shown)
+
+@router.callback_query(F.data == "admin_system")
+async def admin_system_handler(callback: CallbackQuery):
+    if callback.from_user.id not in admin_ids:
+        await callback.answer("🚫 Нет прав", show_alert=True)
+        return
+    hit_rate = metrics.ratio("question_pool_hits", "question_pool_misses")
+    quantiles = [score_histogram.quantile(q) for q in (0.5, 0.9, 0.99)]
+    points_line = " / ".join("—" if v is None else str(round(v, 1)) for v in quantiles)
+    llm_queue = sum(v for k, v in metrics.gauges.items() if k.startswith("llm_queue_depth_"))
+    summary = (
+        "<b>🩺 Метрики системы</b>\n\n"
+        f"🎯 Попадания в пул вопросов: {round(hit_rate * 100, 1)}%\n"
+        f"⭐ Баллы p50 / p90 / p99: {points_line}\n"
+        f"🤖 Очередь к LLM: {llm_queue:g}, повторов: {metrics.counters['llm_retries']:g}, "
+        f"429: {metrics.counters['llm_rate_limited']:g}\n"
+        f"🔌 Предохранитель LLM: {llm_gateway.breaker.state}, "
+        f"ждут оценки: {metrics.gauges.get('reevaluation_pending', 0):g}\n\n"
+    )
+    text = summary + f"<pre>{metrics_dump(TELEGRAM_TEXT_LIMIT - len(summary) - len('<pre></pre>'))}</pre>"
+    await callback.message.edit_text(text, parse_mode="HTML", reply_markup=get_admin_menu())
+    await callback.answer()
+
+@router.callback_query(F.data == "admin_plagiarism")
+async def admin_plagiarism_handler(callback: CallbackQuery):
+    if callback.from_user.id not in admin_ids:
+        await callback.answer("🚫 Нет прав", show_alert=True)
+        return
+    try:
+        async with db_pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT m.similarity, m.created_at, m.user_id, m.matched_user_id,
+                       COALESCE(m.question, a.question) AS question,
+                       u.name AS user_name, o.name AS matched_name
+                FROM plagiarism_matches m
+                LEFT JOIN answers a ON a.id = m.answer_id
+                LEFT JOIN users u ON u.id = m.user_id
+                LEFT JOIN users o ON o.id = m.matched_user_id
+                ORDER BY m.created_at DESC, m.id DESC
+                LIMIT 15
+            ''')
+    except Exception as e:
+        logging.error(f"Ошибка получения совпадений: {e}")
+        await callback.message.edit_text("❌ Ошибка при получении совпадений.", reply_markup=get_admin_menu())
+        await callback.answer()
+        return
+
+    lines = []
+    for r in rows:
+        question = r["question"] or "—"
+        if len(question) > 80:
+            question = question[:80] + "…"
+        lines.append(
+            f"{r['created_at']:%d.%m %H:%M} · <b>{round(r['similarity'] * 100)}%</b>\n"
+            f"👤 {html.escape(r['user_name'] or '—')} (<code>{r['user_id']}</code>) ↔ "
+            f"{html.escape(r['matched_name'] or '—')} (<code>{r['matched_user_id']}</code>)\n"
+            f"<i>{html.escape(question)}</i>"
+        )
+    text = (
+        "<b>🕵️ Похожие ответы разных пользователей</b>\n"
+        f"В индексе ответов: {len(plagiarism_index)}\n\n"
+        + ("\n\n".join(lines) if lines else "Совпадений пока нет.")
+    )
+    await callback.message.edit_text(text, parse_mode="HTML", reply_markup=get_admin_menu())
+    await callback.answer()
+
 @router.callback_query(F.data == "admin_add_academy")
 async def add_academy_student_start(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_text("✍️ Введите ID пользователя, которого нужно сделать учеником Академии:")
@@ -641,9 +1142,7 @@ async def learning_entry(callback: CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data == "track_junior_middle")
-async def handle_junior_track(callback: CallbackQuery):
-    user = await get_user_from_db(callback.from_user.id)
-
+async def handle_junior_track(callback: CallbackQuery, user=None):
     if not user or not user["is_academy_student"]:
         await callback.message.edit_text(
             "🚫 Доступ только для учеников Академии One to One!\n\n"
@@ -654,12 +1153,10 @@ async def handle_junior_track(callback: CallbackQuery):
         await callback.answer()
         return
     # если есть доступ
-    await show_academy_topics(callback)
+    await show_academy_topics(callback, user)
 
 @router.callback_query(F.data.startswith("academy_topic_"))
-async def handle_academy_topic(callback: CallbackQuery, state: FSMContext):
-    user = await get_user_from_db(callback.from_user.id)
-
+async def handle_academy_topic(callback: CallbackQuery, state: FSMContext, user=None):
     # Проверка доступа
     if not user or not user["is_academy_student"]:
         await callback.message.edit_text(
@@ -700,9 +1197,7 @@ async def handle_academy_topic(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 @router.callback_query(F.data.startswith("academy_subtopic_"))
-async def handle_academy_subtopic(callback: CallbackQuery, state: FSMContext):
-    user = await get_user_from_db(callback.from_user.id)
-
+async def handle_academy_subtopic(callback: CallbackQuery, state: FSMContext, user=None):
     if not user or not user["is_academy_student"]:
         await callback.message.edit_text(
             "🚫 Доступ только для учеников Академии One to One!\n\n"
@@ -725,9 +1220,11 @@ async def handle_academy_subtopic(callback: CallbackQuery, state: FSMContext):
         await callback.message.answer("❌ Ошибка выбора темы.")
         return
 
-    # Генерируем вопрос
-    question = await generate_academy_question(main_topic_key, subtopic_name, user["name"])
+    # Берём вопрос из пула (или генерируем на лету)
+    question = await next_academy_question(main_topic_key, subtopic_name, user["name"])
 
+    if not question.startswith("❌"):
+        reference_answers.prefetch(question, user["level"])
     await state.set_state(TaskState.waiting_for_answer)
     await state.update_data(
         question=question,
@@ -756,9 +1253,7 @@ async def handle_academy_subtopic(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 @router.callback_query(F.data == "track_senior")
-async def handle_senior_track(callback: CallbackQuery):
-    user = await get_user_from_db(callback.from_user.id)
-
+async def handle_senior_track(callback: CallbackQuery, user=None):
     if not user or not user["is_academy_student"]:
         await callback.message.edit_text(
             "🚫 Доступ только для учеников Академии One to One!\n\n"
@@ -770,7 +1265,7 @@ async def handle_senior_track(callback: CallbackQuery):
         return
 
     # Если доступ есть — показываем темы
-    await show_academy_topics(callback)
+    await show_academy_topics(callback, user)
 
 @router.callback_query(F.data == "news")
 async def news_callback(callback: CallbackQuery):
@@ -812,8 +1307,10 @@ async def show_progress_analytics(callback: CallbackQuery):
         await callback.message.edit_text("⚠️ Пользователь не найден.")
         return
 
-    data = await get_or_generate_analytics(user_id)
-    text = format_progress_analytics(user, data)
+    data = await get_user_analytics(user_id)
+    percentile = score_histogram.percentile(user["points"])
+    level_percentile = score_histogram.percentile(user["points"], scope=user["level"])
+    text = format_progress_analytics(user, data, percentile, level_percentile)
     await callback.message.edit_text(text, parse_mode="HTML", reply_markup=get_main_menu())
     await callback.answer()
 
@@ -834,12 +1331,11 @@ async def confirm_academy_student(message: Message, state: FSMContext):
             "UPDATE users SET is_academy_student = TRUE WHERE id = $1",
             user["id"]
         )
+    user_cache.invalidate(user["id"])
     await message.answer(f"✅ Пользователь @{username} добавлен в Академию!", reply_markup=get_admin_menu())
     await state.clear()
 
-async def show_academy_topics(callback: CallbackQuery):
-    user = await get_user_from_db(callback.from_user.id)
-
+async def show_academy_topics(callback: CallbackQuery, user=None):
     if not user or not user["is_academy_student"]:
         await callback.message.edit_text(
             "🚫 Доступ только для учеников Академии One to One!\n\n"
@@ -913,12 +1409,15 @@ async def handle_topic_selection(callback: CallbackQuery, state: FSMContext):
         await callback.answer("⚠️ Что-то пошло не так. Сначала выберите грейд и тему.", show_alert=True)
         return
 
-    # Генерируем вопрос
-    question = await generate_question(selected_grade, chosen_topic, user["name"])
+    # Берём вопрос из пула (или генерируем на лету)
+    question = await next_question(selected_grade, chosen_topic, user["name"])
     if not question or question.startswith("❌"):
         await callback.answer("❌ Не удалось сгенерировать вопрос. Попробуйте другую тему.", show_alert=True)
         return
 
+    # Эталон начинаем готовить сразу, пока пользователь думает
+    reference_answers.prefetch(question, selected_grade)
+
     # Переходим в состояние ожидания ответа
     await state.set_state(TaskState.waiting_for_answer)
     await state.update_data(question=question, grade=selected_grade, selected_topic=chosen_topic, last_score=0.0)
@@ -943,16 +1442,23 @@ async def cb_show(call: CallbackQuery, state: FSMContext):
     if not q or not g:
         return await call.answer("Нет активного вопроса", show_alert=True)
 
-    # Генерируем эталонный ответ
-    correct = await generate_correct_answer(q, g)
+    await call.answer()
 
-    # Редактируем сообщение: показываем правильный ответ + убираем все кнопки кроме Next и Main
-    await call.message.edit_text(
-        f"✅ Эталонный ответ:\n\n{correct}",
+    # Эталон уже готов (или готовится) с момента выдачи вопроса — если ещё готовится,
+    # показываем его по мере генерации
+    editor = StreamingEditor(call.message, header="✅ Эталонный ответ:\n\n")
+    correct = ""
+    async for partial in reference_answers.stream(q, g):
+        await editor.update(partial)
+        # Последний текст потока — итоговый; повторный get() после ошибки запустил бы генерацию заново
+        correct = partial
+
+    # Финальная правка: правильный ответ + убираем все кнопки кроме Next и Main
+    await editor.finish(
+        f"✅ Эталонный ответ:\n\n{html.escape(correct)}",
         parse_mode="HTML",
         reply_markup=NAV_KB_AFTER_SHOW
     )
-    await call.answer()
 
 @router.callback_query(F.data=="nav_next")
 async def cb_next(call: CallbackQuery, state: FSMContext):
@@ -966,11 +1472,13 @@ async def cb_next(call: CallbackQuery, state: FSMContext):
     if data.get("is_academy_task"):
         main_topic = data.get("selected_academy_topic")
         subtopic   = data.get("selected_topic")
-        new_q = await generate_academy_question(main_topic, subtopic, user["name"])
+        new_q = await next_academy_question(main_topic, subtopic, user["name"])
     else:
         grade = data.get("grade")
         topic = data.get("selected_topic")
-        new_q = await generate_question(grade, topic, user["name"])
+        new_q = await next_question(grade, topic, user["name"])
+    if not new_q.startswith("❌"):
+        reference_answers.prefetch(new_q, data.get("grade"))
 
     # Сбрасываем предыдущий score и сохраняем новый вопрос
     await state.update_data(question=new_q, last_score=0.0)
@@ -1065,8 +1573,7 @@ async def process_clarification(message: Message, state: FSMContext):
     )
 
     try:
-        resp = await asyncio.to_thread(
-            client.chat.completions.create,
+        reply = await llm_gateway.chat(
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": system_content},
@@ -1075,7 +1582,6 @@ async def process_clarification(message: Message, state: FSMContext):
             max_tokens=150,
             temperature=0.5
         )
-        reply = resp.choices[0].message.content.strip()
     except Exception as e:
         logging.error(f"Ошибка при уточнении: {e}")
         reply = "❌ Не удалось получить уточнение. Попробуйте снова."
@@ -1124,70 +1630,213 @@ async def handle_task_answer(message: Message, state: FSMContext):
         await state.set_state(TaskState.waiting_for_clarification)
         return
 
-# ─── ANTI-CHEAT STEP 1: GPT-Классификатор ───────────────────────────
-    try:
-        prompt = (
-            f"Вот ответ студента:\n\n{text}\n\n"
-            "Ответь только одним словом: Да или Нет — выглядит ли он как сгенерированный ИИ (ChatGPT, Bard и т.д.)?\n"
-            "Никаких объяснений, только одно слово: Да или Нет."
-        )
+    await process_answer(message, state, text, status)
 
-        response = await asyncio.to_thread(
-            client.chat.completions.create,
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Ты определяешь, написан ли текст ИИ или человеком."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=1,
-            temperature=0
-        )
+@router.message(StateFilter(TaskState.waiting_for_voice), F.content_type == types.ContentType.VOICE)
+async def process_voice_message(message: Message, state: FSMContext):
+    logging.debug("🚀 Началась обработка голосового сообщения")
 
-        result = response.choices[0].message.content.strip().lower()
+    # 1. Уведомляем пользователя
+    status = await message.answer("⏳ Обрабатываю голосовое сообщение...")
+
+    try:
+        # 2. Сначала ищем готовую расшифровку (то же голосовое могли уже переслать)
+        voice = message.voice
+        text = await transcripts.get(voice.file_unique_id)
+        if text is None:
+            # 3. Скачиваем в память (большие файлы — во временный файл) и сразу транскрибируем
+            file = await bot.get_file(voice.file_id)
+            async with open_voice(bot, file.file_path, voice.file_size) as audio:
+                logging.debug("🎙 Отправка в transcribe_audio...")
+                text = await transcribe_audio(audio)
+            await transcripts.set(voice.file_unique_id, text)
+
+        # 4. Показываем результат пользователю
+        await status.delete()
+        await message.answer(f"📝 Расшифровка: «{text}»")
 
-        if result == "да":
-            await status.delete()
-            result_msg = (
-                "<b>📊 Критерии:</b>\n"
-                "• Соответствие вопросу: 0.00\n\n"
-                "<b>🧮 Оценка (Score):</b> <code>0.00</code>\n\n"
-                "<b>💬 Обратная связь (Feedback):</b>\n"
-                "Ответ выглядит сгенерированным ИИ. Пожалуйста, напишите своими словами."
-            )
-            await message.answer(result_msg, parse_mode="HTML", reply_markup=NAV_KB_AFTER_ANSWER)
-            return
     except Exception as e:
-        logging.warning(f"[AntiCheat] GPT classifier error: {e}")
+        logging.exception(f"❌ Ошибка при обработке голосового: {e}")
+        await status.delete()
+        await message.answer("❌ Не удалось обработать голосовое сообщение. Попробуйте ещё раз.")
+        return
+
+    status = await message.answer("⏳ Оцениваю ваш ответ…")
+    await process_answer(message, state, text, status)
+
+# --------------------------
+# Обработка ответа: анти-чит + оценка
+# --------------------------
+
+def format_rejection(feedback: str) -> str:
+    return (
+        "<b>📊 Критерии:</b>\n"
+        "• Соответствие вопросу: 0.00\n\n"
+        "<b>🧮 Оценка (Score):</b> <code>0.00</code>\n\n"
+        "<b>💬 Обратная связь (Feedback):</b>\n"
+        f"{feedback}"
+    )
 
-    # ────────────────────────────────────────────────────────────────────
+# ─── ANTI-CHEAT STEP 1: ЛОКАЛЬНЫЙ КЛАССИФИКАТОР ИИ-ТЕКСТА ───────────
+# Модель обучается по answers (python ai_text_classifier.py) и загружается при старте
+ai_classifier = None
 
-    # ─── ANTI-CHEAT STEP 2: PERPLEXITY ЧЕРЕЗ DAVINCI ────────────────────
+def load_ai_classifier():
+    global ai_classifier
     try:
-        perp_resp = await client.completions.create(
-            model="text-davinci-003",
-            prompt=text,
-            max_tokens=1,
-            logprobs=1
+        ai_classifier = AITextClassifier.load(AI_CLASSIFIER_PATH)
+    except FileNotFoundError:
+        logging.warning(f"[AntiCheat] Нет модели {AI_CLASSIFIER_PATH} — классификатор ИИ-текста отключён")
+        return
+    logging.info(f"[AntiCheat] Классификатор ИИ-текста загружен: {ai_classifier.metrics}")
+
+async def check_ai_classifier(text: str):
+    if ai_classifier is None:
+        return None
+    if ai_classifier.predict_proba(text) >= AI_CLASSIFIER_CONFIDENCE:
+        return "Ответ выглядит сгенерированным ИИ. Пожалуйста, напишите своими словами."
+    return None
+
+# ─── ANTI-CHEAT STEP 2: PERPLEXITY ЛОКАЛЬНОЙ N-GRAM МОДЕЛЬЮ ─────────
+# Модель обучается офлайн (python ngram_lm.py) и загружается при старте
+perplexity_model = None
+
+def load_perplexity_model():
+    global perplexity_model
+    try:
+        perplexity_model = NgramLM.load(NGRAM_MODEL_PATH)
+    except FileNotFoundError:
+        logging.warning(f"[AntiCheat] Нет модели {NGRAM_MODEL_PATH} — проверка перплексии отключена")
+        return
+    logging.info(f"[AntiCheat] N-gram модель загружена, порог: {PERPLEXITY_THRESHOLD or perplexity_model.threshold}")
+
+async def check_perplexity(text: str):
+    model = perplexity_model
+    threshold = PERPLEXITY_THRESHOLD or (model.threshold if model else None)
+    if model is None or threshold is None:
+        return None
+    if model.mean_surprisal(text) < threshold:
+        return "Ответ слишком «модельный», возможно это копипаст. Попробуйте переформулировать."
+    return None
+
+async def check_gpt_phrases(text: str):
+    hits = find_gpt_phrases(text)
+    if hits:
+        quoted = ", ".join(f"«{phrase}»" for phrase in hits[:3])
+        return f"Переформулируйте ответ своими словами — шаблонные обороты: {html.escape(quoted)}."
+    return None
+
+# ─── ANTI-CHEAT STEP 3: EMBEDDING-SIMILARITY ────────────────────────
+async def check_similarity(text: str, question: str, grade: str):
+    correct = await reference_answers.get(question, grade)
+    if not correct or correct.startswith("❌"):
+        return None
+    # Эмбеддинг эталона кэшируется по хэшу вопроса; иначе оба текста одним запросом
+    ref_vec = await reference_answers.get_embedding(question, grade)
+    if ref_vec is None:
+        stud_emb, ref_emb = await llm_gateway.embed([text, correct])
+        ref_vec = to_unit_vector(ref_emb)
+        await reference_answers.save_embedding(question, grade, ref_vec)
+    else:
+        stud_emb, = await llm_gateway.embed([text])
+
+    cos_sim = cosine_similarity(to_unit_vector(stud_emb), ref_vec)
+    if cos_sim >= SIMILARITY_THRESHOLD:
+        return (
+            "Ваш ответ слишком близок к эталонному — вероятно, скопирован из ИИ. "
+            "Пожалуйста, пишите ответ своими словами. За обман предусмотрена блокировка."
         )
-        token_logprobs = perp_resp.choices[0].logprobs.token_logprobs or []
-        if token_logprobs:
-            avg_lp = sum(abs(lp) for lp in token_logprobs) / len(token_logprobs)
-            if avg_lp < PERPLEXITY_THRESHOLD:
-                await status.delete()
-                result_msg = (
-                    "<b>📊 Критерии:</b>\n"
-                    "• Соответствие вопросу: 0.00\n\n"
-                    "<b>🧮 Оценка (Score):</b> <code>0.00</code>\n\n"
-                    "<b>💬 Обратная связь (Feedback):</b>\n"
-                    "Ответ слишком «модельный», возможно это копипаст. Попробуйте переформулировать."
-                )
-                await message.answer(result_msg, parse_mode="HTML", reply_markup=NAV_KB_AFTER_ANSWER)
-                return
+    return None
+
+# ─── ANTI-CHEAT: СПИСЫВАНИЕ МЕЖДУ ПОЛЬЗОВАТЕЛЯМИ ───────────────────
+# Ответ не отклоняется, а помечается is_suspicious; совпадения видны в админке
+def find_plagiarism(user_id: int, question: str, topic: str, text: str):
+    """(сигнатура ответа, совпадения с ответами других пользователей на тот же вопрос или тему)."""
+    signature = plagiarism_index.signature(text)
+    if signature is None:
+        return None, []
+    return signature, plagiarism_index.query(signature, answer_scopes(question, topic), exclude_user=user_id)
+
+async def record_plagiarism(answer_id, user_id: int, question: str, topic: str, signature, matches):
+    """
+    Записывает найденные совпадения и добавляет сохранённый ответ в индекс.
+
+    Совпадения пишутся для любого проверенного ответа, даже если он не сохранён
+    (answer_id is None): повторная запись того же ответа — например, после
+    итоговой оценки из очереди — обновляет строку, а не дублирует её.
+    """
+    if signature is None:
+        return
+    if answer_id is not None:
+        plagiarism_index.add(answer_id, user_id, signature, answer_scopes(question, topic))
+    if not matches:
+        return
+    metrics.inc("plagiarism_matches", len(matches))
+    logging.warning(f"[Plagiarism] Ответ #{answer_id or '—'} user={user_id} совпал с "
+                    + ", ".join(f"#{a} user={u} ({s:.2f})" for a, u, s in matches[:3]))
+    try:
+        async with db_pool.acquire() as conn:
+            await conn.executemany('''
+                INSERT INTO plagiarism_matches
+                    (answer_id, matched_answer_id, user_id, matched_user_id, similarity, question)
+                VALUES ($1, $2, $3, $4, $5, $6)
+                ON CONFLICT (user_id, md5(question), matched_answer_id) DO UPDATE
+                SET answer_id = COALESCE(EXCLUDED.answer_id, plagiarism_matches.answer_id),
+                    similarity = GREATEST(plagiarism_matches.similarity, EXCLUDED.similarity)
+            ''', [(answer_id, other_id, user_id, other_user, similarity, question)
+                  for other_id, other_user, similarity in matches])
     except Exception as e:
-        logging.warning(f"[AntiCheat] Perplexity error: {e}")
-    # ────────────────────────────────────────────────────────────────────
+        logging.error(f"[Plagiarism] Не удалось сохранить совпадения ответа user={user_id}: {e}")
 
-    # 2) Основная логика оценки
+async def load_plagiarism_index(batch_size: int = 1000):
+    """Досчитывает сигнатуры старых ответов и собирает индекс из answers.minhash."""
+    backfilled = 0
+    async with db_pool.acquire() as conn:
+        while True:
+            rows = await conn.fetch('''
+                SELECT id, answer FROM answers WHERE minhash IS NULL ORDER BY id LIMIT $1
+            ''', batch_size)
+            if not rows:
+                break
+            await conn.executemany(
+                "UPDATE answers SET minhash = $2 WHERE id = $1",
+                [(r["id"], plagiarism_index.to_bytes(plagiarism_index.signature(r["answer"]))) for r in rows]
+            )
+            backfilled += len(rows)
+        rows = await conn.fetch('''
+            SELECT id, user_id, question, topic, minhash FROM answers
+            WHERE length(minhash) > 0 ORDER BY id
+        ''')
+    if backfilled:
+        logging.info(f"[Plagiarism] Посчитаны сигнатуры {backfilled} старых ответов")
+    plagiarism_index.load((r["id"], r["user_id"], r["question"], r["topic"], r["minhash"]) for r in rows)
+
+async def refresh_plagiarism_index(overlap: int = PLAGIARISM_REFRESH_OVERLAP):
+    """
+    Дочитывает в индекс ответы, сохранённые после последнего чтения, — в том числе другими
+    репликами. Последние overlap id перечитываются: транзакция с меньшим id может
+    закоммититься позже соседней; уже известные ответы индекс пропускает.
+    """
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch('''
+            SELECT id, user_id, question, topic, minhash FROM answers
+            WHERE id > $1 AND length(minhash) > 0 ORDER BY id
+        ''', plagiarism_index.last_id - overlap)
+    added = plagiarism_index.extend((r["id"], r["user_id"], r["question"], r["topic"], r["minhash"]) for r in rows)
+    if added:
+        logging.info(f"[Plagiarism] Дочитано ответов в индекс: {added}, всего: {len(plagiarism_index)}")
+    return added
+
+async def run_plagiarism_refresher(interval: float = PLAGIARISM_REFRESH_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await refresh_plagiarism_index()
+        except Exception as e:
+            logging.warning(f"[Plagiarism] Не удалось обновить индекс: {e}")
+
+async def process_answer(message: Message, state: FSMContext, text: str, status: Message):
+    """Общий путь для текстовых и голосовых ответов."""
     data       = await state.get_data()
     grade      = data.get("grade")
     question   = data.get("question")
@@ -1204,192 +1853,136 @@ async def handle_task_answer(message: Message, state: FSMContext):
         await message.answer("⚠️ Пользователь не найден.", reply_markup=get_main_menu())
         return
 
-    if detect_gpt_phrases(text):
-        await status.delete()
-        await message.answer("⚠️ Переформулируйте ответ своими словами.", reply_markup=NAV_KB_AFTER_ANSWER)
-        return
-
-    feedback_raw = await evaluate_answer(question, text, user["name"])
-    if not feedback_raw or "Ошибка" in feedback_raw:
+    # Анти-чит и оценка идут параллельно; первый отказ отменяет оценку.
+    # Feedback показываем по мере генерации прямо в статусном сообщении
+    editor = StreamingEditor(status, header="⏳ Оцениваю ваш ответ…\n\n💬 ")
+    result = await run_answer_pipeline(
+        {
+            "ai_classifier": lambda: check_ai_classifier(text),
+            "perplexity":    lambda: check_perplexity(text),
+            "gpt_phrases":   lambda: check_gpt_phrases(text),
+            "similarity":    lambda: check_similarity(text, question, grade),
+        },
+        lambda: evaluate_answer(question, text, user["name"], on_feedback=editor.update),
+        label=f"user={message.from_user.id}"
+    )
+    if result.rejected:
         await status.delete()
-        await message.answer("❌ Ошибка оценки. Попробуйте позже.", reply_markup=get_main_menu())
-        await state.clear()
+        await message.answer(format_rejection(result.rejection), parse_mode="HTML", reply_markup=NAV_KB_AFTER_ANSWER)
         return
 
-    # Парсинг критериев и подсчёт баллов
-    import re
-    pattern = r"Критерии:\s*(.*?)Итог:\s*([\d.]+)\s*Feedback:\s*(.*)"
-    match = re.search(pattern, feedback_raw, re.DOTALL)
-    if match:
-        criteria_block = match.group(1).strip()
-        try:
-            new_score = float(match.group(2))
-        except:
-            new_score = 0.0
-        feedback_text = match.group(3).strip()
-    else:
-        criteria_block = ""
-        new_score = 0.0
-        feedback_text = feedback_raw.strip()
-
-    # ─── ANTI-CHEAT STEP 3: EMBEDDING-SIMILARITY ────────────────────────
-    correct = await generate_correct_answer(question, grade)
-    stud_emb = await asyncio.to_thread(client.embeddings.create,
-        model="text-embedding-ada-002", input=text)
-    corr_emb = await asyncio.to_thread(client.embeddings.create,
-        model="text-embedding-ada-002", input=correct)
-
-    v1 = stud_emb.data[0].embedding
-    v2 = corr_emb.data[0].embedding
-    dot = sum(a*b for a, b in zip(v1, v2))
-    norm1 = math.sqrt(sum(a*a for a in v1))
-    norm2 = math.sqrt(sum(b*b for b in v2))
-    cos_sim = dot / (norm1 * norm2) if norm1 and norm2 else 0.0
-    if cos_sim >= SIMILARITY_THRESHOLD:
-        await status.delete()
-        result_msg = (
-            "<b>📊 Критерии:</b>\n"
-            "• Соответствие вопросу: 0.00\n\n"
-            "<b>🧮 Оценка (Score):</b> <code>0.00</code>\n\n"
-            "<b>💬 Обратная связь (Feedback):</b>\n"
-            "Ваш ответ слишком близок к эталонному — вероятно, скопирован из ИИ. "
-            "Пожалуйста, пишите ответ своими словами. За обман предусмотрена блокировка."
+    evaluation = result.evaluation
+    # Условие подозрительности: слишком короткий или слишком быстрый ответ
+    question_time = data.get("question_time", time.time())
+    is_suspicious = len(text.strip()) < 30 or (time.time() - question_time) < 120
+    topic = data.get("selected_topic", "—")
+    is_academy = bool(data.get("is_academy_task"))
+    # ...или почти совпадающий с чужим ответом на тот же вопрос/тему
+    signature, matches = find_plagiarism(message.from_user.id, question, topic, text)
+    is_suspicious = is_suspicious or bool(matches)
+
+    queued = False
+    if evaluation is None:
+        # LLM недоступен или не ответил: сразу даём предварительную оценку,
+        # а ответ ставим в очередь — баллы начислятся по итоговой
+        evaluation = score_answer(question, text)
+        queued = await reevaluation.enqueue(
+            user_id=message.from_user.id, chat_id=message.chat.id, question=question, answer=text,
+            grade=grade, topic=topic, is_academy=is_academy, is_suspicious=is_suspicious,
+            last_score=last_score, provisional_score=evaluation.score
         )
-        await message.answer(result_msg, parse_mode="HTML", reply_markup=NAV_KB_AFTER_ANSWER)
-        return
+
+    new_score = evaluation.score
 
     # Сохранение и финальный вывод
-    increment = new_score - last_score
-    if increment > 0:
-        if data.get("is_academy_task"):
-            await update_academy_topic_points(message.from_user.id, data.get("selected_topic"), increment)
-            await update_user_academy_points(message.from_user.id, increment)
-        await update_user_points(message.from_user.id, increment)
-        await update_level(message.from_user.id)
-        await save_user_answer(
+    committed = None
+    # Сколько начислить, решает commit_score по лучшему засчитанному баллу за вопрос
+    if new_score > last_score and not evaluation.provisional:
+        committed = await commit_score(
             user_id=message.from_user.id,
             question=question,
             answer=text,
             grade=grade,
-            topic=data.get("selected_topic", "—"),
+            topic=topic,
             score=new_score,
-            state=state
+            last_score=last_score,
+            is_academy=is_academy,
+            is_suspicious=is_suspicious,
+            criteria=evaluation.criteria,
+            minhash=plagiarism_index.to_bytes(signature)
         )
         await state.update_data(last_score=new_score)
+    # Совпадения фиксируем и для предварительных, отложенных и не давших прироста ответов
+    await record_plagiarism((committed or {}).get("answer_id"), message.from_user.id, question, topic,
+                            signature, matches)
 
-    result_msg = ""
-    if criteria_block:
-        result_msg += f"<b>📊 Критерии:</b>\n{criteria_block}\n\n"
-    result_msg += f"<b>🧮 Оценка (Score):</b> <code>{round(new_score,2)}</code>\n\n"
-    result_msg += f"<b>💬 Обратная связь (Feedback):</b>\n{feedback_text}"
+    result_msg = format_evaluation(evaluation, committed)
+    if evaluation.provisional:
+        result_msg = (
+            "<b>⚠️ Предварительная оценка</b> — сервис оценки сейчас недоступен.\n"
+            + ("Итоговую оценку пришлём отдельным сообщением, баллы начислим по ней.\n\n" if queued
+               else "Баллы не начислены — попробуйте ответить ещё раз чуть позже.\n\n")
+            + result_msg
+        )
 
-    await status.delete()
-    await message.answer(result_msg, parse_mode="HTML", reply_markup=NAV_KB_AFTER_ANSWER)
+    # Финальная версия заменяет потоковый текст в том же сообщении
+    await editor.finish(result_msg, parse_mode="HTML", reply_markup=NAV_KB_AFTER_ANSWER)
     await state.update_data(last_question=question, last_grade=grade)
     await state.set_state(TaskState.waiting_for_answer)
 
-@router.message(StateFilter(TaskState.waiting_for_voice), F.content_type == types.ContentType.VOICE)
-async def process_voice_message(message: Message, state: FSMContext):
-    logging.debug("🚀 Началась обработка голосового сообщения")
-
-    # 1. Уведомляем пользователя
-    status = await message.answer("⏳ Обрабатываю голосовое сообщение...")
-
+def format_evaluation(evaluation, committed: dict = None) -> str:
+    result_msg = f"<b>📊 Критерии:</b>\n{evaluation.criteria_block()}\n\n"
+    result_msg += f"<b>🧮 Оценка (Score):</b> <code>{round(evaluation.score, 2)}</code>\n\n"
+    result_msg += f"<b>💬 Обратная связь (Feedback):</b>\n{html.escape(evaluation.feedback)}"
+    if committed:
+        result_msg += (
+            f"\n\n⭐ Баллы: {round(committed['points'], 2)} | "
+            f"🎯 {committed['level']} | 🏆 {committed['rank']}-е место"
+        )
+        if committed["level"] != committed["old_level"]:
+            result_msg += f"\n🎉 Новый уровень: <b>{committed['level']}</b>!"
+    return result_msg
+
+async def apply_reevaluation(row, evaluation):
+    """Итоговая оценка ответа из очереди: начисляем баллы и сообщаем пользователю."""
+    committed = None
+    # Пока ответ ждал оценки, могли появиться новые ответы — сверяемся с индексом заново
+    signature, matches = find_plagiarism(row["user_id"], row["question"], row["topic"], row["answer"])
+    # Пока ответ ждал, пользователь мог ответить на вопрос ещё раз и получить баллы:
+    # commit_score начислит только превышение над лучшим засчитанным баллом
+    if evaluation.score > (row["last_score"] or 0.0):
+        committed = await commit_score(
+            user_id=row["user_id"],
+            question=row["question"],
+            answer=row["answer"],
+            grade=row["grade"],
+            topic=row["topic"],
+            score=evaluation.score,
+            last_score=row["last_score"],
+            is_academy=row["is_academy"],
+            is_suspicious=row["is_suspicious"] or bool(matches),
+            criteria=evaluation.criteria,
+            minhash=plagiarism_index.to_bytes(signature)
+        )
+        # Если пользователь всё ещё на этом вопросе — следующий ответ считаем от итоговой оценки
+        context = dp.fsm.get_context(bot=bot, chat_id=row["chat_id"], user_id=row["user_id"])
+        data = await context.get_data()
+        if data.get("question") == row["question"] and data.get("last_score", 0.0) < evaluation.score:
+            await context.update_data(last_score=evaluation.score)
+
+    question = row["question"]
+    if len(question) > 200:
+        question = question[:200] + "…"
     try:
-        # 2. Получаем файл с сервера Telegram
-        file = await bot.get_file(message.voice.file_id)
-
-        # 3. Сохраняем во временный файл
-        import tempfile
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".ogg") as tmp:
-            temp_path = tmp.name
-        await bot.download_file(file.file_path, destination=temp_path)
-        logging.debug(f"📁 Файл сохранён: {temp_path}")
-
-        # 4. Транскрибируем с помощью Whisper
-        logging.debug("🎙 Отправка в transcribe_audio...")
-        text = await transcribe_audio(temp_path)
-
-        # 5. Удаляем временный файл
-        os.remove(temp_path)
-        logging.debug("🧹 Временный файл удалён")
-
-        # 6. Показываем результат пользователю
-        await status.delete()
-        await message.answer(f"📝 Расшифровка: «{text}»")
-
-    except Exception as e:
-        logging.exception(f"❌ Ошибка при обработке голосового: {e}")
-        await status.delete()
-        await message.answer("❌ Не удалось обработать голосовое сообщение. Попробуйте ещё раз.")
-        return
-
-    # проверка на «слишком ИИ»
-    if detect_gpt_phrases(text):
-        await message.answer("⚠️ Пожалуйста, пишите ответ своими словами. За обман предусмотрена блокировка", reply_markup=get_main_menu())
-        await state.clear()
-        return
-
-    data       = await state.get_data()
-    question   = data.get("question")
-    grade      = data.get("grade")
-    last_score = data.get("last_score", 0.0)
-    user       = await get_user_from_db(message.from_user.id)
-
-    if not user or not grade or not question:
-        await message.answer("⚠️ Нет данных для оценки.", reply_markup=get_main_menu())
-        return
-
-    feedback_raw = await evaluate_answer(question, text, user["name"])
-    if not feedback_raw or "Ошибка" in feedback_raw:
-        await message.answer("❌ Ошибка оценки.", reply_markup=get_main_menu())
-        await state.clear()
-        return
-
-    import re
-    pattern = r"Критерии:\s*(.*?)Итог:\s*([\d.]+)\s*Feedback:\s*(.*)"
-    match = re.search(pattern, feedback_raw, re.DOTALL)
-    if match:
-        criteria = match.group(1).strip()
-        try:
-            new_score = float(match.group(2))
-        except:
-            new_score = 0.0
-        feedback_text = match.group(3).strip()
-    else:
-        criteria = ""
-        new_score = 0.0
-        feedback_text = feedback_raw.strip()
-
-    increment = new_score - last_score
-    if increment > 0:
-        if data.get("is_academy_task"):
-            await update_academy_topic_points(message.from_user.id, data.get("selected_topic"), increment)
-            await update_user_academy_points(message.from_user.id, increment)
-        await update_user_points(message.from_user.id, increment)
-
-        await update_level(message.from_user.id)
-        await save_user_answer(
-            user_id=message.from_user.id,
-            question=question,
-            answer=text,
-            grade=grade,
-            topic=data.get("selected_topic", "—"),
-            score=new_score,
-            state=state
+        await bot.send_message(
+            row["chat_id"],
+            f"✅ <b>Итоговая оценка</b> ответа на задание:\n<i>{html.escape(question)}</i>\n\n"
+            + format_evaluation(evaluation, committed),
+            parse_mode="HTML"
         )
-        await state.update_data(last_score=new_score)
-
-    # Отправляем результат
-    result_msg = ""
-    if criteria:
-        result_msg += f"<b>📊 Критерии:</b>\n{criteria}\n\n"
-    result_msg += f"<b>🧮 Оценка:</b> <code>{round(new_score,2)}</code>\n\n"
-    result_msg += f"<b>💬 Обратная связь:</b>\n{feedback_text}"
-
-    await message.answer(result_msg, parse_mode="HTML", reply_markup=NAV_KB_AFTER_ANSWER)
-    await state.update_data(last_question=question, last_grade=grade)
-    await state.set_state(TaskState.waiting_for_answer)
+    except Exception as e:
+        # Баллы уже начислены — из очереди ответ всё равно убираем
+        logging.warning(f"[Reevaluation] Не удалось отправить итог user={row['user_id']}: {e}")
 
 # --------------------------
 # Функции для работы с OpenAI
@@ -1435,8 +2028,7 @@ async def generate_question(grade: str, topic: str, name: str) -> str:
         """.strip()
 
     try:
-        response = await asyncio.to_thread(
-            client.chat.completions.create,
+        text = await llm_gateway.chat(
             model="gpt-3.5-turbo",
             messages=[
                 {
@@ -1449,10 +2041,10 @@ async def generate_question(grade: str, topic: str, name: str) -> str:
                 },
                 {"role": "user", "content": user_prompt}
             ],
+            priority=Priority.GENERATION,
             max_tokens=350,
             temperature=0.9
         )
-        text = response.choices[0].message.content.strip()
         return text[:800] if len(text) > 800 else text
 
     except Exception as e:
@@ -1491,8 +2083,7 @@ async def generate_academy_question(main_topic: str, subtopic: str, name: str) -
 - Только текст задания, до 800 символов, без приветствий.
         """.strip()
     try:
-        response = await asyncio.to_thread(
-            client.chat.completions.create,
+        text = await llm_gateway.chat(
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": (
@@ -1500,91 +2091,78 @@ async def generate_academy_question(main_topic: str, subtopic: str, name: str) -
                 )},
                 {"role": "user", "content": prompt}
             ],
+            priority=Priority.GENERATION,
             max_tokens=400,
             temperature=0.7
         )
-        text = response.choices[0].message.content.strip()
         return text[:800] if len(text) > 800 else text
     except Exception as e:
         logging.error(f"Ошибка генерации задания Академии: {e}")
         return "❌ Ошибка генерации задания Академии. Попробуйте чуть позже."
 
-async def evaluate_answer(question: str, student_answer: str, student_name: str) -> str:
-    prompt = (
-        f"Вопрос: {question}\n"
-        f"Ответ студента: {student_answer}\n\n"
-        "Проанализируй ответ пользователя по следующей схеме. "
-        "Всего 5 критериев. Каждый оценивается от 0 до 0.2 баллов (шаг 0.05). "
-        "Если критерий 'Соответствие вопросу' равен 0.0 — остальные не учитываются, и итоговая оценка = 0.0. "
-        "Если он больше 0.0, оцени остальные 4 критерия.\n\n"
-        "Критерии:\n"
-        "• Соответствие вопросу\n"
-        "• Полнота\n"
-        "• Аргументация\n"
-        "• Структура\n"
-        "• Примеры\n\n"
-        "Ответ строго в формате:\n\n"
-        "Критерии:\n"
-        "• Соответствие вопросу: <балл>\n"
-        "• Полнота: <балл>\n"
-        "• Аргументация: <балл>\n"
-        "• Структура: <балл>\n"
-        "• Примеры: <балл>\n\n"
-        "Итог: <сумма баллов>\n"
-        "Feedback: <текстовая обратная связь для пользователя>\n\n"
-        "Поясни в Feedback, что именно не так (если есть недочёты), или похвали за хорошую работу (если всё ок)."
-    )
-
-    try:
-        response = await asyncio.to_thread(
-            client.chat.completions.create,
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Ты строгий преподаватель. Не здоровайся, сразу давай оценку без лишних слов."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=450,
-            temperature=0.3
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        logging.error(f"Ошибка оценки ответа: {e}")
-        return "❌ Ошибка оценки ответа."
-
-async def generate_correct_answer(question: str, grade: str) -> str:
+async def stream_correct_answer(question: str, grade: str):
+    """Эталонный ответ по частям (асинхронный генератор фрагментов текста)."""
     prompt = (
         f"Приведи полностью развернутый правильный ответ для уровня {grade} на следующий вопрос:\n\n"
         f"{question}\n\n"
         "Отвечай строго по делу, без оценочных комментариев, приветствий или лишних пояснений. Дай только эталонное решение."
     )
-    try:
-        response = await asyncio.to_thread(
-            client.chat.completions.create,
-            model="gpt-3.5-turbo",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "Ты опытный преподаватель продакт-менеджмента. Твой ответ должен содержать только правильное, структурированное и подробное решение, без оценок, приветствий и лишних комментариев."
-                },
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=1000,
-            temperature=0.3
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        logging.error(f"Ошибка генерации эталонного ответа: {e}")
-        return "❌ Ошибка генерации эталонного ответа."
-
-async def transcribe_audio(file_path: str) -> str:
-    with open(file_path, "rb") as audio_file:
-        response = await asyncio.to_thread(
-            client.audio.transcriptions.create,
-            model="whisper-1",
-            file=audio_file,
-            language="ru"
-        )
-    return response.text
+    # Ошибки обрабатывает ReferenceAnswerStore: он же решает, запоминать ли результат
+    async for chunk in llm_gateway.chat_stream(
+        model="gpt-3.5-turbo",
+        messages=[
+            {
+                "role": "system",
+                "content": "Ты опытный преподаватель продакт-менеджмента. Твой ответ должен содержать только правильное, структурированное и подробное решение, без оценок, приветствий и лишних комментариев."
+            },
+            {"role": "user", "content": prompt}
+        ],
+        priority=Priority.GENERATION,
+        max_tokens=1000,
+        temperature=0.3
+    ):
+        yield chunk
+
+# --------------------------
+# Пул заранее сгенерированных вопросов
+# --------------------------
+
+async def next_question(grade: str, topic: str, name: str) -> str:
+    """Вопрос из пула за миллисекунды; при промахе — живая генерация."""
+    question = question_pool.take(("grade", grade, topic))
+    if question is None:
+        question = await generate_question(grade, topic, name)
+    return question
+
+async def next_academy_question(main_topic: str, subtopic: str, name: str) -> str:
+    question = question_pool.take(("academy", main_topic, subtopic))
+    if question is None:
+        question = await generate_academy_question(main_topic, subtopic, name)
+    return question
+
+def setup_question_pool():
+    # Имя в промпте Академии для заготовок обезличенное — вопрос выдаётся любому ученику
+    for grade in LEVELS:
+        for topic in TOPICS:
+            question_pool.register(
+                ("grade", grade, topic),
+                lambda g=grade, t=topic: with_priority(Priority.BACKGROUND, generate_question(g, t, "студент"))
+            )
+    for main_topic, subtopics in ACADEMY_SUBTOPICS.items():
+        for _, subtopic_name in subtopics:
+            question_pool.register(
+                ("academy", main_topic, subtopic_name),
+                lambda m=main_topic, st=subtopic_name: with_priority(
+                    Priority.BACKGROUND, generate_academy_question(m, st, "студент")
+                )
+            )
+
+async def transcribe_audio(audio) -> str:
+    """audio — путь к файлу, файловый объект или кортеж (имя, файловый объект)."""
+    if isinstance(audio, str):
+        with open(audio, "rb") as audio_file:
+            return await llm_gateway.transcribe(audio_file, model="whisper-1", language="ru")
+    return await llm_gateway.transcribe(audio, model="whisper-1", language="ru")
 
 # --------------------------
 # Автостарт при любой активности вне FSM
@@ -1614,75 +2192,60 @@ async def catch_all(message: Message, state: FSMContext):
             await message.answer("👋 Привет! Давай зарегистрируемся. Как тебя зовут?")
             await state.set_state(RegisterState.name)
 
-async def get_or_generate_analytics(user_id: int):
+async def get_user_analytics(user_id: int):
+    """Строка analytics поддерживается commit_score на каждом ответе — здесь только чтение."""
     async with db_pool.acquire() as conn:
-        existing = await conn.fetchrow(
-            "SELECT * FROM analytics WHERE user_id = $1", user_id
-        )
-        if existing:
-            return existing
-
-        # Примерно считаем средние значения — можно заменить на реальные вычисления
-        averages = await conn.fetchrow('''
-            SELECT 
-                ROUND(AVG(score)::numeric, 2) as avg_score
-            FROM answers
-            WHERE user_id = $1
-        ''', user_id)
-
-
-        # Заглушка по критериям — ты можешь позже это детализировать
-        analytics = {
-            "tasks_done": await conn.fetchval("SELECT COUNT(*) FROM answers WHERE user_id = $1", user_id),
-            "average_score": averages["avg_score"] or 0,
-            "criteria_relevance": 0.18,
-            "criteria_completeness": 0.14,
-            "criteria_argumentation": 0.16,
-            "criteria_structure": 0.11,
-            "criteria_examples": 0.08,
-            "percentile": 68,
-            "next_target": 15,
-        }
-
-        # Сохраняем в таблицу
-        await conn.execute('''
-            INSERT INTO analytics (user_id, tasks_done, average_score, 
-            criteria_relevance, criteria_completeness, criteria_argumentation, 
-            criteria_structure, criteria_examples, percentile, next_target)
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
-        ''', user_id, *analytics.values())
-
-        return analytics
-
-def format_progress_analytics(user, data):
-    return (
+        row = await conn.fetchrow("SELECT * FROM analytics WHERE user_id = $1", user_id)
+    return dict(row) if row else {"tasks_done": 0, "criteria_count": 0}
+
+def points_to_next_level(level: str, points: float):
+    """Сколько баллов осталось до следующего уровня; None — уровень уже максимальный."""
+    if level not in LEVELS or level == LEVELS[-1]:
+        return None
+    threshold = (LEVELS.index(level) + 1) * LEVEL_STEP_POINTS
+    return max(0.0, threshold - (points or 0.0))
+
+def criterion_comment(value: float) -> str:
+    share = value / CRITERION_MAX
+    if share >= 0.8:
+        return "сильная сторона 🔥"
+    if share >= 0.5:
+        return "неплохо, но есть куда расти"
+    return "стоит подтянуть"
+
+def format_progress_analytics(user, data, percentile=None, level_percentile=None):
+    text = (
         f"<b>📊 Твоя аналитика прогресса</b>\n\n"
-        f"<b>📍 Всего заданий пройдено:</b> {data['tasks_done']}\n"
+        f"<b>📍 Всего заданий пройдено:</b> {data.get('tasks_done') or 0}\n"
         f"<b>🎓 Текущий уровень:</b> {user['level']}\n"
         f"<b>⭐ Общий балл:</b> {round(user['points'], 2)}\n\n"
-        f"🔍 <b>Критерии оценки:</b>\n\n"
-        f"• <b>Соответствие вопросу:</b> {round(data['criteria_relevance'], 2)} / 0.20 — ты почти всегда в точку! 🔥\n"
-        f"• <b>Полнота:</b> {round(data['criteria_completeness'], 2)} — немного не раскрываешь мысль до конца\n"
-        f"• <b>Аргументация:</b> {round(data['criteria_argumentation'], 2)} — у тебя хорошие логические цепочки\n"
-        f"• <b>Структура:</b> {round(data['criteria_structure'], 2)} — иногда теряется логика\n"
-        f"• <b>Примеры:</b> {round(data['criteria_examples'], 2)} — добавь больше конкретики\n\n"
-        f"🎯 <b>Суперсила:</b> попадание в суть задачи\n"
-        f"🧱 <b>Зона роста:</b> примеры и структура\n\n"
-        f"📈 <b>Ты лучше, чем {data['percentile']}% пользователей</b>\n"
-        f"🧭 <b>Цель:</b> +{data['next_target']} баллов до следующего уровня 🚀\n\n"
-        f"<i>📌 Обновление аналитики происходит раз в неделю</i>"
     )
 
-def detect_gpt_phrases(text: str) -> bool:
-    suspicious_phrases = re.compile(
-        r"это важный аспект для рассмотрения|данный подход позволяет|"
-        r"таким образом можно охарактеризовать|можно выделить несколько ключевых моментов|"
-        r"рассмотрим подробнее|это свидетельствует о|необходимо подчеркнуть|"
-        r"представляется логичным|в рамках данного контекста|"
-        r"представим ситуацию, при которой",
-        re.IGNORECASE
-    )
-    return bool(suspicious_phrases.search(text))
+    if data.get("criteria_count"):
+        averages = {key: data[f"criteria_{key}"] or 0.0 for key, _ in CRITERIA}
+        titles = dict(CRITERIA)
+        text += "🔍 <b>Критерии оценки</b> (среднее из 0.20):\n\n"
+        for key, title in CRITERIA:
+            text += f"• <b>{title}:</b> {round(averages[key], 2)} — {criterion_comment(averages[key])}\n"
+        ranked = sorted(averages, key=averages.get, reverse=True)
+        text += (
+            f"\n🎯 <b>Суперсила:</b> {titles[ranked[0]].lower()}\n"
+            f"🧱 <b>Зона роста:</b> {titles[ranked[-1]].lower()} и {titles[ranked[-2]].lower()}\n\n"
+        )
+    else:
+        text += "🔍 Оценки по критериям появятся после первого засчитанного ответа.\n\n"
+
+    if percentile is not None:
+        text += f"📈 <b>Ты лучше, чем {round(percentile)}% пользователей</b>\n"
+    if level_percentile is not None:
+        text += f"🎓 <b>Среди уровня {user['level']}:</b> лучше, чем {round(level_percentile)}%\n"
+    to_next = points_to_next_level(user["level"], user["points"])
+    if to_next is None:
+        text += "🏁 <b>Ты на максимальном уровне!</b>\n\n"
+    else:
+        text += f"🧭 <b>Цель:</b> +{round(to_next, 2)} баллов до следующего уровня 🚀\n\n"
+    text += "<i>📌 Аналитика обновляется после каждого засчитанного ответа</i>"
+    return text
 
 # --------------------------
 # Запуск бота
@@ -1690,8 +2253,76 @@ def detect_gpt_phrases(text: str) -> bool:
 
 async def on_startup():
     await create_db_pool()
-    await dp.start_polling(bot, skip_updates=True)
+    load_perplexity_model()
+    load_ai_classifier()
+    reference_answers.attach_pool(db_pool)
+    leaderboard.attach_pool(db_pool)
+    await load_rank_index()
+    await load_plagiarism_index()
+    score_histogram.attach_pool(db_pool)
+    transcripts.attach_pool(db_pool)
+    reevaluation.attach_pool(db_pool)
+    await score_histogram.load()
+    if isinstance(storage, PostgresStorage):
+        storage.attach_pool(db_pool)
+        await storage.start()
+    broadcaster.attach_pool(db_pool)
+    await broadcaster.resume()
+    setup_question_pool()
+    await question_pool.start()
+    inactivity_flusher = asyncio.create_task(inactivity.run_flusher(storage))
+    sweeper_task = asyncio.create_task(session_sweeper.run())
+    histogram_saver = asyncio.create_task(score_histogram.run_saver())
+    reevaluation_task = asyncio.create_task(reevaluation.run())
+    plagiarism_refresher = asyncio.create_task(run_plagiarism_refresher())
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            await dp.start_polling(bot, skip_updates=True)
+    finally:
+        await broadcaster.stop()
+        sweeper_task.cancel()
+        inactivity_flusher.cancel()
+        histogram_saver.cancel()
+        reevaluation_task.cancel()
+        plagiarism_refresher.cancel()
+        await asyncio.gather(sweeper_task, inactivity_flusher, histogram_saver, reevaluation_task,
+                             plagiarism_refresher, return_exceptions=True)
+        await question_pool.stop()
+        await llm_gateway.close()
+
+async def run_webhook():
+    if not WEBHOOK_URL or not WEBHOOK_SECRET:
+        raise RuntimeError("Для BOT_MODE=webhook нужны WEBHOOK_URL и WEBHOOK_SECRET")
+    server = WebhookServer(
+        dp, bot,
+        secret=WEBHOOK_SECRET,
+        path=WEBHOOK_PATH,
+        queue_size=WEBHOOK_QUEUE_SIZE,
+        workers=WEBHOOK_WORKERS,
+        metrics_host=METRICS_HOST,
+        metrics_port=METRICS_PORT
+    )
+    await dp.emit_startup(bot=bot)
+    await ensure_webhook(bot, WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, WEBHOOK_SECRET)
+    try:
+        await server.serve(WEBHOOK_HOST, WEBHOOK_PORT)
+    finally:
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+
+def run():
+    # uvloop приезжает вместе с aiogram[fast]; без него — обычный asyncio
+    try:
+        import uvloop
+    except ImportError:
+        uvloop = None
+    if uvloop is not None and hasattr(uvloop, "run"):
+        uvloop.run(on_startup())
+    else:
+        asyncio.run(on_startup())
 
 if __name__ == "__main__":
     print("=== Запускаем бота ===")
-    asyncio.run(on_startup())
+    run()
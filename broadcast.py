@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from metrics import metrics
+
+CANCEL_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="⛔ Остановить рассылку", callback_data="broadcast_cancel")]
+])
+
+
+def format_eta(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600} ч {seconds % 3600 // 60} мин"
+    if seconds >= 60:
+        return f"{seconds // 60} мин {seconds % 60} сек"
+    return f"{seconds} сек"
+
+
+class Broadcaster:
+    """
+    Рассылка сообщения по всей базе пользователей.
+
+    - Получатели читаются страницами по page_size (keyset: id > последний обработанный),
+      поэтому в памяти никогда не лежит вся таблица и не висит долгая транзакция.
+    - Общий темп задаёт RateLimiter (глобальный лимит бота), внутри страницы
+      одновременно летит не больше concurrency запросов.
+    - RetryAfter ставит на паузу всю рассылку; повтор в тот же чат — не раньше
+      чем через chat_interval секунд (лимит Telegram на один чат).
+    - Прогресс пишется в broadcasts каждые concurrency отправок: last_user_id —
+      наибольший id, до которого включительно всё уже отправлено (непрерывный
+      префикс страницы). После рестарта resume() продолжает с него, так что
+      повторно сообщение могут получить не больше concurrency человек, чьи
+      отправки были в полёте (доставка «хотя бы раз»).
+    - Заблокировавшие бота помечаются users.is_blocked и в следующие рассылки не попадают.
+    - Рассылку ведёт одна реплика: она держит advisory-блокировку на id рассылки,
+      пока шлёт (блокировка снимается и при падении процесса). При каждой записи
+      прогресса проверяется статус — отмена с любой реплики останавливает отправку.
+    """
+
+    def __init__(self, bot: Bot, limiter, concurrency: int = 20, page_size: int = 500,
+                 chat_interval: float = 1.0, max_attempts: int = 3, progress_interval: float = 5.0):
+        self.bot = bot
+        self.limiter = limiter
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.chat_interval = chat_interval
+        self.max_attempts = max_attempts
+        self.progress_interval = progress_interval
+        self._pool = None
+        self._task = None
+        self._paused_until = 0.0
+        self.current_id = None
+
+    def attach_pool(self, pool):
+        self._pool = pool
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    # --------------------------
+    # Управление
+    # --------------------------
+
+    async def create(self, text: str, created_by: int, progress_chat_id: int, progress_message_id: int) -> int:
+        async with self._pool.acquire() as conn:
+            return await conn.fetchval('''
+                INSERT INTO broadcasts (text, created_by, total, progress_chat_id, progress_message_id)
+                SELECT $1, $2, COUNT(*), $3, $4 FROM users WHERE is_blocked IS NOT TRUE
+                RETURNING id
+            ''', text, created_by, progress_chat_id, progress_message_id)
+
+    def start(self, broadcast_id: int):
+        if self.running:
+            raise RuntimeError("Рассылка уже идёт")
+        self.current_id = broadcast_id
+        self._task = asyncio.create_task(self._run(broadcast_id))
+
+    async def resume(self):
+        """Продолжает рассылку, прерванную рестартом (если её не ведёт другая реплика)."""
+        async with self._pool.acquire() as conn:
+            broadcast_id = await conn.fetchval(
+                "SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id LIMIT 1"
+            )
+        if broadcast_id and not self.running:
+            logging.info(f"[Broadcast] Продолжаем рассылку #{broadcast_id} после рестарта")
+            self.start(broadcast_id)
+
+    async def cancel(self):
+        """
+        Останавливает рассылку насовсем (в отличие от stop(), после рестарта она не продолжится).
+        Если рассылку ведёт другая реплика, она увидит статус перед следующей страницей.
+        """
+        async with self._pool.acquire() as conn:
+            await conn.execute('''
+                UPDATE broadcasts SET status = 'cancelled', finished_at = now()
+                WHERE status = 'running' AND ($1::int IS NULL OR id = $1)
+            ''', self.current_id if self.running else None)
+        await self.stop()
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def unblock(self, user_id: int):
+        """Пользователь снова пишет боту — значит, разблокировал его."""
+        async with self._pool.acquire() as conn:
+            await conn.execute("UPDATE users SET is_blocked = FALSE WHERE id = $1 AND is_blocked", user_id)
+
+    # --------------------------
+    # Отправка
+    # --------------------------
+
+    async def _run(self, broadcast_id: int):
+        async with self._pool.acquire() as lock_conn:
+            if not await lock_conn.fetchval("SELECT pg_try_advisory_lock(hashtext('broadcast'), $1)", broadcast_id):
+                logging.info(f"[Broadcast] Рассылку #{broadcast_id} ведёт другая реплика")
+                return
+            try:
+                await self._broadcast(broadcast_id)
+            finally:
+                await lock_conn.execute("SELECT pg_advisory_unlock(hashtext('broadcast'), $1)", broadcast_id)
+
+    async def _broadcast(self, broadcast_id: int):
+        async with self._pool.acquire() as conn:
+            row = await conn.fetchrow("SELECT * FROM broadcasts WHERE id = $1", broadcast_id)
+        if row is None or row["status"] != "running":
+            # Пока ждали блокировку, прежний владелец успел закончить или рассылку отменили
+            return
+        text = row["text"]
+        last_id = row["last_user_id"]
+        counts = {"sent": row["sent"], "failed": row["failed"], "blocked": row["blocked"]}
+        progress = {"chat_id": row["progress_chat_id"], "message_id": row["progress_message_id"],
+                    "total": row["total"], "started": time.monotonic(),
+                    "done_at_start": sum(counts.values()), "reported": 0.0}
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(index, chat_id):
+            async with semaphore:
+                return index, await self._send(chat_id, text)
+
+        while True:
+            async with self._pool.acquire() as conn:
+                status = await conn.fetchval("SELECT status FROM broadcasts WHERE id = $1", broadcast_id)
+                if status != "running":
+                    logging.info(f"[Broadcast] Рассылка #{broadcast_id} остановлена ({status}): {counts}")
+                    return
+                ids = [r["id"] for r in await conn.fetch('''
+                    SELECT id FROM users
+                    WHERE id > $1 AND is_blocked IS NOT TRUE
+                    ORDER BY id
+                    LIMIT $2
+                ''', last_id, self.page_size)]
+            if not ids:
+                break
+
+            tasks = [asyncio.create_task(send(i, chat_id)) for i, chat_id in enumerate(ids)]
+            results = [None] * len(ids)
+            done = saved = 0
+            newly_blocked = []
+            try:
+                for completed in asyncio.as_completed(tasks):
+                    index, result = await completed
+                    results[index] = result
+                    # Считаем только непрерывный префикс: он и станет точкой продолжения
+                    while done < len(ids) and results[done] is not None:
+                        counts[results[done]] += 1
+                        metrics.inc(f"broadcast_{results[done]}")
+                        if results[done] == "blocked":
+                            newly_blocked.append(ids[done])
+                        done += 1
+                    if done > saved and (done - saved >= self.concurrency or done == len(ids)):
+                        last_id = ids[done - 1]
+                        status = await self._checkpoint(broadcast_id, last_id, counts, newly_blocked)
+                        newly_blocked, saved = [], done
+                        if status != "running":
+                            logging.info(f"[Broadcast] Рассылка #{broadcast_id} остановлена ({status}): {counts}")
+                            return
+                        await self._report(broadcast_id, counts, progress)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+        async with self._pool.acquire() as conn:
+            await conn.execute(
+                "UPDATE broadcasts SET status = 'done', finished_at = now() WHERE id = $1", broadcast_id
+            )
+        logging.info(f"[Broadcast] Рассылка #{broadcast_id} завершена: {counts}")
+        await self._report(broadcast_id, counts, progress, finished=True)
+
+    async def _checkpoint(self, broadcast_id: int, last_id: int, counts: dict, newly_blocked: list) -> str:
+        """Сохраняет прогресс и возвращает текущий статус рассылки."""
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                if newly_blocked:
+                    await conn.execute(
+                        "UPDATE users SET is_blocked = TRUE WHERE id = ANY($1::bigint[])", newly_blocked
+                    )
+                return await conn.fetchval('''
+                    UPDATE broadcasts SET last_user_id = $2, sent = $3, failed = $4, blocked = $5
+                    WHERE id = $1
+                    RETURNING status
+                ''', broadcast_id, last_id, counts["sent"], counts["failed"], counts["blocked"])
+
+    async def _send(self, chat_id: int, text: str) -> str:
+        for attempt in range(self.max_attempts):
+            delay = self._paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self.limiter.acquire()
+            try:
+                await self.bot.send_message(chat_id, text)
+                return "sent"
+            except TelegramRetryAfter as e:
+                # Flood wait касается всего бота — притормаживаем всех отправителей
+                metrics.inc("broadcast_flood_waits")
+                logging.warning(f"[Broadcast] RetryAfter {e.retry_after} сек (чат {chat_id})")
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                await asyncio.sleep(max(e.retry_after, self.chat_interval))
+            except TelegramForbiddenError:
+                return "blocked"
+            except TelegramBadRequest as e:
+                logging.warning(f"[Broadcast] Не доставлено в чат {chat_id}: {e}")
+                return "failed"
+            except Exception as e:
+                logging.warning(f"[Broadcast] Ошибка отправки в чат {chat_id} (попытка {attempt + 1}): {e}")
+                await asyncio.sleep(self.chat_interval)
+        return "failed"
+
+    async def _report(self, broadcast_id: int, counts: dict, progress: dict, finished: bool = False):
+        now = time.monotonic()
+        if not finished and now - progress["reported"] < self.progress_interval:
+            return
+        progress["reported"] = now
+
+        done = sum(counts.values())
+        total = max(progress["total"] or 0, done)
+        elapsed = max(now - progress["started"], 1e-6)
+        rate = (done - progress["done_at_start"]) / elapsed
+        metrics.set_gauge("broadcast_rate", round(rate, 2))
+
+        lines = [
+            f"📨 Рассылка #{broadcast_id}" + (" завершена ✅" if finished else ""),
+            f"Обработано: {done} из {total} ({round(done / total * 100, 1) if total else 100}%)",
+            f"✅ Доставлено: {counts['sent']}",
+            f"🚫 Заблокировали бота: {counts['blocked']}",
+            f"⚠️ Ошибки: {counts['failed']}",
+            f"⚡ Скорость: {round(rate, 1)} сообщ./сек",
+        ]
+        if not finished and rate > 0:
+            lines.append(f"⏳ Осталось: ~{format_eta((total - done) / rate)}")
+
+        if progress["chat_id"] and progress["message_id"]:
+            try:
+                await self.bot.edit_message_text(
+                    "\n".join(lines), chat_id=progress["chat_id"], message_id=progress["message_id"],
+                    reply_markup=None if finished else CANCEL_KB
+                )
+            except Exception as e:
+                logging.debug(f"[Broadcast] Не удалось обновить прогресс: {e}")
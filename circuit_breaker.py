@@ -0,0 +1,144 @@
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from metrics import metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+STATE_GAUGE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """Запрос не отправлен: предохранитель разомкнут."""
+
+
+class CircuitBreaker:
+    """
+    Предохранитель по последним window вызовам.
+
+    Размыкается, когда среди них не меньше failure_ratio ошибок или
+    slow_ratio вызовов дольше slow_call_seconds (после min_calls вызовов).
+    В разомкнутом состоянии запросы сразу получают CircuitOpenError;
+    через open_seconds пропускается один пробный запрос (half-open):
+    успех замыкает цепь, ошибка или медленный ответ — размыкают снова.
+    """
+
+    def __init__(self, name: str, window: int = 20, min_calls: int = 5, failure_ratio: float = 0.5,
+                 slow_call_seconds: float = 15.0, slow_ratio: float = 0.5, open_seconds: float = 30.0,
+                 is_failure=None):
+        self.name = name
+        # Какие исключения говорят о сбое сервиса (а не об ошибке в самом запросе)
+        self.is_failure = is_failure or (lambda e: True)
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_ratio = slow_ratio
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self._calls = deque(maxlen=window)  # (ok, slow)
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        metrics.set_gauge(f"circuit_{name}_state", STATE_GAUGE[CLOSED])
+
+    def _transition(self, state: str, reason: str = ""):
+        if state == self.state:
+            return
+        logging.warning(f"[CircuitBreaker] {self.name}: {self.state} → {state}" + (f" ({reason})" if reason else ""))
+        self.state = state
+        metrics.set_gauge(f"circuit_{self.name}_state", STATE_GAUGE[state])
+        metrics.inc(f"circuit_{self.name}_{state}")
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        if state == CLOSED:
+            self._calls.clear()
+
+    @property
+    def available(self) -> bool:
+        """Пропустит ли предохранитель запрос прямо сейчас (без захвата пробы)."""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return time.monotonic() - self._opened_at >= self.open_seconds
+        return not self._probe_in_flight
+
+    def check(self):
+        """Бросает CircuitOpenError, если запрос сейчас не пройдёт; пробу half-open не занимает."""
+        if not self.available:
+            metrics.inc(f"circuit_{self.name}_rejected")
+            raise CircuitOpenError(f"{self.name}: предохранитель разомкнут")
+
+    def before_call(self):
+        """Вызывается перед запросом; бросает CircuitOpenError, если его нельзя отправлять."""
+        if self.state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN, "пробный запрос")
+            self._probe_in_flight = False
+        if self.state == OPEN or (self.state == HALF_OPEN and self._probe_in_flight):
+            metrics.inc(f"circuit_{self.name}_rejected")
+            raise CircuitOpenError(f"{self.name}: предохранитель разомкнут")
+        if self.state == HALF_OPEN:
+            self._probe_in_flight = True
+
+    def record(self, ok: bool, seconds: float):
+        slow = seconds >= self.slow_call_seconds
+        if self.state == HALF_OPEN:
+            self._probe_in_flight = False
+            if ok and not slow:
+                self._transition(CLOSED, "пробный запрос успешен")
+            else:
+                self._transition(OPEN, "пробный запрос не прошёл")
+            return
+        self._calls.append((ok, slow))
+        if self.state != CLOSED or len(self._calls) < self.min_calls:
+            return
+        failures = sum(1 for ok, _ in self._calls if not ok)
+        slow_calls = sum(1 for _, slow in self._calls if slow)
+        if failures >= self.failure_ratio * len(self._calls):
+            self._transition(OPEN, f"ошибок {failures}/{len(self._calls)}")
+        elif slow_calls >= self.slow_ratio * len(self._calls):
+            self._transition(OPEN, f"медленных ответов {slow_calls}/{len(self._calls)}")
+
+    @contextmanager
+    def track(self):
+        """
+        Контекст одного вызова под предохранителем. Для потоковых ответов
+        вызывающий отмечает первый фрагмент через responded() — задержка
+        считается до него, а не до конца генерации.
+        """
+        self.before_call()
+        call = _TrackedCall(self)
+        try:
+            yield call
+        except Exception as e:
+            call.finish(not self.is_failure(e))
+            raise
+        except BaseException:
+            # Отмена вызывающим — не сигнал о здоровье сервиса
+            if not call.recorded and self.state == HALF_OPEN:
+                self._probe_in_flight = False
+            raise
+        call.finish(True)
+
+    async def call(self, factory):
+        """Выполняет factory() (фабрику корутины) под предохранителем."""
+        with self.track():
+            return await factory()
+
+
+class _TrackedCall:
+    def __init__(self, breaker: CircuitBreaker):
+        self.breaker = breaker
+        self.started = time.monotonic()
+        self.recorded = False
+
+    def responded(self):
+        self.finish(True)
+
+    def finish(self, ok: bool):
+        if not self.recorded:
+            self.recorded = True
+            self.breaker.record(ok, time.monotonic() - self.started)
@@ -0,0 +1,148 @@
+import json
+import logging
+import re
+from dataclasses import dataclass
+
+import llm_gateway
+from llm_scheduler import Priority
+from metrics import metrics
+
+EVALUATION_MODEL = "gpt-3.5-turbo"
+
+# Критерии оценки ответа: (ключ в JSON и в БД, название для пользователя); максимум за каждый — 0.2
+CRITERIA = [
+    ("relevance",     "Соответствие вопросу"),
+    ("completeness",  "Полнота"),
+    ("argumentation", "Аргументация"),
+    ("structure",     "Структура"),
+    ("examples",      "Примеры"),
+]
+CRITERION_MAX = 0.2
+
+EVALUATION_SYSTEM_PROMPT = (
+    "Ты строгий преподаватель продакт-менеджмента. Оцени ответ студента по 5 критериям, "
+    "каждый от 0 до 0.2 с шагом 0.05: relevance (соответствие вопросу), completeness (полнота), "
+    "argumentation (аргументация), structure (структура), examples (примеры). "
+    "Если relevance = 0, все остальные тоже 0. "
+    "Верни только JSON: {\"relevance\": n, \"completeness\": n, \"argumentation\": n, "
+    "\"structure\": n, \"examples\": n, \"total\": сумма, \"feedback\": \"2–4 предложения по-русски: "
+    "что не так или за что похвалить\"}"
+)
+
+
+class EvaluationError(ValueError):
+    """Ответ модели не соответствует схеме оценки."""
+
+
+@dataclass
+class Evaluation:
+    criteria: dict          # ключ из CRITERIA -> балл
+    score: float            # пересчитан по критериям, а не взят из ответа модели
+    feedback: str
+    reported_total: float = None
+    provisional: bool = False   # эвристическая оценка, пока LLM недоступна
+
+    def criteria_block(self) -> str:
+        return "\n".join(f"• {title}: {self.criteria[key]:.2f}" for key, title in CRITERIA)
+
+
+def build_evaluation_messages(question: str, student_answer: str) -> list:
+    return [
+        {"role": "system", "content": EVALUATION_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Вопрос: {question}\n\nОтвет студента: {student_answer}"},
+    ]
+
+
+PARTIAL_FEEDBACK = re.compile(r'"feedback"\s*:\s*"((?:[^"\\]|\\.)*)')
+
+
+def partial_feedback(raw: str) -> str:
+    """Уже сгенерированная часть feedback из недописанного JSON (для потокового показа)."""
+    match = PARTIAL_FEEDBACK.search(raw)
+    if not match:
+        return ""
+    body = match.group(1)
+    # Обрезаем незаконченную escape-последовательность в конце
+    body = re.sub(r'\\(u[0-9a-fA-F]{0,3})?$', "", body)
+    try:
+        return json.loads(f'"{body}"')
+    except json.JSONDecodeError:
+        return ""
+
+
+def _number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def parse_evaluation(raw: str) -> Evaluation:
+    """Строго разбирает JSON-оценку; при любом отклонении от схемы — EvaluationError."""
+    try:
+        data = json.loads(raw)
+    except (TypeError, json.JSONDecodeError) as e:
+        raise EvaluationError(f"не JSON: {e}") from e
+    if not isinstance(data, dict):
+        raise EvaluationError("ожидался JSON-объект")
+
+    criteria = {}
+    for key, _ in CRITERIA:
+        value = data.get(key)
+        if not _number(value):
+            raise EvaluationError(f"нет числового критерия {key!r}")
+        if not 0.0 <= value <= CRITERION_MAX + 1e-9:
+            raise EvaluationError(f"критерий {key!r} вне диапазона: {value}")
+        criteria[key] = round(float(value), 2)
+
+    feedback = data.get("feedback")
+    if not isinstance(feedback, str) or not feedback.strip():
+        raise EvaluationError("нет feedback")
+
+    if criteria["relevance"] == 0.0:
+        criteria = {key: 0.0 for key in criteria}
+    score = round(sum(criteria.values()), 2)
+
+    reported = data.get("total")
+    if not _number(reported):
+        reported = None
+    elif abs(reported - score) > 0.011:
+        # Модель ошиблась в сложении — доверяем критериям
+        metrics.inc("evaluation_total_mismatch")
+        logging.info(f"[Evaluation] Итог модели {reported} ≠ сумме критериев {score}")
+    return Evaluation(criteria=criteria, score=score, feedback=feedback.strip(), reported_total=reported)
+
+
+async def _stream_raw(messages: list, on_feedback, **kwargs) -> str:
+    parts = []
+    async for chunk in llm_gateway.chat_stream(messages, **kwargs):
+        parts.append(chunk)
+        feedback = partial_feedback("".join(parts))
+        if feedback:
+            await on_feedback(feedback)
+    return "".join(parts).strip()
+
+
+async def evaluate_answer(question: str, student_answer: str, student_name: str = None, attempts: int = 2,
+                          on_feedback=None):
+    """
+    Оценивает ответ студента. Возвращает Evaluation или None, если модель
+    недоступна или так и не вернула корректный JSON за attempts попыток.
+    on_feedback — async-колбэк: если передан, ответ модели читается потоком
+    и колбэк получает уже написанную часть feedback.
+    """
+    messages = build_evaluation_messages(question, student_answer)
+    params = dict(model=EVALUATION_MODEL, max_tokens=300, temperature=0.3,
+                  response_format={"type": "json_object"}, priority=Priority.INTERACTIVE)
+    for attempt in range(attempts):
+        try:
+            if on_feedback is None:
+                raw = await llm_gateway.chat(messages, **params)
+            else:
+                raw = await _stream_raw(messages, on_feedback, **params)
+        except Exception as e:
+            logging.error(f"Ошибка оценки ответа: {e}")
+            return None
+        try:
+            return parse_evaluation(raw)
+        except EvaluationError as e:
+            metrics.inc("evaluation_parse_errors")
+            logging.warning(f"[Evaluation] Некорректная оценка (попытка {attempt + 1}): {e}")
+    return None
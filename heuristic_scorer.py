@@ -0,0 +1,73 @@
+import re
+
+from evaluation import CRITERIA, CRITERION_MAX, Evaluation
+
+# Предварительная оценка без LLM: грубая, зато мгновенная и всегда доступная.
+# Каждый критерий — от 0 до CRITERION_MAX с шагом 0.05, как у модели.
+
+WORD = re.compile(r"[а-яёa-z0-9]+", re.IGNORECASE)
+STOPWORDS = {
+    "как", "что", "это", "для", "или", "при", "если", "чтобы", "его", "её", "они", "ваши", "ваш", "вашей",
+    "вы", "есть", "был", "была", "были", "будет", "какие", "какой", "каким", "какая", "почему", "зачем",
+    "the", "and", "над", "под", "без", "уже", "ещё", "еще", "так", "там", "тут", "все", "всё",
+}
+ARGUMENT_MARKERS = ("потому что", "так как", "поэтому", "следовательно", "из-за", "значит", "в результате",
+                    "это позволит", "что приведёт", "что приведет", "иначе", "поскольку", "благодаря")
+STRUCTURE_MARKERS = ("во-первых", "во-вторых", "в-третьих", "сначала", "затем", "далее", "после этого",
+                     "в итоге", "итак", "шаг ")
+LIST_ITEM = re.compile(r"^\s*(?:[-•*—]|\d+[.)])\s+", re.MULTILINE)
+EXAMPLE_MARKERS = ("например", "к примеру", "допустим", "скажем", "как в случае", "кейс", "пример")
+NUMBER = re.compile(r"\d+(?:[.,]\d+)?\s*(?:%|₽|\$|руб|тыс|млн|k\b)?", re.IGNORECASE)
+
+STEP = 0.05
+
+
+def _stem(word: str) -> str:
+    # Для русского достаточно грубо отрезать окончание — «метрики» и «метрикам» совпадут
+    return word[:6]
+
+
+def _keywords(text: str) -> set:
+    return {_stem(w) for w in WORD.findall(text.lower()) if len(w) > 3 and w not in STOPWORDS}
+
+
+def _scale(value: float, full: float) -> float:
+    """value из [0, full] -> балл из [0, CRITERION_MAX], округлённый до шага 0.05."""
+    ratio = min(1.0, max(0.0, value / full)) if full else 0.0
+    return round(round(ratio * CRITERION_MAX / STEP) * STEP, 2)
+
+
+def _count(text: str, markers) -> int:
+    return sum(text.count(marker) for marker in markers)
+
+
+def score_answer(question: str, answer: str) -> Evaluation:
+    """Оценивает ответ по длине, структуре, пересечению с вопросом и наличию примеров."""
+    lowered = answer.lower()
+    words = WORD.findall(lowered)
+    question_words = _keywords(question)
+    overlap = len(question_words & _keywords(answer)) / len(question_words) if question_words else 0.5
+
+    criteria = {
+        # Треть ключевых слов вопроса в ответе — уже полное соответствие
+        "relevance":     _scale(overlap, 0.33),
+        "completeness":  _scale(len(words), 120),
+        "argumentation": _scale(_count(lowered, ARGUMENT_MARKERS), 3),
+        "structure":     _scale(len(LIST_ITEM.findall(answer)) + _count(lowered, STRUCTURE_MARKERS)
+                                + answer.count("\n\n"), 4),
+        "examples":      _scale(_count(lowered, EXAMPLE_MARKERS) + min(2, len(NUMBER.findall(answer))), 3),
+    }
+    # В отличие от модели, не обнуляем всё при relevance = 0: совпадение по словам
+    # не видит синонимов, а предварительная оценка не должна быть строже итоговой
+    if len(words) < 5:
+        criteria = {key: 0.0 for key in criteria}
+    score = round(sum(criteria.values()), 2)
+
+    weakest = [title for key, title in CRITERIA if criteria[key] < CRITERION_MAX / 2]
+    if score == 0.0:
+        feedback = "Ответ слишком короткий — раскройте мысль подробнее."
+    elif weakest:
+        feedback = "Стоит усилить: " + ", ".join(title.lower() for title in weakest) + "."
+    else:
+        feedback = "Ответ выглядит развёрнутым и структурированным."
+    return Evaluation(criteria=criteria, score=score, feedback=feedback, provisional=True)
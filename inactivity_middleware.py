@@ -1,47 +1,80 @@
 import time
+import asyncio
 import logging
 from aiogram import BaseMiddleware, types, Bot
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 from aiogram.fsm.context import FSMContext
 
+from session_sweeper import delete_bot_messages
+
 class InactivityMiddleware(BaseMiddleware):
-    def __init__(self, timeout_seconds: int = 7200):
+    """
+    Сбрасывает сессию после timeout_seconds бездействия.
+
+    Время последней активности живёт в памяти процесса (StorageKey -> monotonic),
+    поэтому на каждое событие FSM-хранилище не трогается. В хранилище значение
+    попадает лениво — фоновым flush() раз в flush_interval секунд. Если хранилище
+    умеет save_last_active/get_last_active (PostgresStorage), время пишется в
+    отдельную колонку и общее для всех реплик; иначе — в FSM-данные (last_active).
+
+    Сохранённое время читается, когда память процесса его не знает (первое событие
+    пользователя здесь, рестарт) или считает сессию истёкшей: пользователя в это
+    время могла обслуживать другая реплика. Один экземпляр вешается и на message,
+    и на callback_query.
+
+    Если передан sweeper, каждое событие продлевает сессию в нём, а сессии,
+    выселенные им в фоне, тоже встречают пользователя экраном перезапуска.
+    """
+
+    def __init__(self, timeout_seconds: int = 7200, flush_interval: float = 60.0, sweeper=None):
         super().__init__()
         self.timeout = timeout_seconds  # 7200 секунд = 2 часа
+        self.flush_interval = flush_interval
+        self.sweeper = sweeper
+        self._last_active = {}  # StorageKey -> time.monotonic()
+        self._pending = {}      # StorageKey -> time.time(), ещё не записанные в хранилище
 
     async def __call__(self, handler, event, data):
         state: FSMContext = data.get("state")
         bot: Bot = data.get("bot")
-        now = time.time()
+        now = time.monotonic()
 
         if state:
-            state_data = await state.get_data()
-            last_active = state_data.get("last_active")
+            key = state.key
+            last_active = self._last_active.get(key)
+            synced = False
+
+            # Память процесса не знает пользователя или считает его ушедшим — спрашиваем хранилище
+            if last_active is None or now - last_active > self.timeout:
+                stored = await self._load(state)
+                if stored is not None:
+                    stored = now - max(0.0, time.time() - stored)
+                    last_active = stored if last_active is None else max(last_active, stored)
+                synced = True
 
-            # Если первый раз — просто сохраняем время
-            if last_active is None:
-                await state.update_data(last_active=now)
+            self._last_active[key] = now
+
+            expired = last_active is not None and now - last_active > self.timeout
+            if self.sweeper is not None:
+                expired = self.sweeper.pop_swept(key) or expired
+                self.sweeper.touch(key)
 
             # Если бездействие больше таймаута
-            elif now - last_active > self.timeout:
+            if expired:
                 logging.info(f"[InactivityMiddleware] Более {self.timeout} сек бездействия — очищаем состояние.")
 
-                # Очищаем историю бота
+                # Очищаем историю бота (если sweeper не успел сделать это раньше)
+                state_data = await state.get_data()
                 bot_messages = state_data.get("bot_messages", [])
-                for msg_id in bot_messages:
-                    try:
-                        if isinstance(event, types.Message):
-                            chat_id = event.chat.id
-                        elif isinstance(event, types.CallbackQuery):
-                            chat_id = event.message.chat.id
-                        else:
-                            continue
-                        await bot.delete_message(chat_id=chat_id, message_id=msg_id)
-                    except Exception as e:
-                        logging.warning(f"[InactivityMiddleware] Не удалось удалить сообщение {msg_id}: {e}")
+                if bot_messages:
+                    if isinstance(event, types.Message):
+                        await delete_bot_messages(bot, event.chat.id, bot_messages)
+                    elif isinstance(event, types.CallbackQuery):
+                        await delete_bot_messages(bot, event.message.chat.id, bot_messages)
 
                 # Сброс состояния
                 await state.clear()
+                self._pending.pop(key, None)
 
                 # Новый стартовый экран
                 keyboard = ReplyKeyboardMarkup(
@@ -64,9 +97,51 @@ class InactivityMiddleware(BaseMiddleware):
                 # Прерываем основной хэндлер — дальше это событие не пойдёт
                 return
 
+            if synced and hasattr(state.storage, "save_last_active"):
+                # Пользователь мог прийти с другой реплики — её sweeper должен увидеть это сразу
+                self._pending.pop(key, None)
+                await self._save(state.storage, {key: time.time()})
             else:
-                # Обновляем время последней активности
-                await state.update_data(last_active=now)
+                # Время запишем в хранилище позже, пачкой
+                self._pending[key] = time.time()
 
         # Если всё в порядке — передаём управление дальше
         return await handler(event, data)
+
+    @staticmethod
+    async def _load(state: FSMContext):
+        if hasattr(state.storage, "get_last_active"):
+            return await state.storage.get_last_active(state.key)
+        return (await state.get_data()).get("last_active")
+
+    @staticmethod
+    async def _save(storage, times: dict):
+        if hasattr(storage, "save_last_active"):
+            # Отдельная колонка с GREATEST: не трогает data и не откатывает время назад
+            await storage.save_last_active(times)
+            return
+        for key, last_active in times.items():
+            await storage.update_data(key, {"last_active": last_active})
+
+    async def flush(self, storage):
+        """Пишет накопленные last_active в хранилище и забывает давно неактивных."""
+        pending, self._pending = self._pending, {}
+        try:
+            await self._save(storage, pending)
+        except Exception as e:
+            logging.warning(f"[InactivityMiddleware] Не удалось сохранить last_active ({len(pending)} ключей): {e}")
+            for key, last_active in pending.items():
+                self._pending.setdefault(key, last_active)
+
+        # Время уже сохранено в хранилище — держать такие записи в памяти незачем
+        now = time.monotonic()
+        for key in [k for k, t in self._last_active.items() if now - t > self.timeout and k not in self._pending]:
+            del self._last_active[key]
+
+    async def run_flusher(self, storage):
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush(storage)
+        finally:
+            await self.flush(storage)
@@ -0,0 +1,136 @@
+import os
+import logging
+
+import httpx
+import openai
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+from circuit_breaker import CircuitBreaker
+from llm_scheduler import LLMScheduler, Priority, estimate_tokens, parse_limits
+
+# --------------------------
+# Единая точка входа для всех запросов к OpenAI
+# --------------------------
+
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "400"))
+LLM_MAX_KEEPALIVE   = int(os.getenv("LLM_MAX_KEEPALIVE", "100"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+LLM_TIMEOUT         = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_HTTP2           = os.getenv("LLM_HTTP2", "1") == "1"
+
+# Параллельность по эндпоинтам и бюджеты токенов в минуту по моделям (пусто — без бюджета)
+LLM_CONCURRENCY = parse_limits(os.getenv(
+    "LLM_CONCURRENCY", "chat=32,embeddings=16,transcriptions=8"
+))
+LLM_TPM_LIMITS = parse_limits(os.getenv("LLM_TPM_LIMITS", ""))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+# Предохранитель: доля ошибок/медленных ответов, порог «медленно» и пауза перед пробой
+LLM_BREAKER_FAILURE_RATIO = float(os.getenv("LLM_BREAKER_FAILURE_RATIO", "0.5"))
+LLM_BREAKER_SLOW_SECONDS  = float(os.getenv("LLM_BREAKER_SLOW_SECONDS", "15"))
+LLM_BREAKER_OPEN_SECONDS  = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+
+_client = None
+
+
+def _is_outage(e: Exception) -> bool:
+    # 4xx на конкретный запрос (кроме 429) — не признак того, что сервис лежит
+    return isinstance(e, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError))
+
+
+# Считает каждую HTTP-попытку внутри планировщика, без ожидания в очереди и пауз между повторами
+breaker = CircuitBreaker(
+    "llm",
+    failure_ratio=LLM_BREAKER_FAILURE_RATIO,
+    slow_call_seconds=LLM_BREAKER_SLOW_SECONDS,
+    open_seconds=LLM_BREAKER_OPEN_SECONDS,
+    is_failure=_is_outage,
+)
+# Все запросы ниже проходят через общий планировщик: приоритеты, лимиты, повторы и предохранитель
+scheduler = LLMScheduler(LLM_CONCURRENCY, tpm=LLM_TPM_LIMITS, max_attempts=LLM_MAX_ATTEMPTS, breaker=breaker)
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401  (httpx[http2])
+        return True
+    except ImportError:
+        return False
+
+
+def get_client() -> AsyncOpenAI:
+    """
+    Ленивая инициализация одного AsyncOpenAI на процесс.
+    Все вызовы делят общий keep-alive пул соединений (HTTP/2, если доступен h2).
+    Собственные повторы SDK выключены — их делает scheduler.
+    """
+    global _client
+    if _client is None:
+        http2 = LLM_HTTP2 and _http2_available()
+        if LLM_HTTP2 and not http2:
+            logging.warning("[LLM] Пакет h2 не установлен — работаем по HTTP/1.1")
+        http_client = DefaultAsyncHttpxClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=LLM_TIMEOUT,
+        )
+        _client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client, max_retries=0)
+        logging.info(f"[LLM] Клиент создан: max_connections={LLM_MAX_CONNECTIONS}, http2={http2}")
+    return _client
+
+
+async def chat(messages: list, model: str = "gpt-3.5-turbo", priority: Priority = None, **kwargs) -> str:
+    """Chat completion; возвращает текст первого ответа без пробелов по краям."""
+    response = await scheduler.run(
+        "chat", lambda: get_client().chat.completions.create(model=model, messages=messages, **kwargs),
+        priority=priority, model=model, tokens=estimate_tokens(messages, max_tokens=kwargs.get("max_tokens")),
+    )
+    return response.choices[0].message.content.strip()
+
+
+async def chat_stream(messages: list, model: str = "gpt-3.5-turbo", priority: Priority = None, **kwargs):
+    """Chat completion по частям: асинхронный генератор текстовых фрагментов по мере генерации."""
+    tokens = estimate_tokens(messages, max_tokens=kwargs.get("max_tokens"))
+    # Слот держится, пока читается поток; повторяется только открытие потока.
+    # Для предохранителя задержка — время до ответа сервера на открытие потока
+    async with scheduler.slot("chat", priority, model, tokens):
+        stream = await scheduler.retrying(
+            lambda: get_client().chat.completions.create(model=model, messages=messages, stream=True, **kwargs),
+            model,
+        )
+        async with stream:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+
+async def embed(inputs: list, model: str = "text-embedding-ada-002", priority: Priority = None) -> list:
+    """Эмбеддинги для списка строк одним запросом, в исходном порядке."""
+    response = await scheduler.run(
+        "embeddings", lambda: get_client().embeddings.create(model=model, input=inputs),
+        priority=priority, model=model, tokens=estimate_tokens(prompt="".join(inputs)),
+    )
+    return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+
+async def transcribe(file, model: str = "whisper-1", language: str = "ru", priority: Priority = None) -> str:
+    audio = file[1] if isinstance(file, tuple) else file
+
+    async def call():
+        # При повторе файл читается заново с начала
+        if hasattr(audio, "seek"):
+            audio.seek(0)
+        return await get_client().audio.transcriptions.create(model=model, file=file, language=language)
+
+    response = await scheduler.run("transcriptions", call, priority=priority, model=model)
+    return response.text
+
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
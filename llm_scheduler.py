@@ -0,0 +1,262 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from enum import IntEnum
+
+import openai
+
+from metrics import metrics
+
+
+class Priority(IntEnum):
+    """Классы запросов: меньше — важнее."""
+    INTERACTIVE = 0   # пользователь ждёт ответа прямо сейчас (оценка, уточнение, расшифровка)
+    GENERATION = 1    # генерация вопроса или эталона по действию пользователя
+    BACKGROUND = 2    # прогрев пула, аналитика
+
+
+# Фоновый контекст может только понизить приоритет запросов, сделанных внутри него
+_context_priority = contextvars.ContextVar("llm_priority", default=Priority.INTERACTIVE)
+
+
+async def with_priority(priority: Priority, coro):
+    """Выполняет корутину так, что все её LLM-запросы идут не выше priority."""
+    token = _context_priority.set(priority)
+    try:
+        return await coro
+    finally:
+        _context_priority.reset(token)
+
+
+def resolve_priority(priority: Priority = None) -> Priority:
+    requested = Priority.INTERACTIVE if priority is None else priority
+    return max(requested, _context_priority.get())
+
+
+def estimate_tokens(messages=None, prompt: str = None, max_tokens: int = None) -> int:
+    """Грубая оценка токенов запроса: ~3 символа кириллицы на токен плюс ответ."""
+    chars = len(prompt or "")
+    for message in messages or ():
+        chars += len(str(message.get("content") or ""))
+    return chars // 3 + (max_tokens or 0)
+
+
+# --------------------------
+# Ограничение параллельности с приоритетной очередью
+# --------------------------
+
+class PriorityGate:
+    """
+    Семафор на limit одновременных запросов; освободившийся слот получает
+    самый приоритетный (а среди равных — самый ранний) ожидающий.
+    """
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.active = 0
+        self._waiters = []  # heap: (priority, seq, future)
+        self._seq = itertools.count()
+
+    @property
+    def depth(self) -> int:
+        return sum(1 for *_, future in self._waiters if not future.done())
+
+    def _report(self):
+        metrics.set_gauge(f"llm_queue_depth_{self.name}", self.depth)
+        metrics.set_gauge(f"llm_in_flight_{self.name}", self.active)
+
+    async def acquire(self, priority: Priority):
+        if self.active < self.limit and not self.depth:
+            self.active += 1
+            self._report()
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._report()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Слот уже передан нам — возвращаем его следующему
+                self.release()
+            else:
+                self._report()
+            raise
+
+    def release(self):
+        while self._waiters:
+            *_, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # Слот переходит ожидающему, active не меняется
+                future.set_result(None)
+                self._report()
+                return
+        self.active -= 1
+        self._report()
+
+
+# --------------------------
+# Бюджет токенов в минуту
+# --------------------------
+
+class TokenBudget:
+    """Token bucket на tokens_per_minute; после 429 бюджет ставится на паузу."""
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def reserve(self, tokens: int) -> float:
+        """Ждёт, пока в бюджете найдётся tokens; возвращает время ожидания."""
+        tokens = min(float(tokens), self.capacity)
+        started = time.monotonic()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return time.monotonic() - started
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+# --------------------------
+# Повторы
+# --------------------------
+
+RETRYABLE = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def is_retryable(exc: Exception) -> bool:
+    if not isinstance(exc, RETRYABLE):
+        return False
+    # Кончились деньги на аккаунте — повтор не поможет
+    return getattr(exc, "code", None) != "insufficient_quota"
+
+
+def retry_after(exc: Exception):
+    """Retry-After из ответа OpenAI в секундах или None."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value) * scale)
+        except ValueError:
+            continue
+    return None
+
+
+class LLMScheduler:
+    """
+    Общая очередь всех запросов к OpenAI.
+
+    Для каждого эндпоинта (chat, embeddings, ...) — свой лимит одновременных
+    запросов с приоритетной очередью; для каждой модели — необязательный бюджет
+    токенов в минуту. Временные ошибки (429, 5xx, обрыв соединения) повторяются
+    с экспоненциальной задержкой и jitter, не раньше Retry-After.
+
+    Необязательный breaker видит каждую HTTP-попытку отдельно: ожидание слота,
+    бюджета токенов и паузы между повторами в его задержку не входят. При
+    разомкнутом предохранителе запрос отклоняется до постановки в очередь.
+    """
+
+    def __init__(self, limits: dict, tpm: dict = None, default_limit: int = 16, max_attempts: int = 4,
+                 base_delay: float = 0.5, max_delay: float = 20.0, breaker=None):
+        self._gates = {endpoint: PriorityGate(endpoint, limit) for endpoint, limit in limits.items()}
+        self._budgets = {model: TokenBudget(limit) for model, limit in (tpm or {}).items()}
+        self.default_limit = default_limit
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker
+
+    def _gate(self, endpoint: str) -> PriorityGate:
+        gate = self._gates.get(endpoint)
+        if gate is None:
+            gate = self._gates[endpoint] = PriorityGate(endpoint, self.default_limit)
+        return gate
+
+    @asynccontextmanager
+    async def slot(self, endpoint: str, priority: Priority = None, model: str = None, tokens: int = 0):
+        """Держит слот эндпоинта (и списывает токены модели) на время запроса."""
+        priority = resolve_priority(priority)
+        if self.breaker is not None:
+            self.breaker.check()
+        gate = self._gate(endpoint)
+        started = time.monotonic()
+        await gate.acquire(priority)
+        try:
+            budget = self._budgets.get(model)
+            if budget is not None and tokens:
+                metrics.observe("llm_tpm_wait_seconds", await budget.reserve(tokens))
+            metrics.observe(f"llm_wait_seconds_{priority.name.lower()}", time.monotonic() - started)
+            metrics.inc(f"llm_requests_{endpoint}")
+            yield
+        finally:
+            gate.release()
+
+    async def retrying(self, call, model: str = None):
+        """Вызывает call() (фабрику корутины), повторяя временные ошибки."""
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                if self.breaker is None:
+                    return await call()
+                with self.breaker.track():
+                    return await call()
+            except Exception as e:
+                if attempt == self.max_attempts or not is_retryable(e):
+                    raise
+                delay = random.uniform(0.5, 1.0) * min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+                hint = retry_after(e)
+                if hint is not None:
+                    delay = max(delay, hint)
+                if isinstance(e, openai.RateLimitError):
+                    metrics.inc("llm_rate_limited")
+                    budget = self._budgets.get(model)
+                    if budget is not None:
+                        # Остальные запросы к этой модели тоже подождут
+                        budget.pause(delay)
+                metrics.inc("llm_retries")
+                logging.warning(f"[LLMScheduler] {type(e).__name__}, повтор {attempt}/{self.max_attempts - 1} "
+                                f"через {delay:.1f}с")
+                await asyncio.sleep(delay)
+
+    async def run(self, endpoint: str, call, priority: Priority = None, model: str = None, tokens: int = 0):
+        async with self.slot(endpoint, priority, model, tokens):
+            return await self.retrying(call, model)
+
+
+def parse_limits(value: str) -> dict:
+    """«gpt-3.5-turbo=160000,whisper-1=0» -> {"gpt-3.5-turbo": 160000}; нули и мусор пропускаются."""
+    limits = {}
+    for item in (value or "").split(","):
+        name, _, number = item.strip().partition("=")
+        try:
+            if name and int(number) > 0:
+                limits[name] = int(number)
+        except ValueError:
+            logging.warning(f"[LLMScheduler] Некорректный лимит: {item!r}")
+    return limits
@@ -0,0 +1,47 @@
+import time
+from collections import defaultdict
+
+
+class Metrics:
+    """
+    Простой in-process реестр метрик: счётчики, gauges и тайминги.
+    Имена метрик плоские, например «question_pool_hits».
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(float)
+        self.gauges = {}
+        self.timings = {}  # name -> [count, sum, max]
+        self.started_at = time.time()
+
+    def inc(self, name: str, value: float = 1.0):
+        self.counters[name] += value
+
+    def set_gauge(self, name: str, value: float):
+        self.gauges[name] = value
+
+    def observe(self, name: str, seconds: float):
+        stat = self.timings.setdefault(name, [0, 0.0, 0.0])
+        stat[0] += 1
+        stat[1] += seconds
+        stat[2] = max(stat[2], seconds)
+
+    def ratio(self, hits: str, misses: str) -> float:
+        total = self.counters[hits] + self.counters[misses]
+        return self.counters[hits] / total if total else 0.0
+
+    def render_text(self) -> str:
+        """Текстовый дамп в формате, близком к Prometheus exposition."""
+        lines = []
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{name} {value:g}")
+        for name, value in sorted(self.gauges.items()):
+            lines.append(f"{name} {value:g}")
+        for name, (count, total, peak) in sorted(self.timings.items()):
+            lines.append(f"{name}_count {count}")
+            lines.append(f"{name}_sum {total:.4f}")
+            lines.append(f"{name}_max {peak:.4f}")
+        return "\n".join(lines)
+
+
+metrics = Metrics()
@@ -0,0 +1,134 @@
+"""
+Поиск списанных друг у друга ответов: MinHash-сигнатуры + LSH-индекс в памяти.
+
+Сигнатура ответа (num_perm чисел uint32) считается один раз и хранится в
+answers.minhash; индекс собирается из базы при старте бота и потом дочитывает
+новые строки (id > last_id), в том числе сохранённые другими репликами. Ответ сравнивается
+только с ответами на тот же вопрос или по той же теме (scope), и только с теми,
+что совпали хотя бы в одной LSH-полосе, — без перебора всей таблицы.
+"""
+import hashlib
+import logging
+
+import numpy as np
+
+from ngram_lm import encode, hash_ngrams
+
+SHINGLE = 5           # символьные 5-граммы нормализованного текста
+MIN_SHINGLES = 40     # короче — «не знаю»-ответы совпадают у всех, такие не сравниваем
+MASK32 = np.uint64(0xFFFFFFFF)
+SHIFT32 = np.uint64(32)
+
+
+def answer_scopes(question: str, topic: str = None) -> list:
+    """Группы, внутри которых ищем совпадения: сам вопрос и тема (если она есть)."""
+    scopes = ["q:" + hashlib.sha1((question or "").strip().encode("utf-8")).hexdigest()[:16]]
+    if topic and topic != "—":
+        scopes.append("t:" + topic)
+    return scopes
+
+
+class MinHashIndex:
+    """
+    MinHash по символьным n-граммам: доля совпавших позиций двух сигнатур —
+    оценка коэффициента Жаккара их множеств n-грамм. Сигнатура режется на
+    bands полос по rows чисел; ответы с хотя бы одной одинаковой полосой
+    становятся кандидатами (порог срабатывания ≈ (1/bands)^(1/rows)),
+    кандидаты проверяются по полной сигнатуре с порогом threshold.
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, threshold: float = 0.6, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm должно делиться на bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        # Хэш-функции вида (a·x + b) >> 32 по модулю 2^64, a — нечётное
+        rng = np.random.default_rng(seed)
+        self._a = (rng.integers(0, 1 << 63, num_perm, dtype=np.uint64) << np.uint64(1)) | np.uint64(1)
+        self._b = rng.integers(0, 1 << 63, num_perm, dtype=np.uint64)
+        self._buckets = {}      # (scope, полоса, байты полосы) -> [answer_id]
+        self._answers = {}      # answer_id -> (user_id, сигнатура)
+        self.last_id = 0        # наибольший answer_id, прочитанный из базы
+
+    def __len__(self):
+        return len(self._answers)
+
+    # --------------------------
+    # Сигнатуры
+    # --------------------------
+
+    def signature(self, text: str):
+        """uint32[num_perm] или None, если ответ слишком короткий для сравнения."""
+        codes = encode(text or "", SHINGLE)
+        shingles = np.unique(hash_ngrams(codes, SHINGLE, 32)[SHINGLE - 1, SHINGLE - 1:]).astype(np.uint64)
+        if len(shingles) < MIN_SHINGLES:
+            return None
+        hashed = (self._a[:, None] * shingles[None, :] + self._b[:, None]) >> SHIFT32
+        return (hashed & MASK32).min(axis=1).astype(np.uint32)
+
+    @staticmethod
+    def similarity(first: np.ndarray, second: np.ndarray) -> float:
+        return float(np.count_nonzero(first == second)) / len(first)
+
+    def to_bytes(self, signature) -> bytes:
+        """Для answers.minhash; пустые байты — «ответ обработан, сигнатуры нет»."""
+        return b"" if signature is None else signature.tobytes()
+
+    def from_bytes(self, data: bytes):
+        if not data or len(data) != self.num_perm * 4:
+            return None
+        return np.frombuffer(data, dtype=np.uint32)
+
+    # --------------------------
+    # Индекс
+    # --------------------------
+
+    def _keys(self, signature: np.ndarray, scopes):
+        bands = signature.reshape(self.bands, self.rows)
+        for scope in scopes:
+            for band in range(self.bands):
+                yield scope, band, bands[band].tobytes()
+
+    def add(self, answer_id: int, user_id: int, signature: np.ndarray, scopes):
+        if answer_id in self._answers:
+            return
+        self._answers[answer_id] = (user_id, signature)
+        for key in self._keys(signature, scopes):
+            self._buckets.setdefault(key, []).append(answer_id)
+
+    def query(self, signature: np.ndarray, scopes, exclude_user: int = None) -> list:
+        """[(answer_id, user_id, сходство)] ответов других пользователей, по убыванию сходства."""
+        candidates = set()
+        for key in self._keys(signature, scopes):
+            candidates.update(self._buckets.get(key, ()))
+        matches = []
+        for answer_id in candidates:
+            user_id, other = self._answers[answer_id]
+            if user_id == exclude_user:
+                continue
+            similarity = self.similarity(signature, other)
+            if similarity >= self.threshold:
+                matches.append((answer_id, user_id, similarity))
+        matches.sort(key=lambda m: (-m[2], m[0]))
+        return matches
+
+    def load(self, rows):
+        """rows — итерируемое (answer_id, user_id, question, topic, minhash)."""
+        self._buckets.clear()
+        self._answers.clear()
+        self.last_id = 0
+        self.extend(rows)
+        logging.info(f"[Plagiarism] В индексе {len(self._answers)} ответов, полос: {len(self._buckets)}")
+
+    def extend(self, rows) -> int:
+        """Дочитывает строки того же вида, что и load(); уже известные ответы пропускаются."""
+        added = 0
+        for answer_id, user_id, question, topic, data in rows:
+            self.last_id = max(self.last_id, answer_id)
+            signature = self.from_bytes(data)
+            if signature is not None and answer_id not in self._answers:
+                self.add(answer_id, user_id, signature, answer_scopes(question, topic))
+                added += 1
+        return added
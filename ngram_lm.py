@@ -0,0 +1,213 @@
+"""
+Символьная n-gram языковая модель для анти-чит шага PERPLEXITY.
+
+Модель учится офлайн на ответах из answers и хранится в двух файлах:
+ngram_lm.npy — счётчики n-грамм (uint32, открываются через mmap) и
+ngram_lm.json — параметры и откалиброванный порог.
+
+    DATABASE_URL=... python ngram_lm.py [путь к .npy]
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+from pathlib import Path
+
+import numpy as np
+
+BOS = "\x02"
+EOS = "\x03"
+# Мультипликативное хэширование (Fibonacci hashing) — константа 2^64 / φ
+HASH_MULT = np.uint64(0x9E3779B97F4A7C15)
+ROLL_MULT = np.uint64(1000003)
+CHAR_RE = re.compile(r"[^0-9a-zа-я.,!?;:()\-%\s]")
+SPACE_RE = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    text = text.lower().replace("ё", "е")
+    text = CHAR_RE.sub("", text)
+    return SPACE_RE.sub(" ", text).strip()
+
+
+def encode(text: str, order: int) -> np.ndarray:
+    """Коды символов нормализованного текста с order−1 BOS в начале и EOS в конце."""
+    padded = BOS * (order - 1) + normalize(text) + EOS
+    return np.frombuffer(padded.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+
+
+def hash_ngrams(codes: np.ndarray, order: int, bits: int) -> np.ndarray:
+    """indexes[k, i] — бакет из 2**bits для (k+1)-граммы, оканчивающейся в позиции i."""
+    shift = np.uint64(64 - bits)
+    indexes = np.empty((order, len(codes)), dtype=np.int64)
+    rolling = np.zeros(len(codes), dtype=np.uint64)
+    for k in range(order):
+        # h_{k+1}[i] = h_k[i-1] * M + c[i]; переполнение uint64 — часть хэша
+        previous = np.empty_like(rolling)
+        previous[0] = 0
+        previous[1:] = rolling[:-1]
+        rolling = previous * ROLL_MULT + codes
+        indexes[k] = (rolling * HASH_MULT) >> shift
+    return indexes
+
+
+class NgramLM:
+    """
+    Интерполированная модель символьных n-грамм порядка 1..order.
+
+    Счётчики лежат в хэш-таблицах фиксированного размера 2**bits на каждый
+    порядок (коллизии допустимы: модель нужна для ранжирования, а не как
+    точная вероятность). Хэши всех позиций считаются векторно, поэтому оценка
+    ответа — несколько проходов numpy, без цикла по символам в питоне.
+    Сглаживание — аддитивное (alpha) на каждом порядке, веса порядков — lambdas.
+    """
+
+    def __init__(self, order: int = 5, bits: int = 18, alpha: float = 0.1, lambdas=None,
+                 counts: np.ndarray = None, vocab: int = 64, threshold: float = None):
+        self.order = order
+        self.bits = bits
+        self.alpha = alpha
+        weights = np.asarray(lambdas or [0.05, 0.1, 0.15, 0.3, 0.4][-order:], dtype=np.float64)
+        self.lambdas = weights / weights.sum()
+        self.counts = counts if counts is not None else np.zeros((order, 1 << bits), dtype=np.uint32)
+        self.vocab = vocab
+        self.threshold = threshold
+        self._total = float(self.counts[0].sum())
+
+    # --------------------------
+    # Обучение
+    # --------------------------
+
+    def fit(self, texts) -> "NgramLM":
+        codes = [encode(t, self.order) for t in texts if t and t.strip()]
+        if not codes:
+            return self
+        stream = np.concatenate(codes)
+        indexes = hash_ngrams(stream, self.order, self.bits)
+        size = 1 << self.bits
+        for k in range(self.order):
+            added = np.bincount(indexes[k], minlength=size).astype(np.uint64)
+            self.counts[k] = np.minimum(self.counts[k] + added, np.iinfo(np.uint32).max)
+        self.vocab = max(self.vocab, len(np.unique(stream)))
+        self._total = float(self.counts[0].sum())
+        return self
+
+    # --------------------------
+    # Оценка
+    # --------------------------
+
+    def surprisal(self, text: str) -> np.ndarray:
+        """Неожиданность (−log2 p) каждого символа ответа, включая конец текста."""
+        codes = encode(text, self.order)
+        indexes = hash_ngrams(codes, self.order, self.bits)
+        start = self.order - 1
+        counts = self.counts
+        total = self._total or 1.0
+        positions = np.arange(start, len(codes))
+
+        probability = np.zeros(len(positions), dtype=np.float64)
+        unigram = counts[0][indexes[0, positions]]
+        probability += self.lambdas[0] * (unigram + self.alpha) / (total + self.alpha * self.vocab)
+        for k in range(1, self.order):
+            ngram = counts[k][indexes[k, positions]]
+            context = counts[k - 1][indexes[k - 1, positions - 1]]
+            probability += self.lambdas[k] * (ngram + self.alpha) / (context + self.alpha * self.vocab)
+        return -np.log2(probability)
+
+    def mean_surprisal(self, text: str) -> float:
+        """Средняя неожиданность в битах на символ (log2 перплексии)."""
+        return float(self.surprisal(text).mean())
+
+    def is_suspicious(self, text: str):
+        """True — текст подозрительно предсказуем; None — порог не откалиброван."""
+        if self.threshold is None:
+            return None
+        return self.mean_surprisal(text) < self.threshold
+
+    # --------------------------
+    # Хранение
+    # --------------------------
+
+    def save(self, path: str):
+        path = Path(path)
+        np.save(path, self.counts)
+        meta = {"order": self.order, "bits": self.bits, "alpha": self.alpha, "lambdas": self.lambdas.tolist(),
+                "vocab": self.vocab, "threshold": self.threshold}
+        path.with_suffix(".json").write_text(json.dumps(meta, ensure_ascii=False, indent=2))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "NgramLM":
+        path = Path(path)
+        meta = json.loads(path.with_suffix(".json").read_text())
+        counts = np.load(path, mmap_mode="r" if mmap else None)
+        return cls(order=meta["order"], bits=meta["bits"], alpha=meta["alpha"], lambdas=meta["lambdas"],
+                   counts=counts, vocab=meta["vocab"], threshold=meta["threshold"])
+
+
+# --------------------------
+# Калибровка порога
+# --------------------------
+
+def calibrate(scores, labels, min_positives: int = 5):
+    """
+    Порог t для правила «score < t — подозрительно», максимизирующий
+    сбалансированную точность (J Юдена) на размеченных ответах.
+    None — если меток мало или средняя неожиданность их не разделяет.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    labels = np.asarray(labels, dtype=bool)
+    positives, negatives = labels.sum(), (~labels).sum()
+    if positives < min_positives or negatives < min_positives:
+        return None, 0.0
+    order = np.argsort(scores)
+    sorted_scores, sorted_labels = scores[order], labels[order]
+    # Порог между соседними значениями: всё левее — «подозрительно»
+    tpr = np.cumsum(sorted_labels) / positives
+    fpr = np.cumsum(~sorted_labels) / negatives
+    j = tpr - fpr
+    best = int(np.argmax(j))
+    if j[best] <= 0.05:
+        return None, float(j[best])
+    upper = sorted_scores[best + 1] if best + 1 < len(sorted_scores) else sorted_scores[best] + 1e-6
+    return float((sorted_scores[best] + upper) / 2), float(j[best])
+
+
+def train(rows, order: int = 5, bits: int = 18, holdout: int = 5) -> NgramLM:
+    """
+    rows — (id, answer, is_suspicious). Учимся на неподозрительных ответах,
+    каждый holdout-й ответ (по id) откладываем для калибровки порога.
+    """
+    train_texts, calibration = [], []
+    for row_id, answer, suspicious in rows:
+        if row_id % holdout == 0:
+            calibration.append((answer, bool(suspicious)))
+        elif not suspicious:
+            train_texts.append(answer)
+    model = NgramLM(order=order, bits=bits).fit(train_texts)
+    if calibration:
+        scores = [model.mean_surprisal(answer) for answer, _ in calibration]
+        model.threshold, j = calibrate(scores, [label for _, label in calibration])
+        logging.info(f"[NgramLM] Порог {model.threshold} (J={j:.2f}) по {len(calibration)} ответам")
+    return model
+
+
+async def train_from_db(path: str):
+    import asyncpg
+
+    conn = await asyncpg.connect(os.getenv("DATABASE_URL"))
+    try:
+        rows = await conn.fetch(
+            "SELECT id, answer, is_suspicious FROM answers WHERE answer IS NOT NULL AND length(answer) >= 20"
+        )
+    finally:
+        await conn.close()
+    model = train([(r["id"], r["answer"], r["is_suspicious"]) for r in rows])
+    model.save(path)
+    print(f"Обучено на {len(rows)} ответах, порог: {model.threshold}, файл: {path}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(train_from_db(sys.argv[1] if len(sys.argv) > 1 else "ngram_lm.npy"))
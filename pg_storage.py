@@ -0,0 +1,229 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StorageKey
+
+from metrics import metrics
+
+
+# Запись, не тронутая дольше ttl (параметр $3), при записи считается пустой — старые поля не воскресают
+EXPIRED = "GREATEST(fsm_storage.updated_at, fsm_storage.last_active) < now() - make_interval(secs => $3)"
+
+
+class PostgresStorage(BaseStorage):
+    """
+    Постоянное FSM-хранилище поверх общего asyncpg-пула.
+
+    - Запись — write-through, одним запросом на изменение. update_data сливает
+      ключи прямо в БД (data || изменения), set_data пишет только отличия от
+      того, что этот процесс читал. Поэтому реплики, обслуживающие один чат,
+      не затирают друг другу поля, даже если читали устаревшую копию.
+    - Чтение идёт через небольшой in-process кэш (LRU, не дольше cache_ttl
+      секунд); каждая запись обновляет кэш значением, которое вернула БД.
+    - Ключи, к которым не обращались дольше ttl (тот же горизонт, что и у
+      InactivityMiddleware), считаются истёкшими и периодически удаляются.
+      Обращением считается запись, last_active и чтение из БД; чтение обновляет
+      updated_at, только если тот старше touch_interval, — иначе каждое чтение
+      мимо кэша было бы ещё и записью строки в WAL.
+    - last_active — время последнего события пользователя на любой реплике —
+      лежит в отдельной колонке и только растёт (GREATEST), не задевая data.
+
+    При нескольких процессах чтение может отставать от чужой записи не больше
+    чем на cache_ttl.
+    """
+
+    def __init__(self, ttl: int = 7200, cache_size: int = 10000, cache_ttl: float = 1.0,
+                 expire_interval: float = 300.0, touch_interval: float = 300.0):
+        self.ttl = ttl
+        self.touch_interval = touch_interval
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.expire_interval = expire_interval
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._pool = None
+        self._cache = OrderedDict()  # key -> {"state", "data", "loaded_at"}
+        self._expire_task = None
+
+    def attach_pool(self, pool):
+        self._pool = pool
+
+    async def start(self):
+        async with self._pool.acquire() as conn:
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS fsm_storage (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data JSONB NOT NULL DEFAULT '{}'::jsonb,
+                    updated_at TIMESTAMP NOT NULL DEFAULT now()
+                )
+            ''')
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS fsm_storage_updated_at_idx ON fsm_storage (updated_at);
+            ''')
+            await conn.execute('''
+                ALTER TABLE fsm_storage ADD COLUMN IF NOT EXISTS last_active TIMESTAMPTZ;
+            ''')
+        self._expire_task = asyncio.create_task(self._expire_loop())
+
+    async def close(self):
+        if self._expire_task:
+            self._expire_task.cancel()
+            await asyncio.gather(self._expire_task, return_exceptions=True)
+            self._expire_task = None
+
+    # --------------------------
+    # API BaseStorage
+    # --------------------------
+
+    async def set_state(self, key: StorageKey, state=None):
+        state = state.state if isinstance(state, State) else state
+        await self._write(self.key_builder.build(key), f'''
+            INSERT INTO fsm_storage (key, state) VALUES ($1, $2)
+            ON CONFLICT (key) DO UPDATE
+            SET state = EXCLUDED.state,
+                data = CASE WHEN {EXPIRED} THEN '{{}}'::jsonb ELSE fsm_storage.data END,
+                updated_at = now()
+            RETURNING state, data
+        ''', state, self.ttl)
+
+    async def get_state(self, key: StorageKey):
+        return (await self._record(self.key_builder.build(key)))["state"]
+
+    async def set_data(self, key: StorageKey, data):
+        key = self.key_builder.build(key)
+        data = dict(data)
+        base = (await self._record(key))["data"]
+        changed = {k: v for k, v in data.items() if k not in base or base[k] != v}
+        removed = [k for k in base if k not in data]
+        if not changed and not removed:
+            return
+        await self._merge(key, changed, removed)
+
+    async def update_data(self, key: StorageKey, data) -> dict:
+        """Слияние без чтения: изменённые ключи дописываются к тому, что лежит в БД."""
+        return dict(await self._merge(self.key_builder.build(key), dict(data), []))
+
+    async def get_data(self, key: StorageKey) -> dict:
+        return dict((await self._record(self.key_builder.build(key)))["data"])
+
+    async def delete(self, key: StorageKey):
+        """Полностью удаляет запись ключа (используется при выселении неактивных сессий)."""
+        key = self.key_builder.build(key)
+        async with self._pool.acquire() as conn:
+            await conn.execute("DELETE FROM fsm_storage WHERE key = $1", key)
+        self._cache.pop(key, None)
+
+    async def delete_idle(self, key: StorageKey, idle_seconds: float) -> bool:
+        """Удаляет запись, только если last_active старше idle_seconds (проверка и удаление — один запрос)."""
+        key = self.key_builder.build(key)
+        async with self._pool.acquire() as conn:
+            status = await conn.execute('''
+                DELETE FROM fsm_storage
+                WHERE key = $1 AND (last_active IS NULL OR last_active < now() - make_interval(secs => $2))
+            ''', key, float(idle_seconds))
+        self._cache.pop(key, None)
+        return status != "DELETE 0"
+
+    # --------------------------
+    # Время последней активности
+    # --------------------------
+
+    async def save_last_active(self, times: dict):
+        """times — {StorageKey: time.time()}; время в БД только увеличивается."""
+        if not times:
+            return
+        async with self._pool.acquire() as conn:
+            await conn.executemany('''
+                INSERT INTO fsm_storage (key, last_active) VALUES ($1, to_timestamp($2))
+                ON CONFLICT (key) DO UPDATE
+                SET last_active = GREATEST(fsm_storage.last_active, EXCLUDED.last_active)
+            ''', [(self.key_builder.build(key), float(t)) for key, t in times.items()])
+
+    async def get_last_active(self, key: StorageKey):
+        """time.time() последнего события пользователя на любой реплике или None."""
+        async with self._pool.acquire() as conn:
+            return await conn.fetchval(
+                "SELECT extract(epoch FROM last_active)::float8 FROM fsm_storage WHERE key = $1",
+                self.key_builder.build(key)
+            )
+
+    # --------------------------
+    # Запись и кэш
+    # --------------------------
+
+    async def _merge(self, key: str, changed: dict, removed: list) -> dict:
+        # Сериализуем до запроса: неподходящие данные — ошибка этого вызова, а не соседних
+        payload = json.dumps(changed, ensure_ascii=False)
+        record = await self._write(key, f'''
+            INSERT INTO fsm_storage (key, data) VALUES ($1, $2::jsonb)
+            ON CONFLICT (key) DO UPDATE
+            SET state = CASE WHEN {EXPIRED} THEN NULL ELSE fsm_storage.state END,
+                data = CASE WHEN {EXPIRED} THEN EXCLUDED.data
+                            ELSE (fsm_storage.data - $4::text[]) || EXCLUDED.data END,
+                updated_at = now()
+            RETURNING state, data
+        ''', payload, self.ttl, removed)
+        return record["data"]
+
+    async def _write(self, key: str, query: str, *args) -> dict:
+        started = time.monotonic()
+        async with self._pool.acquire() as conn:
+            row = await conn.fetchrow(query, key, *args)
+        metrics.observe("fsm_write_seconds", time.monotonic() - started)
+        return self._remember(key, row["state"], json.loads(row["data"]))
+
+    async def _record(self, key: str) -> dict:
+        record = self._cache.get(key)
+        if record is not None and time.monotonic() - record["loaded_at"] <= self.cache_ttl:
+            metrics.inc("fsm_cache_hits")
+            self._cache.move_to_end(key)
+            return record
+        metrics.inc("fsm_cache_misses")
+        async with self._pool.acquire() as conn:
+            # Чтение тоже продлевает жизнь сессии, но пишет строку не чаще раза в touch_interval
+            row = await conn.fetchrow('''
+                WITH current AS (
+                    SELECT state, data, updated_at FROM fsm_storage
+                    WHERE key = $1 AND GREATEST(updated_at, last_active) > now() - make_interval(secs => $2)
+                ), touched AS (
+                    UPDATE fsm_storage f SET updated_at = now()
+                    FROM current c
+                    WHERE f.key = $1 AND c.updated_at < now() - make_interval(secs => $3)
+                )
+                SELECT state, data FROM current
+            ''', key, self.ttl, self.touch_interval)
+        if row:
+            return self._remember(key, row["state"], json.loads(row["data"]))
+        return self._remember(key, None, {})
+
+    def _remember(self, key: str, state, data: dict) -> dict:
+        record = {"state": state, "data": data, "loaded_at": time.monotonic()}
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return record
+
+    async def expire(self):
+        """Удаляет ключи, неактивные дольше ttl, из БД и из кэша."""
+        async with self._pool.acquire() as conn:
+            await conn.execute('''
+                DELETE FROM fsm_storage
+                WHERE updated_at < now() - make_interval(secs => $1)
+                  AND (last_active IS NULL OR last_active < now() - make_interval(secs => $1))
+            ''', self.ttl)
+        now = time.monotonic()
+        for key in [k for k, r in self._cache.items() if now - r["loaded_at"] > self.cache_ttl]:
+            del self._cache[key]
+
+    async def _expire_loop(self):
+        while True:
+            await asyncio.sleep(self.expire_interval)
+            try:
+                await self.expire()
+            except Exception as e:
+                logging.warning(f"[PostgresStorage] Очистка истёкших ключей не удалась: {e}")
@@ -0,0 +1,145 @@
+import logging
+import os
+import re
+from collections import deque
+from functools import lru_cache
+
+# Словарь шаблонных фраз ChatGPT для анти-чит шага GPT_PHRASES
+GPT_PHRASES_PATH = os.getenv("GPT_PHRASES_PATH", os.path.join(os.path.dirname(__file__), "gpt_phrases.txt"))
+
+WORD = re.compile(r"[а-яёa-z0-9]+(?:-[а-яёa-z0-9]+)*", re.IGNORECASE)
+VERSION = re.compile(r"#\s*version:\s*(\S+)", re.IGNORECASE)
+
+# Окончания, которые срезаются при лёгком стемминге (длинные проверяются первыми)
+ENDINGS = sorted({
+    # существительные и прилагательные
+    "иями", "ями", "ами", "ией", "ием", "иях", "ого", "его", "ому", "ему", "ыми", "ими", "ых", "их", "ым",
+    "ой", "ей", "ий", "ый", "ая", "яя", "ое", "ее", "ые", "ие", "ую", "юю", "ом", "ем", "им",
+    "ах", "ях", "ов", "ев", "ам", "ям", "ия",
+    # глаголы: настоящее время, инфинитив, прошедшее время
+    "овать", "овала", "овало", "овали", "овал", "ует", "уют", "ают", "яют", "ает", "яет",
+    "ешь", "ете", "ите", "ишь", "ют", "ут", "ят", "ат", "ет", "ит",
+    "ать", "ять", "еть", "ить", "ть", "ала", "яла", "ела", "ила", "ало", "яло", "ело", "ило",
+    "али", "яли", "ели", "или", "ал", "ял", "ел", "ил",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+}, key=len, reverse=True)
+MIN_STEM = 3
+
+
+@lru_cache(maxsize=50000)
+def stem(word: str) -> str:
+    """Грубый стемминг: «подхода», «подходы», «подходом» -> «подход»."""
+    word = word.lower().replace("ё", "е")
+    if word.endswith(("ся", "сь")) and len(word) - 2 >= MIN_STEM:
+        word = word[:-2]
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text: str) -> list:
+    return [stem(word) for word in WORD.findall(text)]
+
+
+class PhraseMatcher:
+    """
+    Поиск множества фраз за один линейный проход по тексту.
+
+    Фразы и текст приводятся к последовательностям основ слов (tokenize),
+    из фраз строится автомат Ахо–Корасик по токенам. Автомат собирается один
+    раз при загрузке словаря, поиск не зависит от числа фраз.
+    """
+
+    def __init__(self, phrases, version: str = None):
+        self.version = version
+        self.phrases = []
+        self._goto = [{}]      # состояние -> {токен: состояние}
+        self._fail = [0]
+        self._output = [()]    # состояние -> индексы фраз, оканчивающихся здесь
+        for phrase in phrases:
+            self._add(phrase)
+        self._build()
+
+    def __len__(self):
+        return len(self.phrases)
+
+    def _add(self, phrase: str):
+        tokens = tokenize(phrase)
+        if not tokens:
+            return
+        state = 0
+        for token in tokens:
+            nxt = self._goto[state].get(token)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][token] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            state = nxt
+        self._output[state] += (len(self.phrases),)
+        self.phrases.append(phrase)
+
+    def _build(self):
+        # BFS: fail-ссылка ведёт в самый длинный собственный суффикс, который есть в боре
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and token not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(token, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._output[nxt] += self._output[self._fail[nxt]]
+
+    def find(self, text: str) -> list:
+        """Сработавшие фразы словаря в порядке первого вхождения (без повторов)."""
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        hits = {}
+        for token in tokenize(text):
+            while state and token not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token, 0)
+            for index in output[state]:
+                hits.setdefault(index, None)
+        return [self.phrases[index] for index in hits]
+
+    @classmethod
+    def from_file(cls, path: str) -> "PhraseMatcher":
+        """Файл: по фразе на строку, «# version: N» — версия словаря, остальные # — комментарии."""
+        version, phrases = None, []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith("#"):
+                    match = VERSION.match(line)
+                    if match:
+                        version = match.group(1)
+                elif line:
+                    phrases.append(line)
+        matcher = cls(phrases, version=version)
+        logging.info(f"[PhraseMatcher] {path}: {len(matcher)} фраз, версия {version}")
+        return matcher
+
+
+_gpt_matcher = None
+
+
+def gpt_phrase_matcher() -> PhraseMatcher:
+    global _gpt_matcher
+    if _gpt_matcher is None:
+        _gpt_matcher = PhraseMatcher.from_file(GPT_PHRASES_PATH)
+    return _gpt_matcher
+
+
+def find_gpt_phrases(text: str) -> list:
+    """Шаблонные фразы ChatGPT, найденные в тексте."""
+    return gpt_phrase_matcher().find(text)
+
+
+def detect_gpt_phrases(text: str) -> bool:
+    return bool(find_gpt_phrases(text))
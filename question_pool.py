@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from metrics import metrics
+
+
+class QuestionPool:
+    """
+    Тёплый пул заранее сгенерированных вопросов.
+    Для каждого ключа (грейд+тема или раздел+подтема Академии) держим очередь
+    готовых вопросов и дозаполняем её фоновыми задачами: как только в очереди
+    осталось меньше low_watermark вопросов, генерируем до high_watermark.
+    """
+
+    def __init__(self, low_watermark: int = 1, high_watermark: int = 3, concurrency: int = 4):
+        self.low_watermark = low_watermark
+        self.high_watermark = max(high_watermark, low_watermark + 1)
+        self._generators = {}
+        self._queues = {}
+        self._refill_tasks = {}
+        self._sem = asyncio.Semaphore(concurrency)
+        self._running = False
+
+    def register(self, key: tuple, generator):
+        """generator — корутина без аргументов, возвращающая текст вопроса."""
+        self._generators[key] = generator
+        self._queues.setdefault(key, deque())
+
+    async def start(self):
+        self._running = True
+        for key in self._generators:
+            self._schedule_refill(key)
+        logging.info(f"[QuestionPool] Запущен прогрев для {len(self._generators)} ключей")
+
+    async def stop(self):
+        self._running = False
+        tasks = list(self._refill_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._refill_tasks.clear()
+
+    def take(self, key: tuple):
+        """Мгновенно отдаёт готовый вопрос или None, если пул пуст."""
+        queue = self._queues.get(key)
+        question = queue.popleft() if queue else None
+        if question is None:
+            metrics.inc("question_pool_misses")
+        else:
+            metrics.inc("question_pool_hits")
+        metrics.set_gauge("question_pool_hit_rate", metrics.ratio("question_pool_hits", "question_pool_misses"))
+        if key in self._generators and len(self._queues[key]) < self.low_watermark:
+            self._schedule_refill(key)
+        return question
+
+    def size(self, key: tuple) -> int:
+        return len(self._queues.get(key, ()))
+
+    def _schedule_refill(self, key: tuple):
+        if not self._running:
+            return
+        task = self._refill_tasks.get(key)
+        if task and not task.done():
+            return
+        self._refill_tasks[key] = asyncio.create_task(self._refill(key))
+
+    async def _refill(self, key: tuple):
+        queue = self._queues[key]
+        generator = self._generators[key]
+        while self._running and len(queue) < self.high_watermark:
+            async with self._sem:
+                started = time.monotonic()
+                try:
+                    question = await generator()
+                except Exception as e:
+                    logging.warning(f"[QuestionPool] Ошибка генерации для {key}: {e}")
+                    question = None
+                metrics.observe("question_pool_refill_seconds", time.monotonic() - started)
+
+            # Ошибки генерации в пул не кладём и не долбим API повторно
+            if not question or question.startswith("❌"):
+                metrics.inc("question_pool_refill_errors")
+                return
+            queue.append(question)
+            metrics.inc("question_pool_refilled")
+        metrics.set_gauge("question_pool_size", sum(len(q) for q in self._queues.values()))
@@ -0,0 +1,124 @@
+import time
+import logging
+
+from metrics import metrics
+
+
+class RankIndex:
+    """
+    Order-statistic структура для рейтинга: дерево Фенвика по квантованным баллам.
+    rank(user) = 1 + число пользователей со строго большим баллом — O(log n)
+    и на запрос, и на обновление.
+    """
+
+    def __init__(self, resolution: float = 0.01, initial_size: int = 1 << 15):
+        self._scale = 1.0 / resolution
+        self._size = initial_size
+        self._tree = [0] * (self._size + 1)
+        self._buckets = {}  # user_id -> бакет
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def load(self, rows):
+        """rows — итерируемое (user_id, points)."""
+        self._buckets.clear()
+        self._tree = [0] * (self._size + 1)
+        for user_id, points in rows:
+            self.update(user_id, points or 0.0)
+        logging.info(f"[RankIndex] Загружено {len(self._buckets)} пользователей")
+
+    def update(self, user_id: int, points: float):
+        bucket = self._bucket(points)
+        old = self._buckets.get(user_id)
+        if old == bucket:
+            return
+        if old is not None:
+            self._add(old, -1)
+            del self._buckets[user_id]
+        if bucket >= self._size:
+            self._grow(bucket)
+        self._add(bucket, 1)
+        self._buckets[user_id] = bucket
+
+    def rank(self, user_id: int) -> int:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            return -1
+        return len(self._buckets) - self._prefix(bucket) + 1
+
+    def _bucket(self, points: float) -> int:
+        return max(0, int(round(points * self._scale)))
+
+    def _add(self, bucket: int, delta: int):
+        i = bucket + 1
+        while i <= self._size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, bucket: int) -> int:
+        """Число пользователей с бакетом <= bucket."""
+        i, total = bucket + 1, 0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _grow(self, bucket: int):
+        while self._size <= bucket:
+            self._size *= 2
+        buckets = list(self._buckets.items())
+        self._tree = [0] * (self._size + 1)
+        for _, b in buckets:
+            self._add(b, 1)
+
+
+class Leaderboard:
+    """
+    Кэшированный снимок топ-N (глобально и по уровням).
+    Снимок живёт ttl секунд, страницы отдаются из памяти.
+    """
+
+    def __init__(self, size: int = 100, page_size: int = 10, ttl: float = 60.0):
+        self.size = size
+        self.page_size = page_size
+        self.ttl = ttl
+        self._snapshots = {}  # level | None -> (loaded_at, rows)
+        self._pool = None
+
+    def attach_pool(self, pool):
+        self._pool = pool
+
+    def invalidate(self):
+        self._snapshots.clear()
+
+    async def page(self, level: str = None, page: int = 0):
+        """Возвращает (строки страницы, число страниц)."""
+        rows = await self._snapshot(level)
+        pages = max(1, -(-len(rows) // self.page_size))
+        page = min(max(page, 0), pages - 1)
+        start = page * self.page_size
+        return rows[start:start + self.page_size], pages
+
+    async def _snapshot(self, level):
+        cached = self._snapshots.get(level)
+        if cached and time.monotonic() - cached[0] < self.ttl:
+            metrics.inc("leaderboard_cache_hits")
+            return cached[1]
+        metrics.inc("leaderboard_cache_misses")
+        async with self._pool.acquire() as conn:
+            if level:
+                rows = await conn.fetch('''
+                    SELECT id, name, level, points FROM users
+                    WHERE level = $1
+                    ORDER BY points DESC, id
+                    LIMIT $2
+                ''', level, self.size)
+            else:
+                rows = await conn.fetch('''
+                    SELECT id, name, level, points FROM users
+                    ORDER BY points DESC, id
+                    LIMIT $1
+                ''', self.size)
+        self._snapshots[level] = (time.monotonic(), rows)
+        return rows
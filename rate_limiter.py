@@ -0,0 +1,38 @@
+import asyncio
+import time
+
+
+class RateLimiter:
+    """
+    Token bucket: не больше rate запросов в секунду, короткие всплески до burst.
+    Один экземпляр делится между всеми фоновыми задачами, которые ходят в Telegram API,
+    чтобы их суммарный поток не упирался в лимиты бота.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0):
+        # Под локом — чтобы ожидающие получали токены по очереди, а не гонялись за ними
+        async with self._lock:
+            self._refill()
+            while self._tokens < tokens:
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= tokens
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
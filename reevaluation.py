@@ -0,0 +1,122 @@
+import asyncio
+import logging
+
+from llm_scheduler import Priority, with_priority
+from metrics import metrics
+
+
+class ReevaluationQueue:
+    """
+    Ответы, которые не удалось оценить LLM (предохранитель разомкнут или сервис
+    не ответил). Пользователь сразу получает предварительную оценку, а ответ
+    лежит в pending_evaluations, пока фоновый run() не дооценит его.
+
+    Очередь разбирается, только когда предохранитель пропускает запросы; первая
+    же неудача прерывает пачку, чтобы не долбить лежащий сервис. on_result
+    начисляет баллы и сообщает пользователю итог; после него строка удаляется.
+
+    run() крутится на каждой реплике: строки забираются атомарно (claimed_at,
+    FOR UPDATE SKIP LOCKED), так что один ответ оценивает только одна реплика.
+    Захват реплики, упавшей посреди пачки, истекает через claim_seconds.
+    """
+
+    def __init__(self, evaluate, on_result, breaker, interval: float = 30.0, batch_size: int = 20,
+                 max_attempts: int = 10, claim_seconds: float = 600.0):
+        self.evaluate = evaluate
+        self.on_result = on_result
+        self.breaker = breaker
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.claim_seconds = claim_seconds
+        self._pool = None
+
+    def attach_pool(self, pool):
+        self._pool = pool
+
+    async def enqueue(self, user_id: int, chat_id: int, question: str, answer: str, grade: str, topic: str,
+                      is_academy: bool, is_suspicious: bool, last_score: float, provisional_score: float) -> bool:
+        try:
+            async with self._pool.acquire() as conn:
+                # Новый ответ на тот же вопрос заменяет ещё не оценённый прежний
+                await conn.execute('''
+                    WITH superseded AS (
+                        DELETE FROM pending_evaluations
+                        WHERE user_id = $1 AND question = $3 AND claimed_at IS NULL
+                    )
+                    INSERT INTO pending_evaluations
+                        (user_id, chat_id, question, answer, grade, topic, is_academy, is_suspicious,
+                         last_score, provisional_score)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+                ''', user_id, chat_id, question, answer, grade, topic, is_academy, is_suspicious,
+                    last_score, provisional_score)
+        except Exception as e:
+            logging.error(f"[Reevaluation] Не удалось поставить ответ user={user_id} в очередь: {e}")
+            return False
+        metrics.inc("reevaluation_enqueued")
+        return True
+
+    async def process_batch(self) -> int:
+        """Дооценивает до batch_size ответов; возвращает, сколько удалось."""
+        if not self.breaker.available:
+            return 0
+        async with self._pool.acquire() as conn:
+            rows = await conn.fetch('''
+                WITH picked AS (
+                    SELECT id FROM pending_evaluations
+                    WHERE attempts < $1
+                      AND (claimed_at IS NULL OR claimed_at < now() - make_interval(secs => $3))
+                    ORDER BY id
+                    LIMIT $2
+                    FOR UPDATE SKIP LOCKED
+                )
+                UPDATE pending_evaluations p SET claimed_at = now()
+                FROM picked WHERE p.id = picked.id
+                RETURNING p.*
+            ''', self.max_attempts, self.batch_size, self.claim_seconds)
+            metrics.set_gauge("reevaluation_pending", await conn.fetchval("SELECT COUNT(*) FROM pending_evaluations"))
+
+        rows = sorted(rows, key=lambda r: r["id"])
+        done = 0
+        for index, row in enumerate(rows):
+            if not self.breaker.available:
+                await self._release(rows[index:])
+                break
+            # Разбор очереди не должен отнимать слоты у живых пользователей
+            evaluation = await with_priority(Priority.BACKGROUND, self.evaluate(row["question"], row["answer"]))
+            if evaluation is None:
+                await self._release(rows[index:index + 1], failed=True)
+                await self._release(rows[index + 1:])
+                break
+            try:
+                await self.on_result(row, evaluation)
+            except Exception as e:
+                logging.exception(f"[Reevaluation] Не удалось применить оценку #{row['id']}: {e}")
+                await self._release([row], failed=True)
+                continue
+            async with self._pool.acquire() as conn:
+                await conn.execute("DELETE FROM pending_evaluations WHERE id = $1", row["id"])
+            done += 1
+            metrics.inc("reevaluation_completed")
+        if done:
+            logging.info(f"[Reevaluation] Дооценено ответов: {done}")
+        return done
+
+    async def _release(self, rows, failed: bool = False):
+        """Возвращает захваченные строки в очередь; failed — засчитать попытку."""
+        if not rows:
+            return
+        async with self._pool.acquire() as conn:
+            await conn.execute('''
+                UPDATE pending_evaluations
+                SET claimed_at = NULL, attempts = attempts + CASE WHEN $2 THEN 1 ELSE 0 END
+                WHERE id = ANY($1::int[])
+            ''', [r["id"] for r in rows], failed)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.process_batch()
+            except Exception as e:
+                logging.warning(f"[Reevaluation] Ошибка обработки очереди: {e}")
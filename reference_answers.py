@@ -0,0 +1,204 @@
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+
+from metrics import metrics
+from similarity import vector_to_bytes, vector_from_bytes
+
+
+def question_hash(question: str, grade: str) -> str:
+    """Ключ эталонного ответа: хэш от текста вопроса и грейда."""
+    return hashlib.sha256(f"{grade}\n{question.strip()}".encode("utf-8")).hexdigest()
+
+
+class _Generation:
+    """Одна генерация эталона: фоновая задача и уже полученный текст."""
+
+    def __init__(self):
+        self.task = None
+        self.text = ""
+        self.finished = False
+        self.changed = asyncio.Condition()
+
+    async def publish(self, text: str, finished: bool = False):
+        async with self.changed:
+            self.text = text
+            self.finished = self.finished or finished
+            self.changed.notify_all()
+
+
+class ReferenceAnswerStore:
+    """
+    Эталонные ответы, по одному на вопрос.
+    Генерация стартует фоновой задачей в момент выдачи вопроса, пока пользователь
+    думает над ответом. Анти-чит проверка и «Показать правильный ответ» ждут ту же
+    задачу, поэтому повторные отправки за генерацию не платят.
+
+    generator может вернуть строку (корутина) или асинхронный итератор фрагментов;
+    во втором случае stream() отдаёт текст по мере генерации.
+
+    background (корутина -> корутина) оборачивает генерацию, запущенную prefetch(),
+    например понижает приоритет её LLM-запросов: пользователь её пока не ждёт.
+    """
+
+    def __init__(self, generator, max_entries: int = 2000,
+                 error_text: str = "❌ Ошибка генерации эталонного ответа.", background=None):
+        self._generator = generator  # (question, grade) -> awaitable str | async iterator of str
+        self._error_text = error_text
+        self._background = background
+        self._tasks = OrderedDict()  # ключ -> _Generation
+        self._embeddings = OrderedDict()  # ключ -> нормированный float32-вектор эталона
+        self._max_entries = max_entries
+        self._pool = None
+
+    def attach_pool(self, pool):
+        self._pool = pool
+
+    def clear(self):
+        self._tasks.clear()
+        self._embeddings.clear()
+
+    def prefetch(self, question: str, grade: str) -> str:
+        """Запускает генерацию в фоне (если её ещё нет) и возвращает ключ вопроса."""
+        return self._start(question, grade, background=True)
+
+    def _start(self, question: str, grade: str, background: bool = False) -> str:
+        key = question_hash(question, grade)
+        if key in self._tasks:
+            self._tasks.move_to_end(key)
+            return key
+        generation = self._tasks[key] = _Generation()
+        produce = self._produce(key, generation, question, grade)
+        if background and self._background:
+            produce = self._background(produce)
+        generation.task = asyncio.create_task(produce)
+        while len(self._tasks) > self._max_entries:
+            self._tasks.popitem(last=False)
+        return key
+
+    async def get(self, question: str, grade: str) -> str:
+        key = self._start(question, grade)
+        task = self._tasks[key].task
+        if task.done():
+            metrics.inc("reference_answer_hits")
+        else:
+            metrics.inc("reference_answer_waits")
+        # shield: отмена ожидающего хэндлера не должна убивать общую генерацию
+        return await asyncio.shield(task)
+
+    async def stream(self, question: str, grade: str):
+        """
+        Отдаёт уже сгенерированный текст эталона каждый раз, когда он меняется.
+        Последний отданный текст — итоговый: эталон или текст ошибки.
+        """
+        key = self._start(question, grade)
+        generation = self._tasks[key]
+        last = ""
+        while True:
+            async with generation.changed:
+                await generation.changed.wait_for(lambda: generation.text != last or generation.finished)
+                text, finished = generation.text, generation.finished
+            if text != last:
+                last = text
+                yield text
+            if finished:
+                return
+
+    async def get_embedding(self, question: str, grade: str):
+        """Кэшированный эмбеддинг эталона (память, затем БД) или None."""
+        key = question_hash(question, grade)
+        vec = self._embeddings.get(key)
+        if vec is None and self._pool:
+            try:
+                async with self._pool.acquire() as conn:
+                    raw = await conn.fetchval(
+                        "SELECT embedding FROM reference_answers WHERE question_hash = $1", key
+                    )
+            except Exception as e:
+                logging.warning(f"[ReferenceAnswers] Не удалось прочитать эмбеддинг {key[:12]}: {e}")
+                raw = None
+            if raw:
+                vec = vector_from_bytes(raw)
+                self._remember_embedding(key, vec)
+        if vec is None:
+            metrics.inc("reference_embedding_misses")
+        else:
+            metrics.inc("reference_embedding_hits")
+        return vec
+
+    async def save_embedding(self, question: str, grade: str, vec):
+        key = question_hash(question, grade)
+        self._remember_embedding(key, vec)
+        if not self._pool:
+            return
+        try:
+            async with self._pool.acquire() as conn:
+                await conn.execute(
+                    "UPDATE reference_answers SET embedding = $2 WHERE question_hash = $1",
+                    key, vector_to_bytes(vec)
+                )
+        except Exception as e:
+            logging.warning(f"[ReferenceAnswers] Не удалось сохранить эмбеддинг {key[:12]}: {e}")
+
+    def _remember_embedding(self, key: str, vec):
+        self._embeddings[key] = vec
+        self._embeddings.move_to_end(key)
+        while len(self._embeddings) > self._max_entries:
+            self._embeddings.popitem(last=False)
+
+    async def _produce(self, key: str, generation: _Generation, question: str, grade: str) -> str:
+        answer = None
+        try:
+            answer = await self._load(key)
+            if answer:
+                return answer
+            try:
+                result = self._generator(question, grade)
+                if hasattr(result, "__aiter__"):
+                    parts = []
+                    async for chunk in result:
+                        parts.append(chunk)
+                        await generation.publish("".join(parts))
+                    answer = "".join(parts).strip()
+                else:
+                    answer = await result
+            except Exception as e:
+                logging.error(f"[ReferenceAnswers] Ошибка генерации эталона {key[:12]}: {e}")
+                answer = self._error_text
+            if not answer or answer.startswith("❌"):
+                answer = answer or self._error_text
+                # Ошибку не запоминаем — следующий запрос попробует ещё раз
+                if self._tasks.get(key) is generation:
+                    del self._tasks[key]
+                return answer
+            metrics.inc("reference_answer_generated")
+            await self._save(key, grade, answer)
+            return answer
+        finally:
+            await generation.publish(answer or "", finished=True)
+
+    async def _load(self, key: str):
+        if not self._pool:
+            return None
+        try:
+            async with self._pool.acquire() as conn:
+                return await conn.fetchval(
+                    "SELECT answer FROM reference_answers WHERE question_hash = $1", key
+                )
+        except Exception as e:
+            logging.warning(f"[ReferenceAnswers] Не удалось прочитать эталон {key[:12]}: {e}")
+            return None
+
+    async def _save(self, key: str, grade: str, answer: str):
+        if not self._pool:
+            return
+        try:
+            async with self._pool.acquire() as conn:
+                await conn.execute('''
+                    INSERT INTO reference_answers (question_hash, grade, answer)
+                    VALUES ($1, $2, $3)
+                    ON CONFLICT (question_hash) DO NOTHING
+                ''', key, grade, answer)
+        except Exception as e:
+            logging.warning(f"[ReferenceAnswers] Не удалось сохранить эталон {key[:12]}: {e}")
@@ -0,0 +1,220 @@
+"""
+Агрегаты по ответам и пользователям для админки и Metabase.
+
+Таблицы answer_stats_* и stats_totals поддерживаются триггерами на INSERT в answers
+и users, поэтому чтение метрик не зависит от размера answers. При первом запуске
+агрегаты один раз заполняются из существующих данных.
+
+Счётчики, которые трогает каждая вставка (за день, по теме, по грейду, итоги),
+разбиты на ROLLUP_SHARDS строк по user_id % ROLLUP_SHARDS: параллельные ответы
+разных пользователей не ждут блокировку одной строки. При чтении шарды суммируются.
+
+Ответы в боте только добавляются (UPDATE/DELETE по answers нет) — триггеры
+обрабатывают только вставку; после ручной правки данных вызовите rebuild_rollups().
+"""
+import logging
+
+# Ключ advisory-лока, чтобы два процесса не пересоздавали триггеры одновременно
+ROLLUP_LOCK_ID = 7_140_001
+# Число строк-шардов у каждого общего счётчика
+ROLLUP_SHARDS = 16
+
+# Таблицы до шардирования: агрегаты производные, их проще пересоздать и заполнить заново
+UNSHARDED_CHECK = '''
+    SELECT to_regclass('stats_totals') IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'stats_totals' AND column_name = 'shard'
+    )
+'''
+DROP_UNSHARDED = '''
+    DROP TABLE IF EXISTS answer_stats_daily, answer_stats_topic, answer_stats_grade, stats_totals;
+'''
+
+ROLLUP_TABLES = '''
+    CREATE TABLE IF NOT EXISTS answer_stats_daily (
+        day DATE NOT NULL,
+        shard SMALLINT NOT NULL,
+        answers BIGINT NOT NULL DEFAULT 0,
+        score_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+        suspicious BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, shard)
+    );
+    CREATE TABLE IF NOT EXISTS answer_stats_topic (
+        topic TEXT NOT NULL,
+        shard SMALLINT NOT NULL,
+        answers BIGINT NOT NULL DEFAULT 0,
+        score_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+        PRIMARY KEY (topic, shard)
+    );
+    CREATE TABLE IF NOT EXISTS answer_stats_grade (
+        grade TEXT NOT NULL,
+        shard SMALLINT NOT NULL,
+        answers BIGINT NOT NULL DEFAULT 0,
+        score_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+        PRIMARY KEY (grade, shard)
+    );
+    CREATE TABLE IF NOT EXISTS answer_stats_user (
+        user_id BIGINT PRIMARY KEY,
+        answers BIGINT NOT NULL DEFAULT 0,
+        score_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+        first_answer_at TIMESTAMP,
+        last_answer_at TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS stats_totals (
+        shard SMALLINT PRIMARY KEY,
+        users BIGINT NOT NULL DEFAULT 0,
+        answering_users BIGINT NOT NULL DEFAULT 0,
+        answers BIGINT NOT NULL DEFAULT 0,
+        score_sum DOUBLE PRECISION NOT NULL DEFAULT 0
+    );
+'''
+
+ROLLUP_TRIGGERS = f'''
+    CREATE OR REPLACE FUNCTION rollup_answer_insert() RETURNS trigger AS $$
+    DECLARE
+        first_answer BOOLEAN;
+        score DOUBLE PRECISION := COALESCE(NEW.score, 0);
+        ts TIMESTAMP := COALESCE(NEW.created_at, now());
+        part SMALLINT := abs(COALESCE(NEW.user_id, 0) % {ROLLUP_SHARDS});
+    BEGIN
+        INSERT INTO answer_stats_daily AS s (day, shard, answers, score_sum, suspicious)
+        VALUES (ts::date, part, 1, score, CASE WHEN NEW.is_suspicious THEN 1 ELSE 0 END)
+        ON CONFLICT (day, shard) DO UPDATE
+        SET answers = s.answers + 1, score_sum = s.score_sum + EXCLUDED.score_sum,
+            suspicious = s.suspicious + EXCLUDED.suspicious;
+
+        INSERT INTO answer_stats_topic AS s (topic, shard, answers, score_sum)
+        VALUES (COALESCE(NEW.topic, ''), part, 1, score)
+        ON CONFLICT (topic, shard) DO UPDATE
+        SET answers = s.answers + 1, score_sum = s.score_sum + EXCLUDED.score_sum;
+
+        INSERT INTO answer_stats_grade AS s (grade, shard, answers, score_sum)
+        VALUES (COALESCE(NEW.grade, ''), part, 1, score)
+        ON CONFLICT (grade, shard) DO UPDATE
+        SET answers = s.answers + 1, score_sum = s.score_sum + EXCLUDED.score_sum;
+
+        INSERT INTO answer_stats_user AS s (user_id, answers, score_sum, first_answer_at, last_answer_at)
+        VALUES (NEW.user_id, 1, score, ts, ts)
+        ON CONFLICT (user_id) DO UPDATE
+        SET answers = s.answers + 1, score_sum = s.score_sum + EXCLUDED.score_sum,
+            last_answer_at = GREATEST(s.last_answer_at, EXCLUDED.last_answer_at)
+        RETURNING (xmax = 0) INTO first_answer;
+
+        INSERT INTO stats_totals AS s (shard, answers, score_sum, answering_users)
+        VALUES (part, 1, score, CASE WHEN first_answer THEN 1 ELSE 0 END)
+        ON CONFLICT (shard) DO UPDATE
+        SET answers = s.answers + 1,
+            score_sum = s.score_sum + EXCLUDED.score_sum,
+            answering_users = s.answering_users + EXCLUDED.answering_users;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION rollup_user_insert() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO stats_totals AS s (shard, users)
+        VALUES (abs(NEW.id % {ROLLUP_SHARDS}), 1)
+        ON CONFLICT (shard) DO UPDATE SET users = s.users + 1;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS answers_rollup ON answers;
+    CREATE TRIGGER answers_rollup AFTER INSERT ON answers
+        FOR EACH ROW EXECUTE FUNCTION rollup_answer_insert();
+
+    DROP TRIGGER IF EXISTS users_rollup ON users;
+    CREATE TRIGGER users_rollup AFTER INSERT ON users
+        FOR EACH ROW EXECUTE FUNCTION rollup_user_insert();
+'''
+
+
+async def ensure_rollups(conn):
+    """Создаёт агрегаты и триггеры; при первом запуске заполняет их по истории."""
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock($1)", ROLLUP_LOCK_ID)
+        if await conn.fetchval(UNSHARDED_CHECK):
+            logging.info("[Rollups] Агрегаты без шардов — пересоздаём")
+            await conn.execute(DROP_UNSHARDED)
+        await conn.execute(ROLLUP_TABLES)
+        await conn.execute(ROLLUP_TRIGGERS)
+        if await conn.fetchval("SELECT NOT EXISTS (SELECT 1 FROM stats_totals)"):
+            await _backfill(conn)
+
+
+async def rebuild_rollups(conn):
+    """Пересчитывает агрегаты с нуля (после ручной правки answers/users)."""
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock($1)", ROLLUP_LOCK_ID)
+        await _backfill(conn)
+
+
+async def _backfill(conn):
+    # SHARE блокирует вставки на время пересчёта — ни один ответ не потеряется и не задвоится
+    await conn.execute("LOCK TABLE answers, users IN SHARE MODE")
+    await conn.execute('''
+        TRUNCATE answer_stats_daily, answer_stats_topic, answer_stats_grade, answer_stats_user, stats_totals
+    ''')
+    await conn.execute('''
+        INSERT INTO answer_stats_daily (day, shard, answers, score_sum, suspicious)
+        SELECT COALESCE(created_at, now())::date, abs(COALESCE(user_id, 0) % $1), COUNT(*),
+               COALESCE(SUM(score::double precision), 0), COUNT(*) FILTER (WHERE is_suspicious)
+        FROM answers GROUP BY 1, 2
+    ''', ROLLUP_SHARDS)
+    await conn.execute('''
+        INSERT INTO answer_stats_topic (topic, shard, answers, score_sum)
+        SELECT COALESCE(topic, ''), abs(COALESCE(user_id, 0) % $1), COUNT(*), COALESCE(SUM(score::double precision), 0)
+        FROM answers GROUP BY 1, 2
+    ''', ROLLUP_SHARDS)
+    await conn.execute('''
+        INSERT INTO answer_stats_grade (grade, shard, answers, score_sum)
+        SELECT COALESCE(grade, ''), abs(COALESCE(user_id, 0) % $1), COUNT(*), COALESCE(SUM(score::double precision), 0)
+        FROM answers GROUP BY 1, 2
+    ''', ROLLUP_SHARDS)
+    await conn.execute('''
+        INSERT INTO answer_stats_user (user_id, answers, score_sum, first_answer_at, last_answer_at)
+        SELECT user_id, COUNT(*), COALESCE(SUM(score::double precision), 0), MIN(created_at), MAX(created_at)
+        FROM answers WHERE user_id IS NOT NULL GROUP BY user_id
+    ''')
+    await conn.execute('''
+        INSERT INTO stats_totals (shard, users, answering_users, answers, score_sum)
+        SELECT p.shard,
+               (SELECT COUNT(*) FROM users WHERE abs(id % $1) = p.shard),
+               (SELECT COUNT(*) FROM answer_stats_user WHERE abs(user_id % $1) = p.shard),
+               (SELECT COALESCE(SUM(answers), 0) FROM answer_stats_daily d WHERE d.shard = p.shard),
+               (SELECT COALESCE(SUM(score_sum), 0) FROM answer_stats_daily d WHERE d.shard = p.shard)
+        FROM generate_series(0, $1 - 1) AS p(shard)
+    ''', ROLLUP_SHARDS)
+    logging.info("[Rollups] Агрегаты пересчитаны по истории ответов")
+
+
+async def fetch_totals(conn) -> dict:
+    row = await conn.fetchrow('''
+        SELECT SUM(users)::bigint AS users, SUM(answering_users)::bigint AS answering_users,
+               SUM(answers)::bigint AS answers, SUM(score_sum) AS score_sum
+        FROM stats_totals
+        HAVING COUNT(*) > 0
+    ''')
+    if row is None:
+        return {"users": 0, "answering_users": 0, "answers": 0, "score_sum": 0.0}
+    return dict(row)
+
+
+async def fetch_product_metrics(conn, top_topics: int = 3) -> dict:
+    """Метрики для экрана «📈 Метрики продукта» — только чтения агрегатов."""
+    totals = await fetch_totals(conn)
+    topics = await conn.fetch('''
+        SELECT topic, SUM(answers)::bigint AS answers FROM answer_stats_topic
+        GROUP BY topic ORDER BY answers DESC LIMIT $1
+    ''', top_topics)
+    today = await conn.fetchrow('''
+        SELECT SUM(answers)::bigint AS answers, SUM(score_sum) AS score_sum FROM answer_stats_daily
+        WHERE day = CURRENT_DATE HAVING COUNT(*) > 0
+    ''')
+    return {
+        "tasks_avg": totals["answers"] / totals["answering_users"] if totals["answering_users"] else 0.0,
+        "avg_score": totals["score_sum"] / totals["answers"] if totals["answers"] else 0.0,
+        "top_topics": [(r["topic"], r["answers"]) for r in topics],
+        "answers_today": today["answers"] if today else 0,
+        "users": totals["users"],
+    }
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+
+from metrics import metrics
+
+ALL = "all"
+
+
+class ScoreHistogram:
+    """
+    Распределение баллов пользователей: гистограмма с фиксированными бакетами
+    ширины bucket_width (последний бакет собирает всё, что выше).
+
+    Ведётся отдельно для всей базы (scope "all") и для каждого уровня. Обновляется
+    на каждом изменении баллов (move), процентиль и квантиль считаются за O(buckets)
+    без сортировки users. Таблица score_histogram общая для всех реплик: каждая
+    периодически дописывает в неё свои изменения (count = count + delta) и
+    перечитывает итог, подхватывая изменения остальных. При старте таблица
+    загружается, а если разошлась с числом пользователей — пересобирается по users.
+    """
+
+    def __init__(self, bucket_width: float = 0.1, buckets: int = 5000, save_interval: float = 60.0):
+        self.bucket_width = bucket_width
+        self.buckets = buckets
+        self.save_interval = save_interval
+        self._counts = {}  # scope -> [count] * buckets
+        self._deltas = {}  # (scope, bucket) -> изменение, ещё не записанное в базу
+        self._pool = None
+
+    def attach_pool(self, pool):
+        self._pool = pool
+
+    def _bucket(self, points: float) -> int:
+        return min(self.buckets - 1, max(0, int((points or 0.0) / self.bucket_width)))
+
+    def _scope(self, scope: str) -> list:
+        counts = self._counts.get(scope)
+        if counts is None:
+            counts = self._counts[scope] = [0] * self.buckets
+        return counts
+
+    def total(self, scope: str = ALL) -> int:
+        return sum(self._counts.get(scope, ()))
+
+    # --------------------------
+    # Обновление
+    # --------------------------
+
+    def add(self, points: float, level: str, count: int = 1):
+        bucket = self._bucket(points)
+        for scope in (ALL, level):
+            self._scope(scope)[bucket] += count
+            self._deltas[(scope, bucket)] = self._deltas.get((scope, bucket), 0) + count
+
+    def move(self, old_points: float, new_points: float, old_level: str, new_level: str):
+        """Пользователь перешёл из (old_points, old_level) в (new_points, new_level)."""
+        if self._bucket(old_points) == self._bucket(new_points) and old_level == new_level:
+            return
+        self.add(old_points, old_level, -1)
+        self.add(new_points, new_level, 1)
+
+    # --------------------------
+    # Запросы
+    # --------------------------
+
+    def percentile(self, points: float, scope: str = ALL):
+        """Доля пользователей (в %), у которых баллов меньше; None — если данных нет."""
+        counts = self._counts.get(scope)
+        if not counts:
+            return None
+        bucket = self._bucket(points)
+        below = sum(counts[:bucket])
+        total = below + sum(counts[bucket:])
+        if total == 0:
+            return None
+        # Внутри бакета считаем баллы распределёнными равномерно
+        if bucket < self.buckets - 1:
+            offset = (points or 0.0) / self.bucket_width - bucket
+            below += counts[bucket] * min(1.0, max(0.0, offset))
+        return 100.0 * below / total
+
+    def quantile(self, q: float, scope: str = ALL):
+        """Баллы, ниже которых доля q пользователей (0 ≤ q ≤ 1); None — если данных нет."""
+        counts = self._counts.get(scope)
+        total = sum(counts) if counts else 0
+        if total == 0:
+            return None
+        target = q * total
+        seen = 0
+        for bucket, count in enumerate(counts):
+            if count and seen + count >= target:
+                return (bucket + (target - seen) / count) * self.bucket_width
+            seen += count
+        return self.buckets * self.bucket_width
+
+    # --------------------------
+    # Хранение
+    # --------------------------
+
+    async def load(self):
+        """Загружает снимок; если его нет или он не сходится с users — пересобирает."""
+        async with self._pool.acquire() as conn:
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS score_histogram (
+                    scope TEXT,
+                    bucket INTEGER,
+                    count BIGINT NOT NULL,
+                    PRIMARY KEY (scope, bucket)
+                )
+            ''')
+            async with conn.transaction():
+                # Пересобирает одна реплика; остальные ждут и читают её результат
+                await conn.execute("SELECT pg_advisory_xact_lock(hashtext('score_histogram'))")
+                meta = await conn.fetchrow('''
+                    SELECT COALESCE(SUM(count) FILTER (WHERE scope = $1), 0) AS snapshot_users,
+                           (SELECT COUNT(*) FROM users) AS users,
+                           COUNT(DISTINCT bucket) FILTER (WHERE bucket >= $2) AS out_of_range
+                    FROM score_histogram
+                ''', ALL, self.buckets)
+                # Небольшое расхождение — изменения других реплик, ещё не записанные в таблицу
+                drift = abs(meta["snapshot_users"] - meta["users"])
+                empty = not meta["snapshot_users"] and meta["users"]
+                if not empty and not meta["out_of_range"] and drift <= max(10, meta["users"] // 100):
+                    rows = await conn.fetch("SELECT scope, bucket, count FROM score_histogram")
+                    source = "снимка"
+                else:
+                    # Снимок пустой или устарел (потеряны изменения, смена ширины бакетов)
+                    rows = await conn.fetch('''
+                        SELECT level AS scope, LEAST($2 - 1, GREATEST(0, floor(COALESCE(points, 0) / $1)))::int AS bucket,
+                               COUNT(*) AS count
+                        FROM users GROUP BY 1, 2
+                    ''', self.bucket_width, self.buckets)
+                    source = "users"
+                    # Пересобранный снимок записывается целиком, дальше — только изменения
+                    await conn.execute("DELETE FROM score_histogram")
+                    await conn.copy_records_to_table("score_histogram", records=self._with_totals(rows),
+                                                     columns=["scope", "bucket", "count"])
+                    rows = await conn.fetch("SELECT scope, bucket, count FROM score_histogram")
+
+        self._apply(rows)
+        self._deltas = {}
+        logging.info(f"[ScoreHistogram] Загружено из {source}: {self.total()} пользователей")
+
+    @staticmethod
+    def _with_totals(rows) -> list:
+        """Строки (уровень, бакет, count) из users плюс строки всей базы (в users её нет)."""
+        totals = {}
+        records = []
+        for row in rows:
+            records.append((row["scope"] or "", row["bucket"], row["count"]))
+            totals[row["bucket"]] = totals.get(row["bucket"], 0) + row["count"]
+        return records + [(ALL, bucket, count) for bucket, count in totals.items()]
+
+    def _apply(self, rows):
+        self._counts = {}
+        for row in rows:
+            self._scope(row["scope"])[row["bucket"]] += row["count"]
+
+    async def save(self):
+        """Дописывает свои изменения в общую таблицу и перечитывает её."""
+        deltas, self._deltas = self._deltas, {}
+        try:
+            async with self._pool.acquire() as conn:
+                if deltas:
+                    async with conn.transaction():
+                        await conn.executemany('''
+                            INSERT INTO score_histogram AS h (scope, bucket, count) VALUES ($1, $2, $3)
+                            ON CONFLICT (scope, bucket) DO UPDATE SET count = h.count + EXCLUDED.count
+                        ''', [(scope, bucket, delta) for (scope, bucket), delta in deltas.items() if delta])
+                        await conn.execute("DELETE FROM score_histogram WHERE count = 0")
+                rows = await conn.fetch("SELECT scope, bucket, count FROM score_histogram")
+        except Exception:
+            # Не записали — вернём изменения, добавив к накопленным за это время
+            for key, delta in deltas.items():
+                self._deltas[key] = self._deltas.get(key, 0) + delta
+            raise
+        self._apply(rows)
+        # Изменения, сделанные, пока шёл запрос, ещё не в базе — накладываем поверх
+        for (scope, bucket), delta in self._deltas.items():
+            self._scope(scope)[bucket] += delta
+        metrics.set_gauge("score_histogram_buckets", len(rows))
+
+    async def run_saver(self):
+        try:
+            while True:
+                await asyncio.sleep(self.save_interval)
+                try:
+                    await self.save()
+                except Exception as e:
+                    logging.warning(f"[ScoreHistogram] Не удалось сохранить снимок: {e}")
+        finally:
+            await self.save()
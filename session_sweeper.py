@@ -0,0 +1,164 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from metrics import metrics
+
+# Telegram принимает не больше 100 id в одном deleteMessages
+DELETE_CHUNK = 100
+
+
+async def delete_bot_messages(bot: Bot, chat_id: int, message_ids, limiter=None) -> int:
+    """Удаляет сообщения пачками через delete_messages. Возвращает число отправленных id."""
+    ids = sorted(set(message_ids))
+    sent = 0
+    for i in range(0, len(ids), DELETE_CHUNK):
+        chunk = ids[i:i + DELETE_CHUNK]
+        while True:
+            if limiter:
+                await limiter.acquire()
+            try:
+                await bot.delete_messages(chat_id=chat_id, message_ids=chunk)
+                sent += len(chunk)
+                break
+            except TelegramRetryAfter as e:
+                logging.warning(f"[SessionSweeper] Flood control, ждём {e.retry_after} сек")
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                # Старые (>48 ч) и уже удалённые сообщения Telegram пропускает сам,
+                # сюда попадают только ошибки чата целиком — повторять бессмысленно
+                logging.warning(f"[SessionSweeper] Не удалось удалить сообщения в чате {chat_id}: {e}")
+                break
+    return sent
+
+
+class SessionSweeper:
+    """
+    Фоновое выселение неактивных сессий.
+
+    Сроки истечения лежат в куче (deadline, seq, key) — по одной записи на ключ.
+    touch() только сдвигает срок в словаре; устаревшая запись, всплыв наверх кучи,
+    перекладывается на актуальный срок. Истёкшая сессия теряет FSM-состояние,
+    а её сообщения бота удаляются пачками под общим rate limiter.
+
+    Сроки в куче знает только этот процесс. Если хранилище ведёт общее время
+    активности (PostgresStorage.get_last_active), перед выселением сверяемся с ним:
+    пользователя могла обслуживать другая реплика — тогда срок просто переносится.
+
+    Чтобы вернувшийся пользователь увидел экран перезапуска, о выселенных ключах
+    остаются лёгкие «надгробия» (не дольше tombstone_ttl и не больше max_tombstones).
+    """
+
+    def __init__(self, storage, bot: Bot, timeout: int = 7200, interval: float = 30.0, limiter=None,
+                 tombstone_ttl: float = 7 * 24 * 3600, max_tombstones: int = 100_000):
+        self.storage = storage
+        self.bot = bot
+        self.timeout = timeout
+        self.interval = interval
+        self.limiter = limiter
+        self.tombstone_ttl = tombstone_ttl
+        self.max_tombstones = max_tombstones
+        self._heap = []
+        self._deadlines = {}          # StorageKey -> monotonic-срок истечения
+        self._swept = OrderedDict()   # StorageKey -> когда выселили
+        self._seq = itertools.count()
+
+    def touch(self, key: StorageKey):
+        deadline = time.monotonic() + self.timeout
+        if key not in self._deadlines:
+            heapq.heappush(self._heap, (deadline, next(self._seq), key))
+        self._deadlines[key] = deadline
+
+    def pop_swept(self, key: StorageKey) -> bool:
+        """True, если сессию этого ключа выселили, пока пользователя не было."""
+        swept_at = self._swept.pop(key, None)
+        return swept_at is not None and time.monotonic() - swept_at <= self.tombstone_ttl
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    async def sweep(self) -> int:
+        now = time.monotonic()
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, key = heapq.heappop(self._heap)
+            deadline = self._deadlines.get(key)
+            if deadline is None:
+                continue
+            if deadline > now:
+                heapq.heappush(self._heap, (deadline, next(self._seq), key))
+                continue
+            del self._deadlines[key]
+            expired.append(key)
+
+        evicted = 0
+        for key in expired:
+            try:
+                evicted += await self._evict(key)
+            except Exception as e:
+                logging.warning(f"[SessionSweeper] Не удалось выселить сессию {key}: {e}")
+
+        while self._swept and (len(self._swept) > self.max_tombstones or
+                               now - next(iter(self._swept.values())) > self.tombstone_ttl):
+            self._swept.popitem(last=False)
+
+        metrics.inc("sessions_swept", evicted)
+        metrics.set_gauge("sessions_tracked", len(self._deadlines))
+        if evicted:
+            logging.info(f"[SessionSweeper] Выселено сессий: {evicted}, активных: {len(self._deadlines)}")
+        return evicted
+
+    async def _evict(self, key: StorageKey) -> bool:
+        if hasattr(self.storage, "get_last_active"):
+            stored = await self.storage.get_last_active(key)
+            idle = time.time() - stored if stored is not None else None
+            if idle is not None and idle < self.timeout and key not in self._deadlines:
+                # Пользователь активен на другой реплике — ждём до его настоящего срока
+                deadline = time.monotonic() + self.timeout - idle
+                self._deadlines[key] = deadline
+                heapq.heappush(self._heap, (deadline, next(self._seq), key))
+                return False
+        data = await self.storage.get_data(key)
+        if key in self._deadlines:
+            # Пользователь вернулся, пока мы читали данные — сессия снова активна
+            return False
+        if not await self._drop_state(key):
+            return False
+        self._swept[key] = time.monotonic()
+        self._swept.move_to_end(key)
+
+        message_ids = data.get("bot_messages", [])
+        if message_ids:
+            deleted = await delete_bot_messages(self.bot, key.chat_id, message_ids, self.limiter)
+            metrics.inc("swept_messages_deleted", deleted)
+        return True
+
+    async def _drop_state(self, key: StorageKey) -> bool:
+        """False, если хранилище отказалось удалять: сессия успела стать активной."""
+        if isinstance(self.storage, MemoryStorage):
+            # defaultdict: запись надо именно убрать, а не обнулить, иначе память не освободится
+            self.storage.storage.pop(key, None)
+        elif hasattr(self.storage, "delete_idle"):
+            return await self.storage.delete_idle(key, self.timeout)
+        elif hasattr(self.storage, "delete"):
+            await self.storage.delete(key)
+        else:
+            await self.storage.set_state(key, None)
+            await self.storage.set_data(key, {})
+        return True
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logging.warning(f"[SessionSweeper] Проход не удался: {e}")
@@ -0,0 +1,23 @@
+import numpy as np
+
+
+def to_unit_vector(embedding) -> np.ndarray:
+    """Эмбеддинг -> нормированный float32-вектор (нулевой вектор остаётся нулевым)."""
+    vec = np.asarray(embedding, dtype=np.float32)
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm else vec
+
+
+def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Косинус между двумя уже нормированными векторами — просто скалярное произведение."""
+    if a.shape != b.shape:
+        return 0.0
+    return float(np.dot(a, b))
+
+
+def vector_to_bytes(vec: np.ndarray) -> bytes:
+    return np.asarray(vec, dtype=np.float32).tobytes()
+
+
+def vector_from_bytes(raw: bytes) -> np.ndarray:
+    return np.frombuffer(raw, dtype=np.float32)
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import re
+import time
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramBadRequest
+
+from metrics import metrics
+
+# Граница, по которой можно показать кусок текста: конец предложения или строки
+SENTENCE_BOUNDARY = re.compile(r"[.!?…:;](?=\s)|\n")
+CURSOR = " ▌"
+TELEGRAM_TEXT_LIMIT = 4096
+HTML_TAG = re.compile(r"<(/?)([a-zA-Z][a-zA-Z0-9-]*)[^>]*>")
+# Запас под «…» и закрывающие теги при обрезке HTML
+HTML_TRIM_RESERVE = 64
+
+
+def fit_text(text: str, limit: int = TELEGRAM_TEXT_LIMIT, html: bool = False) -> str:
+    """
+    Обрезает текст до limit символов с «…» в конце. Для HTML не режет внутри тега
+    или сущности (&amp;) и закрывает теги, оставшиеся открытыми.
+    """
+    if len(text) <= limit:
+        return text
+    if not html:
+        return text[:limit - 1] + "…"
+    cut = text[:limit - HTML_TRIM_RESERVE]
+    # Обрыв внутри тега или сущности — отступаем к их началу
+    if cut.rfind("<") > cut.rfind(">"):
+        cut = cut[:cut.rfind("<")]
+    if cut.rfind("&") > cut.rfind(";"):
+        cut = cut[:cut.rfind("&")]
+    opened = []
+    for match in HTML_TAG.finditer(cut):
+        closing, tag = match.group(1), match.group(2).lower()
+        if not closing:
+            opened.append(tag)
+        elif tag in opened:
+            del opened[len(opened) - 1 - opened[::-1].index(tag)]
+    return cut + "…" + "".join(f"</{tag}>" for tag in reversed(opened))
+
+
+class StreamingEditor:
+    """
+    Показывает текст, который ещё генерируется, правкой одного сообщения.
+
+    update() вызывается на каждый фрагмент, но сообщение правится не чаще раза
+    в min_interval секунд и только по границе предложения — чтобы не упираться
+    в лимит Telegram на редактирование и не показывать слова, оборванные на середине.
+    Промежуточные версии — простой текст; finish() делает финальную правку
+    с обычной разметкой и клавиатурой.
+    """
+
+    def __init__(self, message, header: str = "", min_interval: float = 1.5):
+        self.message = message
+        self.header = header
+        self.min_interval = min_interval
+        self._last_edit = time.monotonic()
+        self._shown = 0
+
+    async def update(self, text: str):
+        now = time.monotonic()
+        if now - self._last_edit < self.min_interval:
+            return
+        boundary = None
+        for boundary in SENTENCE_BOUNDARY.finditer(text):
+            pass
+        if boundary is None or boundary.end() <= self._shown:
+            return
+        visible = text[:boundary.end()].rstrip()
+        limit = TELEGRAM_TEXT_LIMIT - len(self.header) - len(CURSOR) - 1
+        if len(visible) > limit:
+            visible = visible[:limit] + "…"
+        self._shown = boundary.end()
+        self._last_edit = now
+        await self._edit(self.header + visible + CURSOR)
+
+    async def finish(self, text: str, **kwargs):
+        """
+        Финальная версия: text уже отформатирован вызывающим (parse_mode, reply_markup — в kwargs).
+        Слишком длинный текст обрезается до лимита Telegram, иначе правка упала бы с BadRequest.
+        """
+        text = fit_text(text, html=str(kwargs.get("parse_mode") or "").upper() == "HTML")
+        try:
+            await self._edit(text, final=True, **kwargs)
+        except TelegramRetryAfter as e:
+            # Финальную правку терять нельзя — ждём и повторяем
+            await asyncio.sleep(e.retry_after)
+            await self._edit(text, final=True, **kwargs)
+
+    async def _edit(self, text: str, final: bool = False, **kwargs):
+        try:
+            await self.message.edit_text(text, **kwargs)
+            metrics.inc("stream_edits")
+        except TelegramRetryAfter as e:
+            metrics.inc("stream_edit_flood_waits")
+            self._last_edit = time.monotonic() + e.retry_after
+            if final:
+                raise
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                return
+            if final:
+                raise
+            logging.warning(f"[StreamingEditor] Не удалось обновить сообщение: {e}")
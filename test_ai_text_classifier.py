@@ -0,0 +1,64 @@
+import random
+import time
+
+import numpy as np
+import pytest
+
+from ai_text_classifier import AITextClassifier, roc_auc, train
+
+LETTERS = "абвгдежзиклмнопрстуфхцчшэюя"
+AI_PHRASES = ["важно отметить", "таким образом", "в заключение", "следует учитывать",
+              "ключевым аспектом является", "комплексный подход"]
+
+
+def make_rows(n=900, seed=3):
+    rng = random.Random(seed)
+    vocabulary = ["".join(rng.choice(LETTERS) for _ in range(rng.randint(3, 9))) for _ in range(2000)]
+
+    def human():
+        return " ".join(rng.choice(vocabulary) for _ in range(25))
+
+    def generated():
+        return " ".join(rng.choice(vocabulary) for _ in range(15)) + " " + ", ".join(rng.sample(AI_PHRASES, 3))
+
+    rows = [(i, generated() if i % 3 == 0 else human(), i % 3 == 0) for i in range(1, n + 1)]
+    return rows, human, generated
+
+
+def test_classifier_separates_held_out_answers_quickly():
+    rows, human, generated = make_rows()
+    model = train(rows)
+
+    assert model.metrics["auc"] > 0.95
+    assert model.predict_proba(generated()) >= 0.8
+    assert model.predict_proba(human()) < 0.5
+
+    text = generated()
+    started = time.perf_counter()
+    for _ in range(200):
+        model.predict_proba(text)
+    assert (time.perf_counter() - started) / 200 < 0.001
+
+
+def test_save_and_load_roundtrip(tmp_path):
+    rows, _, generated = make_rows(n=300)
+    model = train(rows, epochs=5)
+    path = tmp_path / "clf.npy"
+    model.save(path)
+
+    loaded = AITextClassifier.load(path)
+    text = generated()
+    assert loaded.predict_proba(text) == pytest.approx(model.predict_proba(text), abs=1e-6)
+    assert loaded.metrics == model.metrics
+
+
+def test_train_requires_both_classes():
+    rows = [(i, "обычный ответ студента про метрики", False) for i in range(1, 100)]
+    with pytest.raises(ValueError):
+        train(rows)
+
+
+def test_roc_auc():
+    assert roc_auc([0.1, 0.2, 0.8, 0.9], [0, 0, 1, 1]) == 1.0
+    assert roc_auc([0.9, 0.8, 0.2, 0.1], [0, 0, 1, 1]) == 0.0
+    assert np.isnan(roc_auc([0.1, 0.2], [0, 0]))
@@ -0,0 +1,43 @@
+import asyncio
+import pytest
+
+from answer_pipeline import run_answer_pipeline
+
+
+@pytest.mark.asyncio
+async def test_rejection_cancels_evaluation():
+    evaluation_cancelled = asyncio.Event()
+
+    async def reject():
+        return "Ответ выглядит сгенерированным ИИ."
+
+    async def evaluate():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            evaluation_cancelled.set()
+            raise
+
+    result = await run_answer_pipeline({"ai_classifier": reject}, evaluate)
+
+    assert result.rejected_by == "ai_classifier"
+    assert result.evaluation is None
+    assert evaluation_cancelled.is_set()
+
+
+@pytest.mark.asyncio
+async def test_failing_check_is_skipped_and_stages_are_timed():
+    async def broken():
+        raise RuntimeError("network down")
+
+    async def passing():
+        return None
+
+    async def evaluate():
+        return "Итог: 0.8"
+
+    result = await run_answer_pipeline({"perplexity": broken, "similarity": passing}, evaluate)
+
+    assert not result.rejected
+    assert result.evaluation == "Итог: 0.8"
+    assert {"perplexity", "similarity", "evaluate", "total"} <= set(result.timings)
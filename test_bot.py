@@ -7,22 +7,36 @@ from bot import TaskState
 from unittest.mock import ANY
 from aiogram.types import CallbackQuery
 from bot import cb_show, cb_next
+import bot as bot_module
+from evaluation import parse_evaluation
+from metrics import Metrics
+
+async def fake_stream(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+EVALUATION_JSON = (
+    '{"relevance": 0.2, "completeness": 0.0, "argumentation": 0.0, "structure": 0.0, '
+    '"examples": 0.0, "total": 0.2, "feedback": "Хорошо"}'
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_reference_answers():
+    bot_module.reference_answers.clear()
+    yield
+    bot_module.reference_answers.clear()
 
 @pytest.mark.asyncio
 @patch("bot.bot.send_chat_action", new_callable=AsyncMock)
-@patch("bot.evaluate_answer", return_value="Критерии:\n• Соответствие вопросу: 0.2\nИтог: 0.2\nFeedback: Хорошо")
+@patch("bot.evaluate_answer", return_value=parse_evaluation(EVALUATION_JSON))
 @patch("bot.get_user_from_db", return_value={"name": "Антон"})
-@patch("bot.generate_correct_answer", return_value="Правильный ответ")
-@patch("bot.detect_gpt_phrases", return_value=False)
-@patch("bot.client.embeddings.create")
-@patch("bot.update_user_points")
-@patch("bot.update_level")
-@patch("bot.save_user_answer")
-@patch("bot.update_academy_topic_points")
-@patch("bot.update_user_academy_points")
+@patch("bot.stream_correct_answer", side_effect=lambda q, g: fake_stream("Правильный ответ"))
+@patch("bot.find_gpt_phrases", return_value=[])
+@patch("llm_gateway.embed", return_value=[[1.0, 0.0], [0.0, 1.0]])
+@patch("bot.commit_score", return_value={"points": 0.2, "level": "Junior", "old_level": "Junior", "rank": 1})
 async def test_handle_task_answer(
-    mock_update_academy, mock_update_user_academy, mock_save, mock_level, mock_points,
-    mock_emb, mock_detect, mock_user, mock_eval, mock_correct, mock_send_action
+    mock_commit, mock_emb, mock_detect, mock_user, mock_eval, mock_correct, mock_send_action
 ):
     state = AsyncMock(spec=FSMContext)
     state.get_data.return_value = {"grade": "Junior", "question": "Что такое JTBD?", "last_score": 0.0}
@@ -36,32 +50,35 @@ async def test_handle_task_answer(
     await handle_task_answer(message, state)
 
     assert message.answer.called
+    mock_commit.assert_awaited_once()
+    assert mock_commit.await_args.kwargs["score"] == 0.2
+    assert mock_commit.await_args.kwargs["last_score"] == 0.0
+    assert mock_commit.await_args.kwargs["criteria"] == {
+        "relevance": 0.2, "completeness": 0.0, "argumentation": 0.0, "structure": 0.0, "examples": 0.0
+    }
 
 
 @pytest.mark.asyncio
 @patch("bot.bot.send_chat_action", new_callable=AsyncMock)
-@patch("bot.evaluate_answer", return_value="Критерии:\n• Соответствие вопросу: 0.2\nИтог: 0.2\nFeedback: Хорошо")
+@patch("bot.evaluate_answer", return_value=parse_evaluation(EVALUATION_JSON))
 @patch("bot.get_user_from_db", return_value={"name": "Антон"})
-@patch("bot.detect_gpt_phrases", return_value=False)
+@patch("bot.find_gpt_phrases", return_value=[])
 @patch("bot.transcribe_audio", return_value="Это голосовой ответ")
 @patch("bot.bot.get_file")
 @patch("bot.bot.download_file")
-@patch("bot.generate_correct_answer", return_value="Правильный ответ")
-@patch("bot.client.embeddings.create")
-@patch("bot.update_user_points")
-@patch("bot.update_level")
-@patch("bot.save_user_answer")
-@patch("bot.update_academy_topic_points")
-@patch("bot.update_user_academy_points")
+@patch("bot.stream_correct_answer", side_effect=lambda q, g: fake_stream("Правильный ответ"))
+@patch("llm_gateway.embed", return_value=[[1.0, 0.0], [0.0, 1.0]])
+@patch("bot.commit_score", return_value={"points": 0.2, "level": "Junior", "old_level": "Junior", "rank": 1})
 async def test_process_voice_message(
-    mock_update_academy, mock_update_user_academy, mock_save, mock_level, mock_points,
-    mock_emb, mock_correct, mock_download, mock_get_file, mock_transcribe,
+    mock_commit, mock_emb, mock_correct, mock_download, mock_get_file, mock_transcribe,
     mock_detect, mock_user, mock_eval, mock_send_action
 ):
     state = AsyncMock(spec=FSMContext)
     state.get_data.return_value = {"grade": "Middle", "question": "Что такое CJM?", "last_score": 0.0}
     voice = MagicMock(spec=Voice)
     voice.file_id = "test_id"
+    voice.file_unique_id = "test_unique_id"
+    voice.file_size = 1000
     message = AsyncMock()
     message.voice = voice
     message.answer = AsyncMock()
@@ -71,6 +88,7 @@ async def test_process_voice_message(
     await process_voice_message(message, state)
 
     assert message.answer.called
+    mock_transcribe.assert_called_once()
 
 
 @pytest.mark.asyncio
@@ -108,7 +126,7 @@ async def test_handle_voice_answer_button(mock_send_action):
     state.set_state.assert_called_with(TaskState.waiting_for_voice)
 
 @pytest.mark.asyncio
-@patch("bot.generate_correct_answer", return_value="Эталонный ответ")
+@patch("bot.stream_correct_answer", side_effect=lambda q, g: fake_stream("Эталонный ", "ответ"))
 async def test_cb_show_correct_answer(mock_gen_correct):
     state = AsyncMock(spec=FSMContext)
     state.get_data.return_value = {"last_question": "Что такое CJM?", "last_grade": "Middle"}
@@ -145,3 +163,185 @@ async def test_cb_next_generates_new_question(mock_user, mock_gen):
     mock_gen.assert_called_once_with("Junior", "Маркетинг", "Антон")
     message.edit_text.assert_called_once()
     callback.answer.assert_called_once()
+
+
+@pytest.mark.asyncio
+@patch("bot.stream_correct_answer", side_effect=lambda q, g: fake_stream("Эталонный ", "ответ"))
+async def test_cb_show_reuses_prefetched_reference(mock_gen_correct):
+    bot_module.reference_answers.prefetch("Что такое JTBD?", "Junior")
+
+    state = AsyncMock(spec=FSMContext)
+    state.get_data.return_value = {"last_question": "Что такое JTBD?", "last_grade": "Junior"}
+    callback = AsyncMock(spec=CallbackQuery)
+    callback.message = AsyncMock()
+    callback.answer = AsyncMock()
+
+    await cb_show(callback, state)
+    await cb_show(callback, state)
+
+    mock_gen_correct.assert_called_once_with("Что такое JTBD?", "Junior")
+
+
+@pytest.mark.asyncio
+@patch("bot.bot.send_chat_action", new_callable=AsyncMock)
+@patch("bot.evaluate_answer", return_value=None)
+@patch("bot.get_user_from_db", return_value={"name": "Антон"})
+@patch("bot.stream_correct_answer", side_effect=lambda q, g: fake_stream("Правильный ответ"))
+@patch("bot.find_gpt_phrases", return_value=[])
+@patch("llm_gateway.embed", return_value=[[1.0, 0.0], [0.0, 1.0]])
+@patch("bot.reevaluation.enqueue", new_callable=AsyncMock, return_value=True)
+@patch("bot.commit_score")
+async def test_unavailable_llm_gives_provisional_score_and_keeps_answer(
+    mock_commit, mock_enqueue, mock_emb, mock_detect, mock_correct, mock_user, mock_eval, mock_send_action
+):
+    state = AsyncMock(spec=FSMContext)
+    state.get_data.return_value = {"grade": "Junior", "question": "Как измерить retention продукта?", "last_score": 0.0}
+
+    message = AsyncMock()
+    message.text = "Retention измеряю по когортам: например, доля вернувшихся на 7-й день, потому что это видно сразу."
+    message.answer = AsyncMock()
+    message.chat = MagicMock()
+    message.chat.id = 1
+    status = MagicMock()
+    status.edit_text = AsyncMock()
+    message.answer.return_value = status
+
+    await handle_task_answer(message, state)
+
+    mock_commit.assert_not_called()
+    mock_enqueue.assert_awaited_once()
+    assert mock_enqueue.await_args.kwargs["answer"] == message.text
+    assert mock_enqueue.await_args.kwargs["provisional_score"] > 0
+    state.clear.assert_not_called()
+    state.set_state.assert_awaited_with(TaskState.waiting_for_answer)
+    assert "Предварительная оценка" in status.edit_text.await_args.args[0]
+
+
+def test_points_to_next_level():
+    assert bot_module.points_to_next_level("Junior", 10.0) == 40.0
+    assert bot_module.points_to_next_level("Middle", 60.5) == 39.5
+    assert bot_module.points_to_next_level("CEO", 1000.0) is None
+
+
+@pytest.mark.asyncio
+@patch("bot.bot.send_chat_action", new_callable=AsyncMock)
+@patch("bot.evaluate_answer", return_value=parse_evaluation(EVALUATION_JSON))
+@patch("bot.get_user_from_db", return_value={"name": "Антон"})
+@patch("bot.stream_correct_answer", side_effect=lambda q, g: fake_stream("Правильный ответ"))
+@patch("bot.find_gpt_phrases", return_value=[])
+@patch("bot.record_plagiarism", new_callable=AsyncMock)
+@patch("llm_gateway.embed", return_value=[[1.0, 0.0], [0.0, 1.0]])
+@patch("bot.commit_score", return_value={"points": 0.2, "level": "Junior", "old_level": "Junior", "rank": 1,
+                                         "answer_id": 2})
+async def test_answer_copied_from_another_user_is_suspicious(
+    mock_commit, mock_emb, mock_record, mock_detect, mock_user, mock_eval, mock_correct, mock_send_action
+):
+    original = (
+        "Я бы начал с анализа воронки: посмотрел, на каком шаге отваливаются пользователи, затем провёл "
+        "интервью с клиентами и сформулировал гипотезы. Например, проверил бы изменения цен за последний месяц."
+    )
+    index = bot_module.MinHashIndex()
+    index.add(1, 777, index.signature(original), bot_module.answer_scopes("Другой вопрос", "Метрики"))
+
+    state = AsyncMock(spec=FSMContext)
+    state.get_data.return_value = {"grade": "Junior", "question": "Что такое JTBD?", "last_score": 0.0,
+                                   "selected_topic": "Метрики", "question_time": 0}
+    message = AsyncMock()
+    message.text = original.replace("Например", "К примеру")
+    message.from_user.id = 42
+    message.chat = MagicMock()
+
+    with patch.object(bot_module, "plagiarism_index", index):
+        await handle_task_answer(message, state)
+
+    assert mock_commit.await_args.kwargs["is_suspicious"] is True
+    assert len(mock_commit.await_args.kwargs["minhash"]) == 64 * 4
+    answer_id, user_id, *_, matches = mock_record.await_args.args
+    assert (answer_id, user_id) == (2, 42)
+    assert [(a, u) for a, u, _ in matches] == [(1, 777)]
+
+
+@pytest.mark.asyncio
+@patch("bot.bot.send_chat_action", new_callable=AsyncMock)
+@patch("bot.evaluate_answer", return_value=None)
+@patch("bot.get_user_from_db", return_value={"name": "Антон"})
+@patch("bot.stream_correct_answer", side_effect=lambda q, g: fake_stream("Правильный ответ"))
+@patch("bot.find_gpt_phrases", return_value=[])
+@patch("bot.record_plagiarism", new_callable=AsyncMock)
+@patch("llm_gateway.embed", return_value=[[1.0, 0.0], [0.0, 1.0]])
+@patch("bot.reevaluation.enqueue", new_callable=AsyncMock, return_value=True)
+@patch("bot.commit_score")
+async def test_copied_provisional_answer_is_recorded_without_answer_id(
+    mock_commit, mock_enqueue, mock_emb, mock_record, mock_detect, mock_correct, mock_user, mock_eval,
+    mock_send_action
+):
+    original = (
+        "Я бы начал с анализа воронки: посмотрел, на каком шаге отваливаются пользователи, затем провёл "
+        "интервью с клиентами и сформулировал гипотезы. Например, проверил бы изменения цен за последний месяц."
+    )
+    index = bot_module.MinHashIndex()
+    index.add(1, 777, index.signature(original), bot_module.answer_scopes("Что такое JTBD?"))
+
+    state = AsyncMock(spec=FSMContext)
+    state.get_data.return_value = {"grade": "Junior", "question": "Что такое JTBD?", "last_score": 0.0,
+                                   "question_time": 0}
+    message = AsyncMock()
+    message.text = original.replace("Например", "К примеру")
+    message.from_user.id = 42
+    message.chat = MagicMock()
+
+    with patch.object(bot_module, "plagiarism_index", index):
+        await handle_task_answer(message, state)
+
+    mock_commit.assert_not_called()
+    assert mock_enqueue.await_args.kwargs["is_suspicious"] is True
+    answer_id, user_id, question, *_, matches = mock_record.await_args.args
+    assert (answer_id, user_id, question) == (None, 42, "Что такое JTBD?")
+    assert [(a, u) for a, u, _ in matches] == [(1, 777)]
+
+
+@pytest.mark.asyncio
+async def test_repeated_registration_keeps_rank_points():
+    conn = AsyncMock()
+    conn.execute.return_value = "INSERT 0 0"
+    pool = MagicMock()
+    pool.acquire.return_value.__aenter__.return_value = conn
+    index = bot_module.RankIndex()
+    index.update(42, 15.0)
+
+    with patch.object(bot_module, "db_pool", pool), patch.object(bot_module, "rank_index", index), \
+            patch.object(bot_module, "score_histogram", MagicMock()) as histogram:
+        await bot_module.add_user_to_db(42, "anton", "Антон", 30)
+
+    histogram.add.assert_not_called()
+    assert index.rank(42) == 1
+    index.update(7, 10.0)
+    assert index.rank(42) == 1
+
+
+@pytest.mark.asyncio
+async def test_admin_system_is_only_for_admins():
+    callback = AsyncMock()
+    callback.from_user.id = 999
+
+    with patch.object(bot_module, "admin_ids", [1]):
+        await bot_module.admin_system_handler(callback)
+
+    callback.message.edit_text.assert_not_awaited()
+    assert callback.answer.await_args.kwargs["show_alert"] is True
+
+
+@pytest.mark.asyncio
+async def test_admin_system_fits_telegram_limit():
+    callback = AsyncMock()
+    callback.from_user.id = 1
+    metrics = Metrics()
+    for i in range(500):
+        metrics.inc(f"llm_queue_depth_endpoint_{i}_background", i)
+
+    with patch.object(bot_module, "admin_ids", [1]), patch.object(bot_module, "metrics", metrics):
+        await bot_module.admin_system_handler(callback)
+
+    text = callback.message.edit_text.await_args.args[0]
+    assert len(text) <= 4096
+    assert text.endswith("полный список — на /metrics</pre>")
@@ -0,0 +1,149 @@
+import asyncio
+import pytest
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock, MagicMock
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError
+from aiogram.methods import SendMessage
+
+from broadcast import Broadcaster, format_eta
+
+
+class FakeConn:
+    def __init__(self, users):
+        self.users = users
+        self.blocked = set()
+        self.progress = []
+        self.status = "running"
+        self.locked = False
+
+    async def fetchrow(self, query, broadcast_id):
+        return {"text": "Привет!", "last_user_id": 0, "sent": 0, "failed": 0, "blocked": 0, "status": self.status,
+                "progress_chat_id": 1, "progress_message_id": 2, "total": len(self.users)}
+
+    async def fetchval(self, query, *args):
+        if "pg_try_advisory_lock" in query:
+            return not self.locked
+        if "last_user_id" in query:
+            self.progress.append(args[1])
+        return self.status
+
+    async def fetch(self, query, last_id, limit):
+        return [{"id": uid} for uid in self.users if uid > last_id][:limit]
+
+    async def execute(self, query, *args):
+        if "is_blocked = TRUE" in query:
+            self.blocked.update(args[0])
+        elif "'done'" in query:
+            self.status = "done"
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+
+def make_broadcaster(conn, bot, **kwargs):
+    pool = MagicMock()
+
+    @asynccontextmanager
+    async def acquire():
+        yield conn
+
+    pool.acquire = acquire
+    broadcaster = Broadcaster(bot, AsyncMock(), **{"page_size": 2, "chat_interval": 0, **kwargs})
+    broadcaster.attach_pool(pool)
+    return broadcaster
+
+
+@pytest.mark.asyncio
+async def test_broadcast_pages_through_users_and_marks_blocked():
+    conn = FakeConn(users=[10, 20, 30, 40, 50])
+    bot = AsyncMock()
+    method = SendMessage(chat_id=30, text="Привет!")
+    bot.send_message.side_effect = lambda chat_id, text: (
+        _raise(TelegramForbiddenError(method=method, message="bot was blocked by the user")) if chat_id == 30 else None
+    )
+    broadcaster = make_broadcaster(conn, bot)
+
+    await broadcaster._run(1)
+
+    assert sorted(call.args[0] for call in bot.send_message.await_args_list) == [10, 20, 30, 40, 50]
+    assert conn.blocked == {30}
+    assert conn.progress == [20, 40, 50]
+    assert conn.status == "done"
+    assert "завершена" in bot.edit_message_text.await_args_list[-1].args[0]
+
+
+@pytest.mark.asyncio
+async def test_retry_after_pauses_and_retries_same_chat():
+    bot = AsyncMock()
+    method = SendMessage(chat_id=10, text="Привет!")
+    bot.send_message.side_effect = [TelegramRetryAfter(method=method, message="flood", retry_after=0), None]
+    broadcaster = make_broadcaster(FakeConn(users=[]), bot)
+
+    assert await broadcaster._send(10, "Привет!") == "sent"
+    assert bot.send_message.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_broadcast_led_by_another_replica_is_not_sent():
+    conn = FakeConn(users=[10, 20])
+    conn.locked = True
+    bot = AsyncMock()
+
+    await make_broadcaster(conn, bot)._run(1)
+
+    bot.send_message.assert_not_awaited()
+    assert conn.status == "running"
+
+
+@pytest.mark.asyncio
+async def test_cancel_from_another_replica_stops_before_next_page():
+    conn = FakeConn(users=[10, 20, 30, 40, 50])
+    bot = AsyncMock()
+
+    async def send(chat_id, text):
+        if chat_id == 20:
+            conn.status = "cancelled"
+
+    bot.send_message.side_effect = send
+
+    await make_broadcaster(conn, bot)._run(1)
+
+    assert [call.args[0] for call in bot.send_message.await_args_list] == [10, 20]
+    assert conn.status == "cancelled"
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_every_concurrency_sends_at_contiguous_prefix():
+    conn = FakeConn(users=[10, 20, 30, 40, 50, 60])
+    bot = AsyncMock()
+    release_30 = asyncio.Event()
+    saved_while_30_in_flight = []
+
+    async def send(chat_id, text):
+        # 30 отвечает позже 40 и 50 — точка продолжения не должна его перескочить
+        if chat_id == 30:
+            await release_30.wait()
+        elif chat_id == 50:
+            # Даём рассылке обработать уже завершённые отправки
+            await asyncio.sleep(0.05)
+            saved_while_30_in_flight.extend(conn.progress)
+            release_30.set()
+
+    bot.send_message.side_effect = send
+
+    await make_broadcaster(conn, bot, page_size=6, concurrency=2)._run(1)
+
+    assert saved_while_30_in_flight == [20]
+    assert conn.progress[-1] == 60 and conn.progress == sorted(conn.progress)
+    assert conn.status == "done"
+
+
+def test_format_eta():
+    assert format_eta(42) == "42 сек"
+    assert format_eta(125) == "2 мин 5 сек"
+    assert format_eta(3720) == "1 ч 2 мин"
+
+
+def _raise(exc):
+    raise exc
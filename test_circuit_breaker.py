@@ -0,0 +1,79 @@
+from unittest.mock import patch
+
+import pytest
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+from heuristic_scorer import score_answer
+from metrics import metrics
+
+
+async def failing():
+    raise ConnectionError("down")
+
+
+async def ok():
+    return "ok"
+
+
+@pytest.mark.asyncio
+async def test_breaker_opens_on_error_rate_and_rejects_immediately():
+    breaker = CircuitBreaker("test_errors", window=4, min_calls=4, failure_ratio=0.5, open_seconds=30)
+    await breaker.call(ok)
+    await breaker.call(ok)
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            await breaker.call(failing)
+
+    assert breaker.state == OPEN
+    assert metrics.gauges["circuit_test_errors_state"] == 2
+    with pytest.raises(CircuitOpenError):
+        await breaker.call(ok)
+
+
+def test_breaker_opens_on_latency_and_recovers_after_probe():
+    breaker = CircuitBreaker("test_latency", window=4, min_calls=2, slow_call_seconds=5, open_seconds=30)
+    breaker.record(True, 6.0)
+    breaker.record(True, 7.0)
+    assert breaker.state == OPEN
+    assert not breaker.available
+
+    with patch("circuit_breaker.time.monotonic", return_value=breaker._opened_at + 31):
+        assert breaker.available
+        breaker.before_call()
+        assert breaker.state == HALF_OPEN
+        # Пока проба в полёте, остальные запросы отклоняются
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record(True, 0.5)
+
+    assert breaker.state == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_client_errors_do_not_trip_breaker():
+    breaker = CircuitBreaker("test_client", window=2, min_calls=2, is_failure=lambda e: not isinstance(e, ValueError))
+
+    async def bad_request():
+        raise ValueError("400")
+
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            await breaker.call(bad_request)
+    assert breaker.state == CLOSED
+
+
+def test_heuristic_scorer_rewards_structure_and_examples():
+    question = "Retention упал на 10% за неделю. Ваши действия?"
+    detailed = (
+        "Во-первых, проверю трекинг: retention мог упасть из-за сломанной аналитики.\n"
+        "- Разобью падение по когортам и платформам, потому что так видно, где именно упал retention.\n"
+        "- Посмотрю релизы недели, так как изменение могло сломать онбординг.\n"
+        "Например, в прошлом году мы потеряли 8% после редизайна экрана оплаты."
+    )
+    short = "Посмотрю retention"
+
+    detailed_eval = score_answer(question, detailed)
+    assert detailed_eval.provisional
+    assert detailed_eval.criteria["structure"] > 0 and detailed_eval.criteria["examples"] > 0
+    assert detailed_eval.score > score_answer(question, short).score
+    assert all(0.0 <= v <= 0.2 for v in detailed_eval.criteria.values())
@@ -1,16 +1,53 @@
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, AsyncMock
 from ai_utils import evaluate_answer  # ← правильно!
+from evaluation import parse_evaluation, EvaluationError
+
+VALID = (
+    '{"relevance": 0.2, "completeness": 0.15, "argumentation": 0.1, "structure": 0.05, '
+    '"examples": 0.0, "total": 0.5, "feedback": "Хорошая структура, не хватает примеров"}'
+)
 
 @pytest.mark.asyncio
-@patch("openai.ChatCompletion.create")  # ← правильно!
+@patch("llm_gateway.chat", new_callable=AsyncMock)
 async def test_evaluate_answer(mock_create):
-    mock_create.return_value = MagicMock(
-        choices=[MagicMock(message=MagicMock(content="Критерии:\n• Соответствие вопросу: 0.2\nИтог: 1.0\nFeedback: отлично"))]
-    )
+    mock_create.return_value = VALID
 
     result = await evaluate_answer("Что такое MVP?", "Это минимальный продукт", "Антон")
 
-    assert "Критерии" in result
-    assert "Feedback" in result
-    assert "Итог" in result
+    assert result.score == 0.5
+    assert result.criteria["completeness"] == 0.15
+    assert "примеров" in result.feedback
+    assert mock_create.await_args.kwargs["response_format"] == {"type": "json_object"}
+
+@pytest.mark.asyncio
+@patch("llm_gateway.chat", new_callable=AsyncMock)
+async def test_evaluate_answer_retries_broken_json(mock_create):
+    mock_create.side_effect = ["Критерии: ...", VALID]
+
+    result = await evaluate_answer("Что такое MVP?", "Это минимальный продукт")
+
+    assert result.score == 0.5
+    assert mock_create.await_count == 2
+
+def test_total_is_recomputed_from_criteria():
+    raw = VALID.replace('"total": 0.5', '"total": 0.9')
+    assert parse_evaluation(raw).score == 0.5
+
+def test_zero_relevance_zeroes_everything():
+    raw = VALID.replace('"relevance": 0.2', '"relevance": 0')
+    evaluation = parse_evaluation(raw)
+    assert evaluation.score == 0.0
+    assert set(evaluation.criteria.values()) == {0.0}
+
+@pytest.mark.parametrize("raw", [
+    "не JSON",
+    "[]",
+    VALID.replace('"examples": 0.0, ', ""),
+    VALID.replace('"examples": 0.0', '"examples": 0.5'),
+    VALID.replace('"examples": 0.0', '"examples": "0.1"'),
+    VALID.replace('"Хорошая структура, не хватает примеров"', '""'),
+])
+def test_invalid_evaluations_are_rejected(raw):
+    with pytest.raises(EvaluationError):
+        parse_evaluation(raw)
@@ -1,7 +1,7 @@
 import sys
 import os
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, AsyncMock
 
 # Добавляем текущую директорию в sys.path
 sys.path.append(os.path.abspath(os.path.dirname(__file__)))
@@ -9,38 +9,30 @@ sys.path.append(os.path.abspath(os.path.dirname(__file__)))
 from ai_utils import generate_question, generate_correct_answer
 
 @pytest.mark.asyncio
-@patch("openai.ChatCompletion.create")
+@patch("llm_gateway.chat", new_callable=AsyncMock)
 async def test_generate_question(mock_create):
-    mock_create.return_value = MagicMock(
-        choices=[MagicMock(message=MagicMock(content="Тестовое задание по теме управления"))]
-    )
+    mock_create.return_value = "Тестовое задание по теме управления"
     result = await generate_question("Middle", "Управление командой", "Антон")
     assert "задание" in result.lower() or "управление" in result.lower()
 
 @pytest.mark.asyncio
-@patch("openai.ChatCompletion.create")
+@patch("llm_gateway.chat", new_callable=AsyncMock)
 async def test_generate_correct_answer(mock_create):
-    mock_create.return_value = MagicMock(
-        choices=[MagicMock(message=MagicMock(content="Это эталонный ответ"))]
-    )
+    mock_create.return_value = "Это эталонный ответ"
     result = await generate_correct_answer("Что такое MVP?", "Junior")
     assert "эталонный" in result.lower() or "ответ" in result.lower()
 
 @pytest.mark.asyncio
-@patch("openai.ChatCompletion.create")
+@patch("llm_gateway.chat", new_callable=AsyncMock)
 async def test_generate_question_soft_skills(mock_create):
-    mock_create.return_value = MagicMock(
-        choices=[MagicMock(message=MagicMock(content="Ситуация про внутреннюю мотивацию"))]
-    )
+    mock_create.return_value = "Ситуация про внутреннюю мотивацию"
     result = await generate_question("Senior", "Soft skills", "Антон")
     assert "мотивация" in result.lower() or "ситуация" in result.lower()
 
 
 @pytest.mark.asyncio
-@patch("openai.ChatCompletion.create")
+@patch("llm_gateway.chat", new_callable=AsyncMock)
 async def test_generate_question_generic(mock_create):
-    mock_create.return_value = MagicMock(
-        choices=[MagicMock(message=MagicMock(content="Кейс по теме Маркетинг с ограничениями"))]
-    )
+    mock_create.return_value = "Кейс по теме Маркетинг с ограничениями"
     result = await generate_question("Junior", "Маркетинг", "Антон")
     assert "маркетинг" in result.lower() or "ограничения" in result.lower()
\ No newline at end of file
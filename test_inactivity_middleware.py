@@ -0,0 +1,119 @@
+import time
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from aiogram import types
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from inactivity_middleware import InactivityMiddleware
+
+KEY = StorageKey(bot_id=1, chat_id=42, user_id=42)
+
+
+def make_state(storage):
+    state = FSMContext(storage=storage, key=KEY)
+    state.get_data = AsyncMock(wraps=state.get_data)
+    return state
+
+
+class SharedStorage(MemoryStorage):
+    """MemoryStorage с общим для реплик last_active, как у PostgresStorage."""
+
+    def __init__(self):
+        super().__init__()
+        self.last_active = {}
+
+    async def save_last_active(self, times):
+        for key, value in times.items():
+            self.last_active[key] = max(self.last_active.get(key, 0.0), value)
+
+    async def get_last_active(self, key):
+        return self.last_active.get(key)
+
+
+def make_message():
+    message = MagicMock(spec=types.Message)
+    message.chat = MagicMock(id=42)
+    message.answer = AsyncMock()
+    return message
+
+
+@pytest.mark.asyncio
+async def test_hot_path_reads_storage_once():
+    storage = MemoryStorage()
+    state = make_state(storage)
+    middleware = InactivityMiddleware(timeout_seconds=7200)
+    handler = AsyncMock()
+
+    for _ in range(5):
+        await middleware(handler, make_message(), {"state": state, "bot": AsyncMock()})
+
+    assert handler.await_count == 5
+    assert state.get_data.await_count == 1
+    assert "last_active" not in await storage.get_data(KEY)
+
+
+@pytest.mark.asyncio
+async def test_flush_persists_last_active():
+    storage = MemoryStorage()
+    middleware = InactivityMiddleware(timeout_seconds=7200)
+    await middleware(AsyncMock(), make_message(), {"state": make_state(storage), "bot": AsyncMock()})
+
+    await middleware.flush(storage)
+
+    stored = (await storage.get_data(KEY))["last_active"]
+    assert abs(stored - time.time()) < 5
+
+
+@pytest.mark.asyncio
+async def test_timeout_after_restart_clears_session():
+    storage = MemoryStorage()
+    await storage.set_data(KEY, {"last_active": time.time() - 3 * 3600, "bot_messages": [10, 11]})
+    middleware = InactivityMiddleware(timeout_seconds=7200)
+    handler = AsyncMock()
+    bot = AsyncMock()
+    message = make_message()
+
+    result = await middleware(handler, message, {"state": make_state(storage), "bot": bot})
+
+    assert result is None
+    handler.assert_not_awaited()
+    bot.delete_messages.assert_awaited_once_with(chat_id=42, message_ids=[10, 11])
+    assert await storage.get_data(KEY) == {}
+    message.answer.assert_awaited_once()
+    assert "История очищена" in message.answer.await_args.args[0]
+
+
+@pytest.mark.asyncio
+async def test_flush_writes_last_active_outside_fsm_data():
+    storage = SharedStorage()
+    await storage.set_data(KEY, {"question": "q"})
+    middleware = InactivityMiddleware(timeout_seconds=7200)
+    state = make_state(storage)
+    for _ in range(3):
+        await middleware(AsyncMock(), make_message(), {"state": state, "bot": AsyncMock()})
+    storage.update_data = AsyncMock()
+
+    await middleware.flush(storage)
+
+    storage.update_data.assert_not_awaited()
+    assert await storage.get_data(KEY) == {"question": "q"}
+    assert abs(storage.last_active[KEY] - time.time()) < 5
+
+
+@pytest.mark.asyncio
+async def test_activity_on_other_replica_keeps_session():
+    storage = SharedStorage()
+    await storage.set_data(KEY, {"question": "q"})
+    replica = InactivityMiddleware(timeout_seconds=7200)
+    replica._last_active[KEY] = time.monotonic() - 3 * 3600
+    # Последние сообщения пользователя обслужила другая реплика
+    storage.last_active[KEY] = time.time() - 60
+    handler = AsyncMock()
+
+    await replica(handler, make_message(), {"state": make_state(storage), "bot": AsyncMock()})
+
+    handler.assert_awaited_once()
+    assert await storage.get_data(KEY) == {"question": "q"}
+    assert abs(storage.last_active[KEY] - time.time()) < 5
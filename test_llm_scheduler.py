@@ -0,0 +1,112 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import httpx
+import openai
+import pytest
+
+from llm_scheduler import LLMScheduler, Priority, TokenBudget, with_priority, resolve_priority
+
+
+def rate_limit_error(code="rate_limit_exceeded", retry_after="3"):
+    response = httpx.Response(
+        429, headers={"retry-after": retry_after},
+        request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"),
+    )
+    return openai.RateLimitError("rate limited", response=response, body={"code": code})
+
+
+@pytest.mark.asyncio
+async def test_free_slot_goes_to_highest_priority():
+    scheduler = LLMScheduler({"chat": 1})
+    order = []
+    release = asyncio.Event()
+
+    async def request(name, priority, wait=None):
+        async with scheduler.slot("chat", priority):
+            order.append(name)
+            if wait:
+                await wait.wait()
+
+    first = asyncio.create_task(request("busy", Priority.INTERACTIVE, release))
+    await asyncio.sleep(0)
+    queued = [
+        asyncio.create_task(request("prefetch", Priority.BACKGROUND)),
+        asyncio.create_task(request("question", Priority.GENERATION)),
+        asyncio.create_task(request("evaluation", Priority.INTERACTIVE)),
+    ]
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(first, *queued)
+
+    assert order == ["busy", "evaluation", "question", "prefetch"]
+
+
+@pytest.mark.asyncio
+async def test_background_context_demotes_requests():
+    async def probe():
+        return resolve_priority(Priority.INTERACTIVE)
+
+    assert await probe() == Priority.INTERACTIVE
+    assert await with_priority(Priority.BACKGROUND, probe()) == Priority.BACKGROUND
+
+
+@pytest.mark.asyncio
+@patch("llm_scheduler.asyncio.sleep", new_callable=AsyncMock)
+async def test_rate_limit_is_retried_no_sooner_than_retry_after(mock_sleep):
+    scheduler = LLMScheduler({"chat": 4}, max_attempts=3, base_delay=0.1)
+    call = AsyncMock(side_effect=[rate_limit_error(), "ok"])
+
+    assert await scheduler.run("chat", call) == "ok"
+    assert call.await_count == 2
+    assert mock_sleep.await_args.args[0] >= 3.0
+
+
+@pytest.mark.asyncio
+@patch("llm_scheduler.asyncio.sleep", new_callable=AsyncMock)
+async def test_exhausted_quota_is_not_retried(mock_sleep):
+    scheduler = LLMScheduler({"chat": 4})
+    call = AsyncMock(side_effect=rate_limit_error(code="insufficient_quota"))
+
+    with pytest.raises(openai.RateLimitError):
+        await scheduler.run("chat", call)
+    assert call.await_count == 1
+    mock_sleep.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_token_budget_waits_for_refill():
+    budget = TokenBudget(tokens_per_minute=6000)  # 100 токенов в секунду
+
+    assert await budget.reserve(6000) < 0.01
+    waited = await budget.reserve(10)
+    assert 0.05 <= waited < 0.5
+
+
+@pytest.mark.asyncio
+async def test_breaker_measures_http_attempts_not_queue_wait():
+    from circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN
+
+    breaker = CircuitBreaker("test_sched", window=4, min_calls=3, slow_call_seconds=0.05, open_seconds=30)
+    scheduler = LLMScheduler({"chat": 1}, breaker=breaker)
+
+    async def quick():
+        await asyncio.sleep(0.02)
+        return "ok"
+
+    # Восемь запросов в очереди на один слот: последние ждут дольше порога, но сами быстрые
+    await asyncio.gather(*[scheduler.run("chat", quick) for _ in range(8)])
+    assert breaker.state == CLOSED
+
+    call = AsyncMock(side_effect=openai.InternalServerError(
+        "down", response=httpx.Response(500, request=httpx.Request("POST", "https://x")), body=None,
+    ))
+    with patch("llm_scheduler.asyncio.sleep", new_callable=AsyncMock):
+        # Каждая неудачная попытка учтена отдельно: предохранитель размыкается посреди повторов
+        with pytest.raises(CircuitOpenError):
+            await scheduler.run("chat", call)
+    assert call.await_count == 2
+    assert breaker.state == OPEN
+    # Новые запросы отклоняются до постановки в очередь
+    with pytest.raises(CircuitOpenError):
+        await scheduler.run("chat", quick)
@@ -0,0 +1,71 @@
+import numpy as np
+
+from minhash_index import MinHashIndex, answer_scopes
+
+ANSWER = (
+    "Я бы начал с анализа воронки: посмотрел, на каком шаге отваливаются пользователи, затем провёл "
+    "интервью с пятью клиентами и сформулировал гипотезы. Например, если конверсия упала на 20%, проверил бы цены."
+)
+COPY = ANSWER.replace("пятью", "десятью").replace("Например", "К примеру")
+OTHER = (
+    "Сначала определю метрику успеха — удержание на 30-й день. Потом соберу команду, распределю роли "
+    "и договорюсь о ритме встреч, чтобы каждый понимал цель квартала и свои задачи в ней."
+)
+
+
+def test_signature_estimates_jaccard():
+    index = MinHashIndex()
+    original = index.signature(ANSWER)
+
+    assert original.dtype == np.uint32 and len(original) == 64
+    assert index.similarity(original, index.signature(COPY)) > 0.8
+    assert index.similarity(original, index.signature(OTHER)) < 0.2
+    # Регистр и пробелы не влияют
+    assert index.similarity(original, index.signature(ANSWER.upper().replace(" ", "  "))) == 1.0
+
+
+def test_short_answers_have_no_signature():
+    index = MinHashIndex()
+    assert index.signature("не знаю") is None
+    assert index.to_bytes(None) == b""
+    assert index.from_bytes(b"") is None
+
+
+def test_query_finds_copies_of_other_users_in_same_scope():
+    index = MinHashIndex()
+    scopes = answer_scopes("Как поднять конверсию?", "Метрики")
+    index.add(1, 100, index.signature(ANSWER), scopes)
+    index.add(2, 200, index.signature(OTHER), scopes)
+
+    matches = index.query(index.signature(COPY), scopes, exclude_user=300)
+    assert [(a, u) for a, u, _ in matches] == [(1, 100)]
+    # Свой же прошлый ответ — не списывание
+    assert index.query(index.signature(COPY), scopes, exclude_user=100) == []
+    # Другой вопрос, но та же тема — совпадение находится
+    assert index.query(index.signature(COPY), answer_scopes("Другой вопрос", "Метрики"), exclude_user=300)
+    # Ни вопрос, ни тема не совпадают — не сравниваем
+    assert index.query(index.signature(COPY), answer_scopes("Другой вопрос", "—"), exclude_user=300) == []
+
+
+def test_load_restores_index_from_stored_bytes():
+    index = MinHashIndex()
+    stored = index.to_bytes(index.signature(ANSWER))
+
+    restored = MinHashIndex()
+    restored.load([(1, 100, "Вопрос", "Метрики", stored), (2, 200, "Вопрос", "Метрики", b"")])
+
+    assert len(restored) == 1
+    assert restored.query(restored.signature(COPY), answer_scopes("Вопрос"), exclude_user=300)[0][:2] == (1, 100)
+
+
+def test_extend_adds_only_new_answers_and_tracks_last_id():
+    index = MinHashIndex()
+    stored = index.to_bytes(index.signature(ANSWER))
+    index.load([(1, 100, "Вопрос", "Метрики", stored)])
+
+    added = index.extend([(1, 100, "Вопрос", "Метрики", stored), (5, 200, "Вопрос", "Метрики", stored),
+                          (7, 300, "Вопрос", "Метрики", b"")])
+
+    assert added == 1
+    assert len(index) == 2
+    assert index.last_id == 7
@@ -0,0 +1,61 @@
+import random
+
+import numpy as np
+
+from ngram_lm import NgramLM, calibrate, train
+
+WORDS = ("продукт метрика пользователь команда гипотеза удержание конверсия выручка "
+         "спринт бэклог релиз клиент рынок исследование когорта").split()
+
+
+def human_answers(n, seed=1):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(30)) for _ in range(n)]
+
+
+def test_in_domain_text_is_less_surprising():
+    model = NgramLM(order=4, bits=16).fit(human_answers(200))
+
+    in_domain = human_answers(1, seed=99)[0]
+    gibberish = "zqx jjw fffk ppqz xxqw"
+    assert model.mean_surprisal(in_domain) < model.mean_surprisal(gibberish)
+    assert len(model.surprisal("метрика")) == len("метрика") + 1  # плюс конец текста
+
+
+def test_save_and_load_memory_mapped(tmp_path):
+    model = NgramLM(order=3, bits=12, threshold=2.5).fit(human_answers(20))
+    path = tmp_path / "lm.npy"
+    model.save(path)
+
+    loaded = NgramLM.load(path)
+    assert isinstance(loaded.counts, np.memmap)
+    assert loaded.threshold == 2.5
+    text = "команда проверяет гипотезу"
+    assert abs(loaded.mean_surprisal(text) - model.mean_surprisal(text)) < 1e-9
+
+
+def test_calibrate_picks_separating_threshold():
+    threshold, j = calibrate([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], [1, 1, 1, 1, 1, 0, 0, 0, 0, 0])
+    assert 5 < threshold < 6 and j == 1.0
+    # Метки, которые score не разделяет, — порога нет
+    assert calibrate([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], [0, 1, 0, 1, 0, 1, 0, 1, 0, 1])[0] is None
+
+
+def test_train_calibrates_on_held_out_labels():
+    rng = random.Random(3)
+    letters = "абвгдежзиклмнопрстуфхцчшэюя"
+    vocabulary = ["".join(rng.choice(letters) for _ in range(rng.randint(3, 9))) for _ in range(2000)]
+    boilerplate = "в современном мире важно учитывать ключевые метрики продукта"
+
+    def human():
+        return " ".join(rng.choice(vocabulary) for _ in range(25))
+
+    # Шаблонная фраза встречается в корпусе; подозрительные ответы почти целиком из неё
+    rows = [(i, human() + (" " + boilerplate if i % 3 == 0 else ""), False) for i in range(1, 400)]
+    rows += [(1000 + i, (boilerplate + ". ") * 3, True) for i in range(50)]
+
+    model = train(rows, order=4, bits=16, holdout=5)
+
+    assert model.threshold is not None
+    assert model.is_suspicious((boilerplate + ". ") * 2)
+    assert not model.is_suspicious(human())
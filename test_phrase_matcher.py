@@ -0,0 +1,36 @@
+from phrase_matcher import PhraseMatcher, find_gpt_phrases, gpt_phrase_matcher, tokenize
+
+
+def test_matches_inflected_forms():
+    assert find_gpt_phrases("Данные подходы позволяют быстро проверить гипотезу") == ["данный подход позволяет"]
+    assert find_gpt_phrases("Это свидетельствовало о росте") == ["это свидетельствует о"]
+    assert find_gpt_phrases("В рамках данных контекстов всё иначе") == ["в рамках данного контекста"]
+    assert find_gpt_phrases("Я бы сначала поговорил с пользователями") == []
+
+
+def test_reports_every_phrase_once_in_order():
+    text = "Рассмотрим подробнее. Необходимо подчеркнуть важное. Рассмотрим подробнее ещё раз."
+    assert find_gpt_phrases(text) == ["рассмотрим подробнее", "необходимо подчеркнуть"]
+
+
+def test_overlapping_phrases_use_failure_links():
+    matcher = PhraseMatcher(["метрики удержания", "удержания пользователей", "рост"])
+    assert matcher.find("Смотрим метрики удержания пользователей") == [
+        "метрики удержания", "удержания пользователей"
+    ]
+    assert matcher.find("Рост") == ["рост"]
+
+
+def test_dictionary_is_versioned(tmp_path):
+    path = tmp_path / "phrases.txt"
+    path.write_text("# комментарий\n# version: 7\n\nважно отметить\n", encoding="utf-8")
+    matcher = PhraseMatcher.from_file(path)
+
+    assert matcher.version == "7"
+    assert len(matcher) == 1
+    assert matcher.find("Важно отметить, что…") == ["важно отметить"]
+    assert gpt_phrase_matcher().version is not None
+
+
+def test_normalization():
+    assert tokenize("Ёлка ЁЛКИ") == tokenize("елка елки")
@@ -0,0 +1,45 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock
+
+from question_pool import QuestionPool
+
+
+@pytest.mark.asyncio
+async def test_pool_refills_to_high_watermark_and_serves_hits():
+    gen = AsyncMock(side_effect=[f"Вопрос {i}" for i in range(10)])
+    pool = QuestionPool(low_watermark=1, high_watermark=3)
+    pool.register(("grade", "Junior", "Метрики"), gen)
+
+    await pool.start()
+    await asyncio.sleep(0)
+    await asyncio.gather(*pool._refill_tasks.values())
+
+    assert pool.size(("grade", "Junior", "Метрики")) == 3
+    assert pool.take(("grade", "Junior", "Метрики")) == "Вопрос 0"
+    await pool.stop()
+
+
+@pytest.mark.asyncio
+async def test_pool_miss_returns_none_and_skips_error_questions():
+    gen = AsyncMock(return_value="❌ Ошибка генерации вопроса. Попробуйте чуть позже.")
+    pool = QuestionPool(low_watermark=1, high_watermark=3)
+    pool.register(("academy", "mvp", "💎 Ценность продукта"), gen)
+
+    await pool.start()
+    await asyncio.gather(*pool._refill_tasks.values())
+
+    assert pool.take(("academy", "mvp", "💎 Ценность продукта")) is None
+    assert gen.await_count == 1
+    await pool.stop()
+
+
+@pytest.mark.asyncio
+async def test_pool_does_not_generate_before_start():
+    gen = AsyncMock(return_value="Вопрос")
+    pool = QuestionPool()
+    pool.register(("grade", "Middle", "Маркетинг"), gen)
+
+    assert pool.take(("grade", "Middle", "Маркетинг")) is None
+    await asyncio.sleep(0)
+    gen.assert_not_awaited()
@@ -0,0 +1,31 @@
+import random
+
+from rank_service import RankIndex
+
+
+def brute_force_rank(points: dict, user_id: int) -> int:
+    # Индекс различает баллы с точностью до 0.01
+    mine = round(points[user_id], 2)
+    return 1 + sum(1 for p in points.values() if round(p, 2) > mine)
+
+
+def test_rank_matches_brute_force_after_updates():
+    index = RankIndex(initial_size=8)  # маленький размер, чтобы проверить рост дерева
+    points = {}
+    rng = random.Random(42)
+    for _ in range(500):
+        user_id = rng.randint(1, 60)
+        points[user_id] = points.get(user_id, 0.0) + rng.choice([0.05, 0.2, 0.6, 1.0, 3.5])
+        index.update(user_id, points[user_id])
+
+    for user_id in points:
+        assert index.rank(user_id) == brute_force_rank(points, user_id)
+
+
+def test_ties_share_rank_and_unknown_user():
+    index = RankIndex()
+    index.load([(1, 10.0), (2, 10.0), (3, 5.0)])
+
+    assert index.rank(1) == index.rank(2) == 1
+    assert index.rank(3) == 3
+    assert index.rank(404) == -1
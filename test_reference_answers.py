@@ -0,0 +1,63 @@
+import asyncio
+import pytest
+
+from llm_scheduler import Priority, resolve_priority, with_priority
+from reference_answers import ReferenceAnswerStore
+
+
+@pytest.mark.asyncio
+async def test_reference_store_streams_partial_text():
+    release = asyncio.Event()
+
+    async def generator(question, grade):
+        yield "Шаг 1. "
+        await release.wait()
+        yield "Шаг 2."
+
+    store = ReferenceAnswerStore(generator)
+    seen = []
+
+    async def watch():
+        async for text in store.stream("Вопрос", "Junior"):
+            seen.append(text)
+            release.set()
+
+    await asyncio.wait_for(watch(), timeout=2)
+
+    assert seen[0] == "Шаг 1. "
+    assert seen[-1] == "Шаг 1. Шаг 2."
+    assert await store.get("Вопрос", "Junior") == "Шаг 1. Шаг 2."
+
+
+@pytest.mark.asyncio
+async def test_failed_generation_ends_stream_with_error_text():
+    calls = 0
+
+    async def generator(question, grade):
+        nonlocal calls
+        calls += 1
+        yield "Шаг 1. "
+        raise RuntimeError("LLM недоступен")
+
+    store = ReferenceAnswerStore(generator, error_text="❌ Ошибка")
+    seen = [text async for text in store.stream("Вопрос", "Junior")]
+
+    assert seen[-1] == "❌ Ошибка"
+    assert calls == 1
+
+
+@pytest.mark.asyncio
+async def test_prefetch_runs_generation_at_background_priority():
+    priorities = []
+
+    async def generator(question, grade):
+        priorities.append(resolve_priority(Priority.GENERATION))
+        return f"Эталон: {question}"
+
+    store = ReferenceAnswerStore(generator, background=lambda coro: with_priority(Priority.BACKGROUND, coro))
+    store.prefetch("Фоновый", "Junior")
+    assert await store.get("Фоновый", "Junior") == "Эталон: Фоновый"
+    # Без prefetch пользователь уже ждёт — приоритет не понижается
+    assert await store.get("Срочный", "Junior") == "Эталон: Срочный"
+
+    assert priorities == [Priority.BACKGROUND, Priority.GENERATION]
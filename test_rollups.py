@@ -0,0 +1,35 @@
+import pytest
+from unittest.mock import AsyncMock
+
+from rollups import fetch_product_metrics
+
+
+@pytest.mark.asyncio
+async def test_product_metrics_from_rollups():
+    conn = AsyncMock()
+    conn.fetchrow.side_effect = [
+        {"users": 10, "answering_users": 4, "answers": 12, "score_sum": 9.0},
+        {"answers": 5, "score_sum": 3.5},
+    ]
+    conn.fetch.return_value = [{"topic": "Метрики", "answers": 7}, {"topic": "Стратегия", "answers": 5}]
+
+    stats = await fetch_product_metrics(conn)
+
+    assert stats["tasks_avg"] == 3.0
+    assert stats["avg_score"] == 0.75
+    assert stats["top_topics"] == [("Метрики", 7), ("Стратегия", 5)]
+    assert stats["answers_today"] == 5
+    assert stats["users"] == 10
+
+
+@pytest.mark.asyncio
+async def test_product_metrics_on_empty_database():
+    conn = AsyncMock()
+    conn.fetchrow.side_effect = [None, None]
+    conn.fetch.return_value = []
+
+    stats = await fetch_product_metrics(conn)
+
+    assert stats["tasks_avg"] == 0.0
+    assert stats["avg_score"] == 0.0
+    assert stats["answers_today"] == 0
@@ -0,0 +1,41 @@
+import random
+
+from score_histogram import ScoreHistogram
+
+
+def test_percentile_matches_exact_rank():
+    random.seed(7)
+    histogram = ScoreHistogram(bucket_width=0.1, buckets=5000)
+    points = [round(random.uniform(0, 120), 2) for _ in range(2000)]
+    for p in points:
+        histogram.add(p, "Junior" if p < 50 else "Middle")
+
+    for probe in (3.0, 42.5, 99.9):
+        exact = 100.0 * sum(1 for p in points if p < probe) / len(points)
+        assert abs(histogram.percentile(probe) - exact) < 1.0
+
+
+def test_move_updates_global_and_level_scopes():
+    histogram = ScoreHistogram(bucket_width=1.0, buckets=100)
+    histogram.add(0.0, "Junior")
+    histogram.add(10.0, "Junior")
+    histogram.add(60.0, "Middle")
+
+    histogram.move(10.0, 70.0, "Junior", "Middle")
+
+    assert histogram.total() == 3
+    assert histogram.total("Junior") == 1
+    assert histogram.total("Middle") == 2
+    assert histogram.percentile(65.0, scope="Middle") == 50.0
+    assert histogram.percentile(5.0, scope="Senior") is None
+
+
+def test_quantile_and_overflow_bucket():
+    histogram = ScoreHistogram(bucket_width=1.0, buckets=10)
+    for p in range(10):
+        histogram.add(p + 0.5, "Junior")
+    histogram.add(500.0, "CEO")
+
+    assert 4.0 <= histogram.quantile(0.5) <= 6.0
+    assert histogram.percentile(1000.0) < 100.0
+    assert histogram.quantile(1.0) == 10.0
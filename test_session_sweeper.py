@@ -0,0 +1,94 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from aiogram import types
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from inactivity_middleware import InactivityMiddleware
+from session_sweeper import SessionSweeper, delete_bot_messages
+
+
+def make_key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+@pytest.mark.asyncio
+async def test_bulk_delete_in_chunks_of_100():
+    bot = AsyncMock()
+    limiter = AsyncMock()
+
+    sent = await delete_bot_messages(bot, 42, range(250), limiter)
+
+    assert sent == 250
+    chunks = [call.kwargs["message_ids"] for call in bot.delete_messages.await_args_list]
+    assert [len(c) for c in chunks] == [100, 100, 50]
+    assert limiter.acquire.await_count == 3
+
+
+@pytest.mark.asyncio
+async def test_sweep_evicts_only_idle_sessions():
+    storage = MemoryStorage()
+    bot = AsyncMock()
+    sweeper = SessionSweeper(storage, bot, timeout=100)
+    idle, active = make_key(1), make_key(2)
+    await storage.set_data(idle, {"bot_messages": [5, 6]})
+    await storage.set_data(active, {"question": "Вопрос"})
+
+    with patch("session_sweeper.time.monotonic", return_value=1000.0):
+        sweeper.touch(idle)
+        sweeper.touch(active)
+    with patch("session_sweeper.time.monotonic", return_value=1050.0):
+        sweeper.touch(active)
+    with patch("session_sweeper.time.monotonic", return_value=1120.0):
+        swept = await sweeper.sweep()
+
+    assert swept == 1
+    assert idle not in storage.storage
+    assert await storage.get_data(active) == {"question": "Вопрос"}
+    bot.delete_messages.assert_awaited_once_with(chat_id=1, message_ids=[5, 6])
+    assert len(sweeper) == 1
+    assert len(sweeper._heap) == 1
+
+
+@pytest.mark.asyncio
+async def test_returning_user_sees_restart_screen_after_sweep():
+    storage = MemoryStorage()
+    sweeper = SessionSweeper(storage, AsyncMock(), timeout=100)
+    middleware = InactivityMiddleware(timeout_seconds=100, sweeper=sweeper)
+    key = make_key(42)
+    sweeper._swept[key] = 0.0
+
+    message = MagicMock(spec=types.Message)
+    message.chat = MagicMock(id=42)
+    message.answer = AsyncMock()
+    handler = AsyncMock()
+
+    with patch("session_sweeper.time.monotonic", return_value=50.0):
+        await middleware(handler, message, {"state": FSMContext(storage=storage, key=key), "bot": AsyncMock()})
+
+    handler.assert_not_awaited()
+    assert "История очищена" in message.answer.await_args.args[0]
+    assert key in sweeper._deadlines
+
+
+@pytest.mark.asyncio
+async def test_sweep_postpones_session_active_on_other_replica():
+    storage = MemoryStorage()
+    storage.get_last_active = AsyncMock()
+    key = make_key(7)
+    await storage.set_data(key, {"bot_messages": [1]})
+    bot = AsyncMock()
+    sweeper = SessionSweeper(storage, bot, timeout=100)
+    with patch("session_sweeper.time.monotonic", return_value=1000.0):
+        sweeper.touch(key)
+
+    with patch("session_sweeper.time.monotonic", return_value=1200.0), \
+            patch("session_sweeper.time.time", return_value=5000.0):
+        storage.get_last_active.return_value = 4970.0
+        swept = await sweeper.sweep()
+
+    assert swept == 0
+    assert await storage.get_data(key) == {"bot_messages": [1]}
+    bot.delete_messages.assert_not_awaited()
+    assert sweeper._deadlines[key] == 1270.0
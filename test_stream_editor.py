@@ -0,0 +1,46 @@
+import pytest
+from unittest.mock import AsyncMock, patch
+
+from stream_editor import StreamingEditor, CURSOR, fit_text
+
+
+@pytest.mark.asyncio
+async def test_edits_are_throttled_and_cut_at_sentence_boundary():
+    message = AsyncMock()
+    clock = iter([0.0, 0.5, 2.0, 2.5, 4.0])
+    with patch("stream_editor.time.monotonic", side_effect=lambda: next(clock)):
+        editor = StreamingEditor(message, header="✅ ", min_interval=1.5)  # t=0
+        await editor.update("Первое предложение. Втор")  # t=0.5 — рано
+        await editor.update("Первое предложение. Второе пол")  # t=2.0 — правим
+        await editor.update("Первое предложение. Второе полностью")  # t=2.5 — рано
+        await editor.update("Первое предложение. Второе полностью. Тре")  # t=4.0 — правим
+
+    texts = [call.args[0] for call in message.edit_text.await_args_list]
+    assert texts == [
+        "✅ Первое предложение." + CURSOR,
+        "✅ Первое предложение. Второе полностью." + CURSOR,
+    ]
+
+    await editor.finish("<b>Готово</b>", parse_mode="HTML")
+    assert message.edit_text.await_args.kwargs == {"parse_mode": "HTML"}
+
+
+
+@pytest.mark.asyncio
+async def test_finish_trims_long_html_without_breaking_markup():
+    message = AsyncMock()
+    editor = StreamingEditor(message)
+    text = "<b>Итог</b>\n<i>" + "Очень &amp; длинно. " * 400 + "</i>"
+
+    await editor.finish(text, parse_mode="HTML")
+
+    sent = message.edit_text.await_args.args[0]
+    assert len(sent) <= 4096
+    assert sent.endswith("…</i>")
+    body = sent[:-len("…</i>")]
+    assert body.rfind("<") <= body.rfind(">") and body.rfind("&") <= body.rfind(";")
+
+
+def test_fit_text_keeps_short_text_and_cuts_plain_text():
+    assert fit_text("коротко", html=True) == "коротко"
+    assert fit_text("x" * 5000) == "x" * 4095 + "…"
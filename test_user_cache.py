@@ -0,0 +1,43 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from aiogram.types import Message
+
+from user_cache import UserCache, UserMiddleware, MISSING
+
+
+def test_cache_hit_invalidate_and_ttl():
+    cache = UserCache(ttl=30)
+    cache.set(1, {"name": "Антон"})
+    cache.set(2, None)  # незарегистрированного пользователя тоже кэшируем
+
+    assert cache.get(1) == {"name": "Антон"}
+    assert cache.get(2) is None
+
+    cache.invalidate(1)
+    assert cache.get(1) is MISSING
+
+    with patch("user_cache.time.monotonic", return_value=10**9):
+        assert cache.get(2) is MISSING
+
+
+def test_cache_is_bounded():
+    cache = UserCache(max_size=2)
+    for user_id in range(3):
+        cache.set(user_id, {"id": user_id})
+
+    assert cache.get(0) is MISSING
+    assert cache.get(2) == {"id": 2}
+
+
+@pytest.mark.asyncio
+async def test_middleware_injects_user_once():
+    loader = AsyncMock(return_value={"name": "Антон"})
+    middleware = UserMiddleware(loader)
+    handler = AsyncMock(return_value="ok")
+    event = MagicMock(spec=Message)
+    event.from_user = MagicMock(id=7)
+    data = {}
+
+    assert await middleware(handler, event, data) == "ok"
+    loader.assert_awaited_once_with(7)
+    assert data["user"] == {"name": "Антон"}
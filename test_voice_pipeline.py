@@ -0,0 +1,54 @@
+import io
+from unittest.mock import AsyncMock
+
+import pytest
+
+from voice_pipeline import TranscriptCache, open_voice
+
+
+def fake_bot(payload: bytes):
+    bot = AsyncMock()
+
+    async def download_file(file_path, destination):
+        destination.write(payload)
+        destination.seek(0)
+        return destination
+
+    bot.download_file.side_effect = download_file
+    return bot
+
+
+@pytest.mark.asyncio
+async def test_small_voice_stays_in_memory():
+    bot = fake_bot(b"OggS-small")
+
+    async with open_voice(bot, "voice/file.oga", file_size=10, max_in_memory=100) as (name, audio):
+        assert name == "voice.ogg"
+        assert isinstance(audio, io.BytesIO)
+        assert audio.read() == b"OggS-small"
+
+
+@pytest.mark.asyncio
+async def test_large_voice_falls_back_to_temporary_file():
+    bot = fake_bot(b"x" * 200)
+
+    async with open_voice(bot, "voice/file.oga", file_size=200, max_in_memory=100) as (_, audio):
+        assert not isinstance(audio, io.BytesIO)
+        assert audio.read() == b"x" * 200
+    assert audio.closed
+
+
+@pytest.mark.asyncio
+async def test_transcript_cache_is_bounded_lru():
+    cache = TranscriptCache(max_entries=2)
+    await cache.set("a", "первый")
+    await cache.set("b", "второй")
+    assert await cache.get("a") == "первый"
+
+    await cache.set("c", "третий")
+    await cache.set("d", "")
+
+    assert await cache.get("b") is None
+    assert await cache.get("a") == "первый"
+    assert await cache.get("c") == "третий"
+    assert await cache.get("d") is None
@@ -0,0 +1,114 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot
+
+from webhook_server import WebhookServer, SECRET_HEADER, ensure_webhook
+
+SECRET = "s3cr3t"
+
+
+def synthetic_update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 1700000000,
+            "chat": {"id": 42, "type": "private"},
+            "from": {"id": 42, "is_bot": False, "first_name": "Антон"},
+            "text": "/ping",
+        },
+    }
+
+
+def make_server(queue_size: int = 10, workers: int = 2):
+    dp = MagicMock()
+    dp.feed_update = AsyncMock()
+    bot = Bot(token="123456:ABCdefGHIjklMNOpqrSTUvwxYZ123456789")
+    return WebhookServer(dp, bot, secret=SECRET, queue_size=queue_size, workers=workers), dp
+
+
+@pytest.mark.asyncio
+async def test_updates_are_queued_and_fed_to_dispatcher():
+    server, dp = make_server()
+    async with TestClient(TestServer(server.build_app())) as client:
+        for update_id in range(1, 4):
+            resp = await client.post("/webhook", json=synthetic_update(update_id), headers={SECRET_HEADER: SECRET})
+            assert resp.status == 200
+        await asyncio.wait_for(server.queue.join(), timeout=2)
+
+        health = await (await client.get("/health")).json()
+
+    assert dp.feed_update.await_count == 3
+    fed_ids = sorted(call.args[1].update_id for call in dp.feed_update.await_args_list)
+    assert fed_ids == [1, 2, 3]
+    assert health["status"] == "ok"
+
+
+@pytest.mark.asyncio
+async def test_wrong_secret_is_rejected():
+    server, dp = make_server()
+    async with TestClient(TestServer(server.build_app())) as client:
+        resp = await client.post("/webhook", json=synthetic_update(1), headers={SECRET_HEADER: "nope"})
+        assert resp.status == 401
+    dp.feed_update.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_full_queue_applies_backpressure():
+    server, dp = make_server(queue_size=1, workers=0)
+    async with TestClient(TestServer(server.build_app())) as client:
+        first = await client.post("/webhook", json=synthetic_update(1), headers={SECRET_HEADER: SECRET})
+        second = await client.post("/webhook", json=synthetic_update(2), headers={SECRET_HEADER: SECRET})
+
+    assert first.status == 200
+    assert second.status == 503
+    assert second.headers["Retry-After"] == "1"
+
+
+@pytest.mark.asyncio
+async def test_metrics_require_bearer_secret():
+    server, _ = make_server()
+    async with TestClient(TestServer(server.build_app())) as client:
+        anonymous = await client.get("/metrics")
+        wrong = await client.get("/metrics", headers={"Authorization": "Bearer nope"})
+        authorized = await client.get("/metrics", headers={"Authorization": f"Bearer {SECRET}"})
+
+    assert anonymous.status == 401
+    assert wrong.status == 401
+    assert authorized.status == 200
+
+
+@pytest.mark.asyncio
+async def test_metrics_port_moves_metrics_off_public_app():
+    server, _ = make_server()
+    server.metrics_port = 9100
+    async with TestClient(TestServer(server.build_app())) as client:
+        public = await client.get("/metrics", headers={"Authorization": f"Bearer {SECRET}"})
+    async with TestClient(TestServer(server.build_metrics_app())) as client:
+        internal = await client.get("/metrics")
+
+    assert public.status == 404
+    assert internal.status == 200
+
+
+@pytest.mark.asyncio
+async def test_ensure_webhook_keeps_pending_updates_and_skips_when_unchanged():
+    bot = AsyncMock()
+    url = "https://bot.example/webhook"
+    bot.get_webhook_info.return_value = MagicMock(url=url, last_error_message=None)
+    assert await ensure_webhook(bot, url, SECRET) is False
+    bot.set_webhook.assert_not_awaited()
+
+    bot.get_webhook_info.return_value = MagicMock(url="https://old.example/webhook", last_error_message=None)
+    assert await ensure_webhook(bot, url, SECRET) is True
+    bot.set_webhook.assert_awaited_once_with(url=url, secret_token=SECRET)
+
+    # Секрет сменился: Telegram получает 401 от новых реплик
+    bot.set_webhook.reset_mock()
+    bot.get_webhook_info.return_value = MagicMock(
+        url=url, last_error_message="Wrong response from the webhook: 401 Unauthorized"
+    )
+    assert await ensure_webhook(bot, url, SECRET) is True
+    bot.set_webhook.assert_awaited_once()
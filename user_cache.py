@@ -0,0 +1,56 @@
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware, types
+
+from metrics import metrics
+
+MISSING = object()
+
+
+class UserCache:
+    """
+    Ограниченный TTL-кэш строк users.
+    Запись явно сбрасывается при любом изменении пользователя; TTL лишь страхует
+    от изменений, сделанных другим процессом.
+    """
+
+    def __init__(self, ttl: float = 30.0, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = OrderedDict()  # user_id -> (expires_at, row | None)
+
+    def get(self, user_id: int):
+        item = self._items.get(user_id)
+        if item is None or item[0] < time.monotonic():
+            self._items.pop(user_id, None)
+            metrics.inc("user_cache_misses")
+            return MISSING
+        self._items.move_to_end(user_id)
+        metrics.inc("user_cache_hits")
+        return item[1]
+
+    def set(self, user_id: int, row):
+        self._items[user_id] = (time.monotonic() + self.ttl, row)
+        self._items.move_to_end(user_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        self._items.pop(user_id, None)
+
+    def clear(self):
+        self._items.clear()
+
+
+class UserMiddleware(BaseMiddleware):
+    """Загружает пользователя один раз на апдейт и кладёт его в data["user"]."""
+
+    def __init__(self, loader):
+        super().__init__()
+        self.loader = loader  # async (user_id) -> Record | None
+
+    async def __call__(self, handler, event, data):
+        if isinstance(event, (types.Message, types.CallbackQuery)) and event.from_user:
+            data["user"] = await self.loader(event.from_user.id)
+        return await handler(event, data)
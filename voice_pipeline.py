@@ -0,0 +1,90 @@
+import io
+import logging
+import tempfile
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from aiogram import Bot
+
+from metrics import metrics
+
+# Голосовые до этого размера скачиваются в память, крупнее — во временный файл
+MAX_IN_MEMORY_BYTES = 5 * 1024 * 1024
+
+
+@asynccontextmanager
+async def open_voice(bot: Bot, file_path: str, file_size: int = None, max_in_memory: int = MAX_IN_MEMORY_BYTES):
+    """
+    Скачивает голосовое и отдаёт (имя, файловый объект) для transcribe.
+    Обычно всё происходит в памяти; очень большие файлы пишутся в безымянный
+    временный файл, который удаляется при выходе из контекста — даже при ошибке.
+    """
+    if file_size and file_size > max_in_memory:
+        metrics.inc("voice_downloads_disk")
+        with tempfile.TemporaryFile(suffix=".ogg") as tmp:
+            await bot.download_file(file_path, destination=tmp)
+            yield ("voice.ogg", tmp)
+    else:
+        metrics.inc("voice_downloads_memory")
+        buffer = io.BytesIO()
+        await bot.download_file(file_path, destination=buffer)
+        yield ("voice.ogg", buffer)
+
+
+class TranscriptCache:
+    """
+    Расшифровки голосовых по file_unique_id: LRU в памяти, затем таблица transcripts.
+    file_unique_id один и тот же у всех пересланных копий сообщения, поэтому
+    одно и то же голосовое в Whisper уходит один раз.
+    """
+
+    def __init__(self, max_entries: int = 5000):
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._pool = None
+
+    def attach_pool(self, pool):
+        self._pool = pool
+
+    async def get(self, file_unique_id: str):
+        text = self._entries.get(file_unique_id)
+        if text is not None:
+            self._entries.move_to_end(file_unique_id)
+            metrics.inc("transcript_cache_hits")
+            return text
+        if self._pool:
+            try:
+                async with self._pool.acquire() as conn:
+                    text = await conn.fetchval(
+                        "SELECT text FROM transcripts WHERE file_unique_id = $1", file_unique_id
+                    )
+            except Exception as e:
+                logging.warning(f"[Transcripts] Не удалось прочитать расшифровку {file_unique_id}: {e}")
+        if text is None:
+            metrics.inc("transcript_cache_misses")
+            return None
+        metrics.inc("transcript_cache_hits")
+        self._remember(file_unique_id, text)
+        return text
+
+    async def set(self, file_unique_id: str, text: str):
+        if not text:
+            return
+        self._remember(file_unique_id, text)
+        if not self._pool:
+            return
+        try:
+            async with self._pool.acquire() as conn:
+                await conn.execute('''
+                    INSERT INTO transcripts (file_unique_id, text)
+                    VALUES ($1, $2)
+                    ON CONFLICT (file_unique_id) DO NOTHING
+                ''', file_unique_id, text)
+        except Exception as e:
+            logging.warning(f"[Transcripts] Не удалось сохранить расшифровку {file_unique_id}: {e}")
+
+    def _remember(self, file_unique_id: str, text: str):
+        self._entries[file_unique_id] = text
+        self._entries.move_to_end(file_unique_id)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
@@ -0,0 +1,151 @@
+import asyncio
+import hmac
+import logging
+import time
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from metrics import metrics
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+async def ensure_webhook(bot: Bot, url: str, secret: str) -> bool:
+    """
+    Ставит webhook, только если Telegram знает другой адрес или отвергает наш секрет
+    (сам секрет getWebhookInfo не возвращает — видно лишь 401 в last_error_message).
+    Очередь апдейтов не сбрасывается: реплики при деплое не стирают её друг другу.
+    Возвращает True, если webhook пришлось переустановить.
+    """
+    info = await bot.get_webhook_info()
+    if info.url == url and "401" not in (info.last_error_message or ""):
+        return False
+    await bot.set_webhook(url=url, secret_token=secret)
+    logging.info(f"[Webhook] Webhook установлен на {url}")
+    return True
+
+
+class WebhookServer:
+    """
+    aiohttp-сервер для режима webhook.
+
+    Апдейты складываются в ограниченную очередь и разбираются пулом воркеров.
+    Если очередь заполнена, отвечаем 503 — Telegram повторит доставку позже,
+    а процесс не раздувается под нагрузкой (backpressure).
+
+    /metrics на публичном порту отдаётся только с заголовком
+    Authorization: Bearer <secret>. Если задан metrics_port, метрики вместо этого
+    слушаются отдельно на metrics_host (по умолчанию 127.0.0.1) без авторизации,
+    а с публичного порта убираются.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, secret: str, path: str = "/webhook",
+                 queue_size: int = 1000, workers: int = 32,
+                 metrics_host: str = "127.0.0.1", metrics_port: int = None):
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret
+        self.path = path
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.workers = workers
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+        self._worker_tasks = []
+        self._runner = None
+        self._metrics_runner = None
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/health", self.handle_health)
+        if not self.metrics_port:
+            app.router.add_get("/metrics", self.handle_protected_metrics)
+        app.on_startup.append(self._start_workers)
+        app.on_cleanup.append(self._stop_workers)
+        return app
+
+    def build_metrics_app(self) -> web.Application:
+        """Приложение для отдельного (внутреннего) адреса метрик."""
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        return app
+
+    def _authorized(self, token: str) -> bool:
+        return bool(self.secret) and hmac.compare_digest(token, self.secret)
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if not self._authorized(request.headers.get(SECRET_HEADER, "")):
+            metrics.inc("webhook_unauthorized")
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            logging.warning(f"[Webhook] Некорректный апдейт: {e}")
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait((time.monotonic(), update))
+        except asyncio.QueueFull:
+            metrics.inc("webhook_rejected_queue_full")
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        metrics.inc("webhook_updates_received")
+        metrics.set_gauge("webhook_queue_depth", self.queue.qsize())
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "status": "ok",
+            "queue": self.queue.qsize(),
+            "queue_limit": self.queue.maxsize,
+            "workers": sum(1 for t in self._worker_tasks if not t.done()),
+        })
+
+    async def handle_protected_metrics(self, request: web.Request) -> web.Response:
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not self._authorized(token.strip()):
+            metrics.inc("metrics_unauthorized")
+            return web.Response(status=401, headers={"WWW-Authenticate": "Bearer"})
+        return await self.handle_metrics(request)
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render_text() + "\n")
+
+    async def _worker(self):
+        while True:
+            enqueued_at, update = await self.queue.get()
+            metrics.observe("webhook_queue_wait_seconds", time.monotonic() - enqueued_at)
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                logging.exception(f"[Webhook] Ошибка обработки апдейта {update.update_id}: {e}")
+            finally:
+                self.queue.task_done()
+                metrics.set_gauge("webhook_queue_depth", self.queue.qsize())
+
+    async def _start_workers(self, app=None):
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _stop_workers(self, app=None):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    async def serve(self, host: str, port: int):
+        """Запускает сервер и блокируется до отмены."""
+        self._runner = web.AppRunner(self.build_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logging.info(f"[Webhook] Слушаем http://{host}:{port}{self.path}")
+        if self.metrics_port:
+            self._metrics_runner = web.AppRunner(self.build_metrics_app())
+            await self._metrics_runner.setup()
+            await web.TCPSite(self._metrics_runner, self.metrics_host, self.metrics_port).start()
+            logging.info(f"[Webhook] Метрики: http://{self.metrics_host}:{self.metrics_port}/metrics")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            if self._metrics_runner:
+                await self._metrics_runner.cleanup()
+            await self._runner.cleanup()